@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+長時間問診的每輪延遲：完整歷史 vs token 預算視窗 + 滾動摘要
+
+以固定腳本進行 N 輪問診，記錄每輪送出的訊息數、估計的 prompt token 數與回應延遲。
+
+用法：
+    python scripts/benchmark_context.py                       # 使用設定中的 AI 服務（例如 Ollama）
+    python scripts/benchmark_context.py --turns 60 --mock     # 使用模擬 AI 服務（只比較 prompt 大小）
+    python scripts/benchmark_context.py --budget 3072 --keep-turns 6
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from statistics import mean
+
+# 添加專案根目錄到 Python 路徑
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.config.settings import get_settings
+from src.models.conversation import MessageRole
+from src.services.ai_service import AIServiceFactory, AIProvider
+from src.services.case_service import CaseService
+from src.services.context_window import estimate_message_tokens
+from src.services.conversation_service import ConversationService
+
+
+# 學生的問診腳本，不足的輪數依序重複
+SCRIPTED_QUESTIONS = [
+    "你好，我是今天負責的醫學生，請問怎麼稱呼？",
+    "今天哪裡不舒服？",
+    "胸痛是什麼時候開始的？",
+    "可以描述一下是怎樣的痛嗎？悶痛還是刺痛？",
+    "痛的位置在哪裡？會不會痛到其他地方？",
+    "痛的程度從 0 到 10 分大概幾分？",
+    "有沒有什麼情況會讓它更痛或比較舒緩？",
+    "有冒冷汗、喘或噁心嗎？",
+    "以前有發生過類似的情況嗎？",
+    "有高血壓、糖尿病或高血脂嗎？",
+    "平常有在吃什麼藥嗎？",
+    "有抽菸或喝酒的習慣嗎？",
+    "家裡有人有心臟病嗎？",
+    "我先幫你測量生命徵象。",
+    "我幫你做心電圖 ECG。",
+    "抽血檢查心肌酵素 Troponin。",
+    "先給你含一顆 NTG，現在感覺怎麼樣？",
+    "胸口還是很悶嗎？",
+    "有對什麼藥物過敏嗎？",
+    "最近有沒有長時間坐車或手術？",
+]
+
+
+def run_conversation(service: ConversationService, turns: int) -> list:
+    """進行 N 輪問診，返回每輪的 (訊息數, 估計 token 數, 延遲秒數)"""
+    _, conversation_id = service.create_conversation(service.settings.default_case_id)
+    conversation = service.get_conversation(conversation_id)
+    case = service.case_service.get_case(conversation.case_id)
+
+    results = []
+    for turn in range(turns):
+        service.add_message(conversation_id, MessageRole.USER, SCRIPTED_QUESTIONS[turn % len(SCRIPTED_QUESTIONS)])
+        prompt = service.context_manager.build_messages(
+            conversation.case_id, case.get_system_prompt(), conversation.messages
+        )
+        start = time.perf_counter()
+        reply = service.generate_ai_response(conversation_id)
+        results.append((len(prompt), estimate_message_tokens(prompt), time.perf_counter() - start))
+        service.add_message(conversation_id, MessageRole.ASSISTANT, reply or "")
+    return results
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="ClinicSim-AI 長時間問診延遲基準測試")
+    parser.add_argument("--turns", type=int, default=60, help="問診輪數")
+    parser.add_argument("--mock", action="store_true", help="使用模擬 AI 服務")
+    parser.add_argument("--budget", type=int, default=None, help="token 預算（預設依設定）")
+    parser.add_argument("--keep-turns", type=int, default=None, help="以原文保留的輪數（預設依設定）")
+    args = parser.parse_args()
+
+    settings = get_settings()
+    ai_service = (
+        AIServiceFactory.create_service(AIProvider.MOCK) if args.mock
+        else AIServiceFactory.create_from_config(settings)
+    )
+    windowed = {
+        "context_token_budget": args.budget if args.budget is not None else settings.context_token_budget,
+        "context_keep_turns": args.keep_turns if args.keep_turns is not None else settings.context_keep_turns,
+        "context_summary_enabled": True
+    }
+    modes = {
+        "完整歷史": {"context_token_budget": 0, "context_summary_enabled": False},
+        "預算視窗 + 摘要": windowed
+    }
+    print(f"AI 服務: {type(ai_service).__name__}，輪數: {args.turns}，"
+          f"預算: {windowed['context_token_budget']} tokens，保留 {windowed['context_keep_turns']} 輪")
+
+    all_results = {}
+    for name, overrides in modes.items():
+        mode_settings = settings.model_copy(update={"response_cache_enabled": False, **overrides})
+        service = ConversationService(mode_settings, CaseService(mode_settings), ai_service)
+        all_results[name] = run_conversation(service, args.turns)
+
+    names = list(all_results)
+    print(f"\n{'輪':>4} | " + " | ".join(f"{name:^26}" for name in names))
+    print(f"{'':>4} | " + " | ".join(f"{'訊息':>6} {'tokens':>8} {'延遲 ms':>9}" for _ in names))
+    for turn in range(args.turns):
+        cells = []
+        for name in names:
+            count, tokens, seconds = all_results[name][turn]
+            cells.append(f"{count:>6} {tokens:>8} {seconds * 1000:>9.1f}")
+        print(f"{turn + 1:>4} | " + " | ".join(cells))
+
+    print()
+    for name in names:
+        results = all_results[name]
+        last = results[-10:]
+        print(f"{name}: 平均延遲 {mean(r[2] for r in results) * 1000:.1f} ms，"
+              f"最後 10 輪平均 {mean(r[2] for r in last) * 1000:.1f} ms，"
+              f"最大 prompt {max(r[1] for r in results)} tokens")
+
+
+if __name__ == "__main__":
+    main()
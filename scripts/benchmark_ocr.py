@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+批次 OCR 效能基準測試：images/s 與工作行程數的關係
+
+用法：
+    python scripts/benchmark_ocr.py                          # 使用 documents/ 中的圖片
+    python scripts/benchmark_ocr.py --images documents/CaseStudy --workers 1 2 4 8
+    python scripts/benchmark_ocr.py --max-side 1600 --tile-size 1024
+"""
+
+import os
+import sys
+import time
+import argparse
+import importlib.util
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.utils.image_processor import ImageProcessor
+
+
+def default_worker_counts() -> list:
+    """1, 2, 4, ... 直到 CPU 核心數"""
+    cpu_count = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cpu_count:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpu_count:
+        counts.append(cpu_count)
+    return counts
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="ClinicSim-AI 批次 OCR 效能基準測試")
+    parser.add_argument("--images", default="documents", help="圖片目錄（遞迴搜尋）")
+    parser.add_argument("--workers", type=int, nargs="+", help="要測試的工作行程數（預設 1, 2, 4, ... CPU 核心數）")
+    parser.add_argument("--max-side", type=int, default=None, help="長邊縮小上限（預設依設定）")
+    parser.add_argument("--tile-size", type=int, default=None, help="切片大小（預設依設定）")
+    parser.add_argument("--limit", type=int, default=0, help="最多使用幾張圖片，0 表示全部")
+    args = parser.parse_args()
+
+    if importlib.util.find_spec("easyocr") is None:
+        print("❌ 需要安裝 easyocr 才能執行 OCR 基準測試")
+        sys.exit(1)
+
+    probe = ImageProcessor(use_cache=False)
+    image_paths = sorted(
+        path for path in Path(args.images).rglob("*")
+        if path.is_file() and path.suffix.lower() in probe.get_supported_formats()
+    )
+    if args.limit:
+        image_paths = image_paths[:args.limit]
+    if not image_paths:
+        print(f"❌ 在 {args.images} 中找不到圖片")
+        sys.exit(1)
+
+    print(f"圖片: {len(image_paths)} 張（{args.images}），CPU 核心數: {os.cpu_count()}")
+    print("每次測試皆停用 OCR 快取；耗時包含工作行程啟動與 Reader 初始化")
+
+    rows = []
+    for workers in args.workers or default_worker_counts():
+        processor = ImageProcessor(use_cache=False, max_side=args.max_side, tile_size=args.tile_size)
+        started_at = time.perf_counter()
+        texts = processor.extract_text_batch(image_paths, workers=workers)
+        elapsed = time.perf_counter() - started_at
+        rows.append((workers, elapsed, sum(1 for text in texts if text)))
+
+    baseline = rows[0][1]
+    print(f"\n📊 processor: max_side={processor.max_side}, tile_size={processor.tile_size}")
+    print(f"{'workers':>8}{'seconds':>12}{'images/s':>12}{'speedup':>10}{'with text':>12}")
+    print("-" * 54)
+    for workers, elapsed, recognized in rows:
+        print(f"{workers:>8}{elapsed:>12.1f}{len(image_paths) / elapsed:>12.2f}"
+              f"{baseline / elapsed:>9.2f}x{recognized:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+RAG 檢索效能基準測試
+
+用法：
+    python scripts/benchmark_rag.py engine                   # 使用 faiss_index/ 中的索引
+    python scripts/benchmark_rag.py engine --synthetic 20000 # 使用合成索引（不需 embedding 模型）
+    python scripts/benchmark_rag.py recall --scale-to 100000 # 近似索引 recall / 延遲曲線（真實查詢詞彙）
+    python scripts/benchmark_rag.py memory --workers 8       # 多 worker 時每個行程的 RSS / PSS（一般載入 vs mmap）
+    python scripts/benchmark_rag.py format                   # 每個 chunk 的相關性過濾與引註格式化成本
+"""
+
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing
+import tracemalloc
+from pathlib import Path
+from statistics import mean, median
+
+import numpy as np
+
+# 添加專案根目錄到 Python 路徑
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.config.settings import get_settings
+from src.config.keyword_registry import get_keyword_registry
+from src.services.rag_engine import (
+    ChunkStore, FaissRetrievalEngine, CHUNK_STORE_DIRNAME,
+    build_faiss_index, configure_search_params, describe_index, is_inner_product_index
+)
+from src.services.rag_service import RAGService, get_rag_query_vocabulary
+from src.services.rag_segments import SegmentStore
+
+
+def build_synthetic_index(directory: Path, num_chunks: int, dimension: int, seed: int = 0) -> None:
+    """建立合成索引（langchain 格式 + chunk 儲存），模擬真實的 chunk 長度"""
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.embeddings import FakeEmbeddings
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((num_chunks, dimension)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+
+    index = faiss.IndexFlatL2(dimension)
+    index.add(vectors)
+
+    sentence = "急性胸痛病人應在十分鐘內完成12導程心電圖檢查，並抽血檢驗心肌鈣蛋白。"
+    docs = {}
+    index_to_docstore_id = {}
+    for i in range(num_chunks):
+        doc_id = f"chunk-{i}"
+        docs[doc_id] = Document(
+            page_content=sentence * 10,
+            metadata={"source": f"documents/Synthetic/doc_{i % 50}.pdf", "page": i % 30}
+        )
+        index_to_docstore_id[i] = doc_id
+
+    vector_store = FAISS(FakeEmbeddings(size=dimension), index, InMemoryDocstore(docs), index_to_docstore_id)
+    vector_store.save_local(str(directory))
+    ChunkStore.from_langchain(vector_store).save(directory / CHUNK_STORE_DIRNAME)
+
+
+def sample_query_vectors(index, num_queries: int, seed: int = 1) -> np.ndarray:
+    """以索引中的向量加上雜訊作為查詢向量（免載入 embedding 模型）"""
+    import faiss
+
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(0, index.ntotal, size=num_queries)
+    queries = np.stack([index.reconstruct(int(i)) for i in ids])
+    queries += rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def measure(search_fn, query_vectors: np.ndarray, warmup: int = 5) -> dict:
+    """逐筆查詢，量測延遲與記憶體配置峰值"""
+    for vector in query_vectors[:warmup]:
+        search_fn(vector)
+
+    latencies = []
+    peaks = []
+    tracemalloc.start()
+    for vector in query_vectors:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        started_at = time.perf_counter()
+        search_fn(vector)
+        latencies.append((time.perf_counter() - started_at) * 1e6)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "p50_us": median(latencies),
+        "p95_us": latencies[int(len(latencies) * 0.95) - 1],
+        "alloc_kib": mean(peaks) / 1024
+    }
+
+
+def print_rows(title: str, rows: list) -> None:
+    """輸出結果表格"""
+    print(f"\n📊 {title}")
+    print(f"{'backend':<38}{'p50 (µs)':>12}{'p95 (µs)':>12}{'alloc peak (KiB)':>20}")
+    print("-" * 82)
+    for name, result in rows:
+        print(f"{name:<38}{result['p50_us']:>12.1f}{result['p95_us']:>12.1f}{result['alloc_kib']:>20.1f}")
+
+
+def run_engine_benchmark(index_dir: Path, num_queries: int, k: int) -> None:
+    """比較 langchain FAISS 包裝與直接檢索引擎的單一查詢延遲與記憶體配置"""
+    from langchain_community.embeddings import FakeEmbeddings
+    from langchain_community.vectorstores import FAISS
+
+    engine = FaissRetrievalEngine.load(index_dir)
+    vector_store = FAISS.load_local(
+        str(index_dir), FakeEmbeddings(size=engine.index.d), allow_dangerous_deserialization=True
+    )
+    query_vectors = sample_query_vectors(engine.index, num_queries)
+
+    print(f"索引: {index_dir}（{engine.index.ntotal} 個向量，維度 {engine.index.d}），k={k}，查詢數={num_queries}")
+
+    rows = [
+        ("langchain similarity_search", measure(
+            lambda vector: vector_store.similarity_search_with_score_by_vector(vector.tolist(), k=k),
+            query_vectors
+        )),
+        ("faiss engine (ids only)", measure(
+            lambda vector: engine.search(vector[None, :], k),
+            query_vectors
+        )),
+        ("faiss engine (with chunks)", measure(
+            lambda vector: engine.search_chunks(vector[None, :], k),
+            query_vectors
+        )),
+    ]
+    print_rows("單一查詢延遲與記憶體配置", rows)
+
+
+HNSW_EF_SEARCH_VALUES = (16, 32, 64, 128, 256)
+IVF_NPROBE_VALUES = (1, 4, 8, 16, 32, 64)
+
+
+def load_base_vectors(index_dir: Path, scale_to: int, seed: int = 2) -> tuple:
+    """取出索引中的所有向量；scale_to 大於向量數時以加雜訊的複本擴充，模擬更大的知識庫"""
+    import faiss
+
+    index = faiss.read_index(str(index_dir / "index.faiss"))
+    metric = "ip" if is_inner_product_index(index) else "l2"
+    vectors = index.reconstruct_n(0, index.ntotal)
+
+    if scale_to > len(vectors):
+        rng = np.random.default_rng(seed)
+        ids = rng.integers(0, len(vectors), size=scale_to - len(vectors))
+        extra = vectors[ids] + rng.normal(scale=0.05, size=(len(ids), vectors.shape[1])).astype(np.float32)
+        faiss.normalize_L2(extra)
+        vectors = np.vstack([vectors, extra])
+    return np.ascontiguousarray(vectors, dtype=np.float32), metric
+
+
+def embed_vocabulary_queries(dimension: int):
+    """以 embedding 模型計算 generate_rag_queries 的真實查詢詞彙，模型不可用時返回 None"""
+    try:
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(
+            model_name=get_settings().rag_model_name,
+            model_kwargs={'trust_remote_code': True},
+            encode_kwargs={'normalize_embeddings': True}
+        )
+        vectors = np.asarray(embeddings.embed_documents(get_rag_query_vocabulary()), dtype=np.float32)
+    except Exception as e:
+        print(f"⚠️ 無法載入 embedding 模型（{e}），改用索引向量加雜訊作為查詢")
+        return None
+
+    if vectors.shape[1] != dimension:
+        print(f"⚠️ 查詢向量維度 ({vectors.shape[1]}) 與索引維度 ({dimension}) 不符，改用索引向量加雜訊作為查詢")
+        return None
+    return vectors
+
+
+def recall_at_k(result_ids: np.ndarray, truth_ids: np.ndarray) -> float:
+    """平均 recall@k（以精確搜尋結果為基準）"""
+    hits = [len(set(row) & set(truth)) / len(truth) for row, truth in zip(result_ids, truth_ids)]
+    return float(mean(hits))
+
+
+def run_recall_benchmark(index_dir: Path, scale_to: int, k: int, use_model: bool, num_queries: int) -> None:
+    """近似索引（HNSW、IVF-PQ）相對於平面索引的 recall@k 與單一查詢延遲"""
+    vectors, metric = load_base_vectors(index_dir, scale_to)
+    flat_index = build_faiss_index(vectors, metric=metric)
+
+    query_vectors = embed_vocabulary_queries(vectors.shape[1]) if use_model else None
+    query_source = "generate_rag_queries 查詢詞彙"
+    if query_vectors is None:
+        query_vectors = sample_query_vectors(flat_index, num_queries)
+        query_source = "索引向量加雜訊"
+
+    _, truth_ids = flat_index.search(query_vectors, k)
+    print(f"向量數={len(vectors)}，維度={vectors.shape[1]}，度量={metric}，k={k}，"
+          f"查詢={len(query_vectors)} 筆（{query_source}）")
+
+    def evaluate(name: str, index) -> tuple:
+        _, result_ids = index.search(query_vectors, k)
+        timing = measure(lambda vector: index.search(vector[None, :], k), query_vectors)
+        return name, recall_at_k(result_ids, truth_ids), timing
+
+    rows = [evaluate("flat", flat_index)]
+    builds = []
+
+    started_at = time.perf_counter()
+    hnsw_index = build_faiss_index(vectors, metric=metric, index_type="hnsw")
+    builds.append(("hnsw", time.perf_counter() - started_at))
+    for ef_search in HNSW_EF_SEARCH_VALUES:
+        configure_search_params(hnsw_index, hnsw_ef_search=ef_search, ivf_nprobe=0)
+        rows.append(evaluate(f"hnsw efSearch={ef_search}", hnsw_index))
+
+    started_at = time.perf_counter()
+    ivf_index = build_faiss_index(vectors, metric=metric, index_type="ivfpq")
+    builds.append(("ivfpq", time.perf_counter() - started_at))
+    if describe_index(ivf_index) == "ivfpq":  # 向量數過少時會退回平面索引
+        for nprobe in IVF_NPROBE_VALUES:
+            configure_search_params(ivf_index, hnsw_ef_search=0, ivf_nprobe=nprobe)
+            rows.append(evaluate(f"ivfpq nprobe={nprobe}", ivf_index))
+
+    print(f"\n📊 recall@{k} 與單一查詢延遲")
+    print(f"{'index':<28}{'recall':>10}{'p50 (µs)':>12}{'p95 (µs)':>12}")
+    print("-" * 62)
+    for name, recall, timing in rows:
+        print(f"{name:<28}{recall:>10.3f}{timing['p50_us']:>12.1f}{timing['p95_us']:>12.1f}")
+
+    print("\n⏱️ 建立時間")
+    for name, seconds in builds:
+        print(f"{name:<28}{seconds:>10.2f} s")
+
+
+def read_process_memory() -> dict:
+    """讀取目前行程的記憶體用量（KiB）：RSS、私有匿名頁、檔案映射頁與 PSS（共用頁按行程數均攤）"""
+    memory = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                memory[key] = int(value.split()[0])
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                memory["Pss"] = int(line.split()[1])
+    return memory
+
+
+def memory_worker(index_dir: str, use_mmap: bool, num_queries: int, k: int, barrier, results) -> None:
+    """模擬一個 worker：載入檢索引擎、執行查詢，等所有 worker 都載入後回報記憶體用量"""
+    engine = FaissRetrievalEngine.load(Path(index_dir), use_mmap=use_mmap)
+    for row in engine.search_chunks(sample_query_vectors(engine.index, num_queries), k):
+        for chunk, _ in row:
+            chunk.text
+    barrier.wait()
+    results.put(read_process_memory())
+    barrier.wait()
+
+
+def run_memory_benchmark(index_dir: Path, num_workers: int, num_queries: int, k: int) -> None:
+    """比較一般載入與記憶體映射載入時，多個 worker 行程的記憶體用量"""
+    if not Path("/proc/self/smaps_rollup").exists():
+        print("❌ 需要 Linux /proc/self/smaps_rollup 才能量測 PSS")
+        sys.exit(1)
+
+    index_bytes = (index_dir / "index.faiss").stat().st_size
+    chunk_bytes = sum(path.stat().st_size for path in (index_dir / CHUNK_STORE_DIRNAME).iterdir())
+    print(f"索引: {index_dir}（index.faiss {index_bytes / 2**20:.1f} MiB，chunk 儲存 {chunk_bytes / 2**20:.1f} MiB），"
+          f"worker 數={num_workers}")
+
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for use_mmap in (False, True):
+        barrier = context.Barrier(num_workers + 1)
+        results = context.Queue()
+        workers = [
+            context.Process(target=memory_worker, args=(str(index_dir), use_mmap, num_queries, k, barrier, results))
+            for _ in range(num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        samples = [results.get() for _ in workers]
+        barrier.wait()
+        for worker in workers:
+            worker.join()
+        rows.append(("mmap" if use_mmap else "private copy", samples))
+
+    print(f"\n📊 每個 worker 的記憶體用量（MiB，{num_workers} 個 worker 的平均）")
+    print(f"{'load mode':<16}{'RSS':>10}{'anon':>10}{'file':>10}{'PSS':>10}{'total PSS':>12}")
+    print("-" * 68)
+    for name, samples in rows:
+        average = {key: mean(sample[key] for sample in samples) / 1024 for key in samples[0]}
+        total_pss = sum(sample["Pss"] for sample in samples) / 1024
+        print(f"{name:<16}{average['VmRSS']:>10.1f}{average['RssAnon']:>10.1f}{average['RssFile']:>10.1f}"
+              f"{average['Pss']:>10.1f}{total_pss:>12.1f}")
+
+
+def run_format_benchmark(index_dir: Path, num_chunks: int) -> None:
+    """量測每個 chunk 的相關性過濾與引註格式化成本（查詢使用真實查詢詞彙）"""
+    store = ChunkStore.load(index_dir / CHUNK_STORE_DIRNAME)
+    queries = get_rag_query_vocabulary()
+    pairs = [(store.get(i), queries[i % len(queries)]) for i in range(min(num_chunks, len(store)))]
+
+    # 只使用格式化方法，不載入 embedding 模型與索引
+    service = RAGService.__new__(RAGService)
+    service.segments = None
+    registry = get_keyword_registry()
+
+    # 建立索引時預計算的清理與斷句結果
+    started_at = time.perf_counter()
+    segments = SegmentStore.from_chunk_store(store, registry.document_title_markers)
+    build_seconds = time.perf_counter() - started_at
+    precomputed = RAGService.__new__(RAGService)
+    precomputed.segments = segments
+
+    def cold_relevance(pair):
+        # 模擬每個 chunk 都重新建立關鍵字表與比對器
+        registry.relevance_matcher.cache_clear()
+        service._is_content_relevant(pair[0].text, pair[1])
+
+    print(f"chunk 儲存: {index_dir / CHUNK_STORE_DIRNAME}（{len(store)} 個 chunk），量測 {len(pairs)} 個 chunk，查詢數={len(queries)}")
+
+    rows = [
+        ("relevance (cold matcher)", measure(cold_relevance, pairs)),
+        ("relevance", measure(lambda pair: service._is_content_relevant(pair[0].text, pair[1]), pairs)),
+        ("format", measure(lambda pair: service._format_document_content(pair[0].source, pair[0].text), pairs)),
+        ("format with query", measure(
+            lambda pair: service._format_document_content_with_query(pair[0].source, pair[0].text, pair[1]),
+            pairs
+        )),
+    ]
+    # 第一次查詢需由陣列解碼，之後重複檢索到同一 chunk 時直接使用快取的解碼結果
+    format_with_segments = lambda pair: precomputed._format_document_content_with_query(
+        pair[0].source, pair[0].text, pair[1], pair[0].chunk_id
+    )
+    segments.get.cache_clear()
+    rows.append(("format with query (segments, first)", measure(format_with_segments, pairs)))
+    rows.append(("format with query (segments, cached)", measure(format_with_segments, pairs)))
+    print_rows("每個 chunk 的處理成本", rows)
+    print(f"\n預計算 {len(store)} 個 chunk 的清理與斷句耗時 {build_seconds:.2f}s")
+
+
+def resolve_index_dir(args, temp_dir: Path) -> Path:
+    """取得要測試的索引目錄（必要時建立合成索引）"""
+    if args.synthetic:
+        index_dir = temp_dir / "synthetic_index"
+        print(f"正在建立合成索引（{args.synthetic} 個 chunk，維度 {args.dim}）...")
+        build_synthetic_index(index_dir, args.synthetic, args.dim)
+        return index_dir
+
+    index_dir = Path(args.index_dir) if args.index_dir else get_settings().faiss_index_dir
+    if not ChunkStore.exists(index_dir / CHUNK_STORE_DIRNAME):
+        print(f"❌ 找不到 chunk 儲存: {index_dir / CHUNK_STORE_DIRNAME}，請先執行 build_index.py 或使用 --synthetic")
+        sys.exit(1)
+    return index_dir
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="ClinicSim-AI RAG 檢索效能基準測試")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    engine_parser = subparsers.add_parser("engine", help="langchain 包裝 vs FAISS 直接檢索引擎")
+    engine_parser.add_argument("--queries", type=int, default=200, help="查詢數量")
+    engine_parser.add_argument("-k", type=int, default=6, help="每個查詢取回的候選數量")
+
+    recall_parser = subparsers.add_parser("recall", help="HNSW / IVF-PQ 的 recall 與延遲曲線")
+    recall_parser.add_argument("--scale-to", type=int, default=0, help="以加雜訊的複本將向量數擴充到 N")
+    recall_parser.add_argument("--queries", type=int, default=200, help="無 embedding 模型時的合成查詢數量")
+    recall_parser.add_argument("-k", type=int, default=6, help="recall@k 的 k")
+    recall_parser.add_argument("--no-model", action="store_true", help="不載入 embedding 模型，以索引向量加雜訊作為查詢")
+
+    memory_parser = subparsers.add_parser("memory", help="多 worker 行程的 RSS / PSS：一般載入 vs mmap")
+    memory_parser.add_argument("--workers", type=int, default=4, help="worker 行程數")
+    memory_parser.add_argument("--queries", type=int, default=50, help="每個 worker 載入後執行的查詢數量")
+    memory_parser.add_argument("-k", type=int, default=6, help="每個查詢取回的候選數量")
+
+    format_parser = subparsers.add_parser("format", help="每個 chunk 的相關性過濾與引註格式化成本")
+    format_parser.add_argument("--chunks", type=int, default=2000, help="量測的 chunk 數量")
+
+    for sub in (engine_parser, recall_parser, memory_parser, format_parser):
+        sub.add_argument("--index-dir", help="索引目錄（預設為設定中的 faiss_index_dir）")
+        sub.add_argument("--synthetic", type=int, default=0, help="改用 N 個 chunk 的合成索引")
+        sub.add_argument("--dim", type=int, default=768, help="合成索引的向量維度")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_dir = resolve_index_dir(args, Path(temp_dir))
+        if args.command == "engine":
+            run_engine_benchmark(index_dir, args.queries, args.k)
+        elif args.command == "recall":
+            run_recall_benchmark(index_dir, args.scale_to, args.k, not args.no_model, args.queries)
+        elif args.command == "memory":
+            run_memory_benchmark(index_dir, args.workers, args.queries, args.k)
+        elif args.command == "format":
+            run_format_benchmark(index_dir, args.chunks)
+
+
+if __name__ == "__main__":
+    main()
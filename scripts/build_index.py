@@ -1,91 +1,148 @@
 import os
 import sys
+import shutil
+import time
+import uuid
+import argparse
 from pathlib import Path
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.document_loaders import PyMuPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 
-# 添加 src 目錄到 Python 路徑
-sys.path.insert(0, str(Path(__file__).parent / "src"))
+# 添加專案根目錄到 Python 路徑
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from src.utils.image_processor import process_images_in_directory
+from src.config.settings import get_settings
+from src.config.keyword_registry import get_keyword_registry
+from src.services.rag_service import RAGService
+from src.services.rag_engine import ChunkStore, CHUNK_STORE_DIRNAME, build_faiss_index, describe_index
+from src.services.rag_segments import SegmentStore, SEGMENTS_DIRNAME
+from src.services.rag_lexical import BM25Index, LEXICAL_INDEX_DIRNAME
+from src.services.rag_ingestion import IngestionPipeline
+from src.services.rag_manifest import IndexManifest, MANIFEST_FILENAME
+from src.utils.file_utils import hash_file
+from src.services.report_service import get_feedback_query_vocabulary, REPORT_RAG_K
 
 # --- 設定 ---
 DOCUMENTS_PATH = "documents"  # 將你的 PDF、TXT 檔案放在這裡
 INDEX_PATH = "faiss_index"    # 向量資料庫儲存路徑
 EMBEDDING_MODEL = "nomic-ai/nomic-embed-text-v1.5" # 中英雙語皆表現優異的開源模型
+CHUNK_SIZE = 400      # 較小的 chunk 以提高精準度
+CHUNK_OVERLAP = 50
 
-def build_index():
-    """
-    讀取 documents 資料夾中的所有文件，將其轉換為向量並建立 FAISS 索引。
-    這是一個一次性的過程，在開發前運行即可。
+TEXT_SUFFIXES = {'.txt', '.md'}
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif'}
+
+def create_faiss_index_from_settings(vectors: np.ndarray, settings):
+    """依設定建立 FAISS 索引（flat / hnsw / ivfpq）
+
+    embedding 向量皆已正規化，metric="ip" 時內積即為餘弦相似度。
     """
-    print("--- 開始建立 RAG 向量索引 ---")
-    
-    if not os.path.exists(DOCUMENTS_PATH):
-        os.makedirs(DOCUMENTS_PATH)
-        print(f"已建立 '{DOCUMENTS_PATH}' 資料夾，請將你的 PDF、TXT 文件放入其中後再執行一次。")
-        return
+    return build_faiss_index(
+        vectors,
+        metric=settings.rag_index_metric,
+        index_type=settings.rag_index_type,
+        hnsw_m=settings.rag_hnsw_m,
+        hnsw_ef_construction=settings.rag_hnsw_ef_construction,
+        ivf_nlist=settings.rag_ivf_nlist,
+        ivf_pq_m=settings.rag_ivf_pq_m
+    )
+
+def create_vector_store(chunks, index, embeddings, metric: str, doc_ids=None) -> FAISS:
+    """以已填入向量的 FAISS 索引建立 langchain FAISS 向量庫"""
+    doc_ids = doc_ids or [str(uuid.uuid4()) for _ in chunks]
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(doc_ids, chunks))),
+        index_to_docstore_id=dict(enumerate(doc_ids)),
+        distance_strategy=(
+            DistanceStrategy.MAX_INNER_PRODUCT if metric == "ip" else DistanceStrategy.EUCLIDEAN_DISTANCE
+        )
+    )
+
+_image_processor = None
+
+def get_image_processor():
+    """延遲初始化 OCR（只有圖片需要處理時才載入 EasyOCR）"""
+    global _image_processor
+    if _image_processor is None:
+        from src.utils.image_processor import ImageProcessor
+        _image_processor = ImageProcessor()
+    return _image_processor
+
+def scan_documents(documents_path: Path) -> list:
+    """列出所有可建立索引的文件"""
+    return sorted(
+        file for file in documents_path.glob('**/*')
+        if file.is_file() and file.suffix.lower() in {'.pdf'} | TEXT_SUFFIXES | IMAGE_SUFFIXES
+    )
 
-    # 1. 載入所有文件
-    all_docs = []
-    p = Path(DOCUMENTS_PATH)
+def load_file_documents(file) -> list:
+    """載入單一文件，返回頁面層級的 Document 列表（於匯入管線的工作行程中執行）"""
+    file = Path(file)
+    suffix = file.suffix.lower()
+    if suffix == '.pdf':
+        print(f"正在載入 PDF: {file.name}")
+        loader = PyMuPDFLoader(str(file))
+        docs = loader.load()
+        # 確保每個文檔都有正確的來源資訊
+        for doc in docs:
+            # PyMuPDFLoader 會自動在 metadata 中包含 'source' 和 'page' 資訊
+            # 我們只需要確保這些資訊存在
+            if 'source' not in doc.metadata:
+                doc.metadata['source'] = str(file)
+            if 'page' not in doc.metadata:
+                doc.metadata['page'] = 0  # 預設頁碼
+            print(f"  - 頁面 {doc.metadata.get('page', 0) + 1}: {len(doc.page_content)} 字元")
+        return docs
     
-    # 載入 PDF 和文字檔案
-    for file in p.glob('**/*'):
-        if file.is_dir():
-            continue
-        try:
-            if file.suffix == '.pdf':
-                print(f"正在載入 PDF: {file.name}")
-                loader = PyMuPDFLoader(str(file))
-                docs = loader.load()
-                # 確保每個文檔都有正確的來源資訊
-                for doc in docs:
-                    # PyMuPDFLoader 會自動在 metadata 中包含 'source' 和 'page' 資訊
-                    # 我們只需要確保這些資訊存在
-                    if 'source' not in doc.metadata:
-                        doc.metadata['source'] = str(file)
-                    if 'page' not in doc.metadata:
-                        doc.metadata['page'] = 0  # 預設頁碼
-                    print(f"  - 頁面 {doc.metadata.get('page', 0) + 1}: {len(doc.page_content)} 字元")
-                all_docs.extend(docs)
-            elif file.suffix in ['.txt', '.md']:
-                print(f"正在載入文字檔: {file.name}")
-                loader = TextLoader(str(file), encoding='utf-8')
-                docs = loader.load()
-                # 為文字檔案添加來源資訊
-                for doc in docs:
-                    doc.metadata['source'] = str(file)
-                    doc.metadata['page'] = 0  # 文字檔案沒有頁碼概念
-                all_docs.extend(docs)
-        except Exception as e:
-            print(f"載入檔案 {file.name} 失敗: {e}")
-    
-    # 載入圖片檔案
-    print("\n--- 開始處理圖片檔案 ---")
-    image_docs = process_images_in_directory(p, method="easyocr")
-    all_docs.extend(image_docs)
-
-    if not all_docs:
-        print(f"在 '{DOCUMENTS_PATH}' 資料夾中找不到任何可讀取的文件。")
-        return
-        
-    print(f"文件載入完成，共 {len(all_docs)} 頁。開始切塊...")
+    if suffix in TEXT_SUFFIXES:
+        print(f"正在載入文字檔: {file.name}")
+        loader = TextLoader(str(file), encoding='utf-8')
+        docs = loader.load()
+        # 為文字檔案添加來源資訊
+        for doc in docs:
+            doc.metadata['source'] = str(file)
+            doc.metadata['page'] = 0  # 文字檔案沒有頁碼概念
+        return docs
     
-    # 2. 切割文件 - 使用更小的chunk size以提高精準度
+    print(f"📷 正在處理圖片: {file.name}")
+    doc = get_image_processor().process_image_to_document(file, method="easyocr")
+    return [doc] if doc else []
+
+def load_image_documents(paths: list, workers: int = None) -> dict:
+    """以批次 OCR 處理圖片，返回 {路徑: Document 列表}
+
+    圖片不交給匯入管線的行程池逐檔處理：那樣每個行程各自載入 EasyOCR，並以全部核心數執行 torch，
+    互相搶占 CPU。批次 OCR 先查快取，未命中的圖片才分散到 OCR 行程池，各行程平分 torch 執行緒。
+    """
+    if not paths:
+        return {}
+    print(f"📷 正在以批次 OCR 處理 {len(paths)} 張圖片...")
+    processor = get_image_processor()
+    texts = processor.extract_text_batch([Path(path) for path in paths], method="easyocr", workers=workers)
+    documents = {}
+    for path, text in zip(paths, texts):
+        doc = processor.build_document(Path(path), text, method="easyocr")
+        documents[path] = [doc] if doc else []
+    return documents
+
+def split_and_filter(docs: list) -> list:
+    """切割文件並過濾低品質的 chunks"""
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=400,  # 減少chunk大小以提高精準度
-        chunk_overlap=50,  # 減少重疊以提高精準度
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         separators=["\n\n", "\n", "。", "！", "？", "；", "，", " ", ""]  # 更細緻的分隔符
     )
-    chunks = text_splitter.split_documents(all_docs)
-    print(f"切塊完成，共生成 {len(chunks)} 個知識片段。")
     
-    # 3. 過濾低品質的chunks
     filtered_chunks = []
-    for chunk in chunks:
+    for chunk in text_splitter.split_documents(docs):
         content = chunk.page_content.strip()
         
         # 過濾太短的chunks
@@ -101,11 +158,125 @@ def build_index():
             continue
             
         filtered_chunks.append(chunk)
+    return filtered_chunks
+
+def get_build_config(settings) -> dict:
+    """影響向量內容的建立參數；與清單記錄不同時必須完整重建"""
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "index_metric": settings.rag_index_metric,
+        "index_type": settings.rag_index_type,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+    }
+
+def remove_documents(vectorstore: FAISS, doc_ids: list, settings) -> FAISS:
+    """從向量庫刪除指定 chunk
+
+    平面索引直接使用 FAISS.delete（remove_ids 會壓縮向量位置，與 langchain 重新編號的對應一致）。
+    IVF 的 remove_ids 不會重新編號、HNSW 不支援刪除，兩者都改以保留的向量重建（不需重新 embedding）：
+    IVF 沿用已訓練的分群與量化器，清空後依序加入保留的向量；HNSW 重建圖索引。
+    """
+    existing_ids = set(vectorstore.index_to_docstore_id.values())
+    doc_ids = [doc_id for doc_id in doc_ids if doc_id in existing_ids]
+    if not doc_ids:
+        return vectorstore
+    
+    index_type = describe_index(vectorstore.index)
+    if index_type == "flat":
+        vectorstore.delete(doc_ids)
+        return vectorstore
+    
+    removed = set(doc_ids)
+    kept_positions = [
+        position for position, doc_id in sorted(vectorstore.index_to_docstore_id.items())
+        if doc_id not in removed
+    ]
+    if index_type == "ivfpq":
+        # IVF 需要直接對應表才能依位置取回向量
+        faiss.extract_index_ivf(vectorstore.index).make_direct_map()
+    vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)[kept_positions]
+    kept_ids = [vectorstore.index_to_docstore_id[position] for position in kept_positions]
+    kept_chunks = [vectorstore.docstore.search(doc_id) for doc_id in kept_ids]
+    
+    if index_type == "ivfpq":
+        index = faiss.clone_index(vectorstore.index)
+        faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.NoMap)
+        index.reset()
+        index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    else:
+        index = create_faiss_index_from_settings(vectors, settings)
+    return create_vector_store(kept_chunks, index, vectorstore.embedding_function, settings.rag_index_metric, kept_ids)
+
+def clear_index(index_dir: Path) -> bool:
+    """刪除由文件產生的索引檔案（向量索引、chunk 儲存、BM25、預計算結果與清單），返回是否有刪除
+
+    查詢 embedding 快取只與模型有關，保留供下次建立索引後沿用。
+    """
+    removed = False
+    for name in ("index.faiss", "index.pkl", "precomputed_results.json", MANIFEST_FILENAME):
+        path = index_dir / name
+        if path.exists():
+            path.unlink()
+            removed = True
+    for name in (CHUNK_STORE_DIRNAME, LEXICAL_INDEX_DIRNAME):
+        path = index_dir / name
+        if path.exists():
+            shutil.rmtree(path)
+            removed = True
+    return removed
+
+def build_index(full_rebuild: bool = False, workers: int = None, embed_batch_size: int = 64,
+                embed_workers: int = 1, queue_size: int = 8):
+    """
+    讀取 documents 資料夾中的所有文件，將其轉換為向量並建立 FAISS 索引。
+    預設為增量建立：依 manifest.json 中的檔案雜湊，只重新處理新增或變更的檔案，
+    並刪除已移除檔案的向量；full_rebuild=True 或建立參數改變時完整重建。
+    workers / embed_batch_size / embed_workers / queue_size 為匯入管線參數。
+    """
+    print("--- 開始建立 RAG 向量索引 ---")
+    started_at = time.perf_counter()
+    
+    if not os.path.exists(DOCUMENTS_PATH):
+        os.makedirs(DOCUMENTS_PATH)
+        print(f"已建立 '{DOCUMENTS_PATH}' 資料夾，請將你的 PDF、TXT 文件放入其中後再執行一次。")
+        return
+
+    settings = get_settings()
+    index_dir = Path(INDEX_PATH)
+    manifest_path = index_dir / MANIFEST_FILENAME
+    
+    # 1. 計算所有文件的內容雜湊，與上次建立的清單比較
+    files = scan_documents(Path(DOCUMENTS_PATH))
+    if not files:
+        print(f"在 '{DOCUMENTS_PATH}' 資料夾中找不到任何可讀取的文件。")
+        # 文件已全部移除時清除舊索引，避免服務繼續檢索已刪除的內容
+        if clear_index(index_dir):
+            print(f"已清除 '{INDEX_PATH}' 中的舊索引。")
+        return
+    current_hashes = {str(file): hash_file(file) for file in files}
+    
+    config = get_build_config(settings)
+    manifest = None if full_rebuild else IndexManifest.load(manifest_path)
+    incremental = (
+        manifest is not None
+        and manifest.config == config
+        and (index_dir / "index.faiss").exists()
+        and (index_dir / "index.pkl").exists()
+    )
+    if not incremental:
+        if manifest is not None:
+            print("建立參數已變更，將完整重建索引。")
+        manifest = IndexManifest(config)
     
-    chunks = filtered_chunks
-    print(f"過濾後，共保留 {len(chunks)} 個高品質知識片段。")
+    diff = manifest.diff(current_hashes)
+    if incremental and diff.is_empty():
+        print(f"索引已是最新（{len(diff.unchanged)} 個文件未變更），不需重建。")
+        return
+    print(f"新增 {len(diff.added)} 個、變更 {len(diff.changed)} 個、移除 {len(diff.removed)} 個、"
+          f"未變更 {len(diff.unchanged)} 個文件。")
 
-    # 4. 初始化 Embedding 模型
+    # 2. 初始化 Embedding 模型
     print(f"正在初始化 Embedding 模型: {EMBEDDING_MODEL} (可能需要一些時間下載)...")
     embeddings = HuggingFaceEmbeddings(
         model_name=EMBEDDING_MODEL,
@@ -113,14 +284,108 @@ def build_index():
         encode_kwargs={'normalize_embeddings': True}
     )
 
-    # 5. 建立 FAISS 索引並儲存
-    print("正在將知識片段轉換為向量並建立 FAISS 索引...")
-    vectorstore = FAISS.from_documents(chunks, embeddings)
+    # 3. 以管線處理新增或變更的文件：圖片先以批次 OCR 處理，其餘以行程池載入 → 逐檔切塊與過濾 → 批次 embedding
+    #    （切塊只依賴單一文件，結果與整批切塊相同）
+    file_chunks = {}
+    chunks = []
+    vectors = None
+    if diff.to_process:
+        pipeline = IngestionPipeline(
+            load_fn=load_file_documents,
+            split_fn=split_and_filter,
+            embed_fn=embeddings.embed_documents,
+            load_workers=workers,
+            embed_batch_size=embed_batch_size,
+            embed_workers=embed_workers,
+            queue_size=queue_size
+        )
+        image_documents = load_image_documents(
+            [path for path in diff.to_process if Path(path).suffix.lower() in IMAGE_SUFFIXES], workers
+        )
+        print(f"正在處理 {len(diff.to_process)} 個文件（載入行程 {pipeline.load_workers} 個，"
+              f"embedding 批次 {pipeline.embed_batch_size}）...")
+        result = pipeline.run(diff.to_process, preloaded=image_documents)
+        print(result.stats.report())
+        
+        file_chunks = result.file_chunks
+        chunks = [chunk for path_chunks in file_chunks.values() for chunk in path_chunks]
+        if chunks:
+            vectors = np.vstack([result.file_vectors[path] for path, path_chunks in file_chunks.items() if path_chunks])
+    
+    print(f"文件處理完成，共生成 {len(chunks)} 個高品質知識片段。")
+    if not incremental and not chunks:
+        print(f"在 '{DOCUMENTS_PATH}' 資料夾中找不到任何可讀取的文件。")
+        if clear_index(index_dir):
+            print(f"已清除 '{INDEX_PATH}' 中的舊索引。")
+        return
+    doc_ids = [str(uuid.uuid4()) for _ in chunks]
+
+    # 4. 建立或更新 FAISS 索引
+    if incremental:
+        vectorstore = FAISS.load_local(INDEX_PATH, embeddings, allow_dangerous_deserialization=True)
+        stale_ids = manifest.chunk_ids(diff.stale)
+        if stale_ids:
+            print(f"正在從索引刪除 {len(stale_ids)} 個舊的知識片段...")
+            vectorstore = remove_documents(vectorstore, stale_ids, settings)
+        if chunks:
+            print(f"正在合併 {len(chunks)} 個新的知識片段...")
+            vectorstore.add_embeddings(
+                list(zip([chunk.page_content for chunk in chunks], vectors)),
+                metadatas=[chunk.metadata for chunk in chunks],
+                ids=doc_ids
+            )
+    else:
+        print(f"正在建立 FAISS 索引（類型: {settings.rag_index_type}，度量: {settings.rag_index_metric}）...")
+        index = create_faiss_index_from_settings(vectors, settings)
+        vectorstore = create_vector_store(chunks, index, embeddings, settings.rag_index_metric, doc_ids)
     vectorstore.save_local(INDEX_PATH)
     
-    print("\n--- ✅ RAG 索引建立成功！---")
+    # 同時寫入欄式 chunk 儲存，供 FAISS 直接檢索引擎使用（免載入 pickle docstore）
+    chunk_store = ChunkStore.from_langchain(vectorstore)
+    chunk_store.save(index_dir / CHUNK_STORE_DIRNAME)
+    
+    # 預計算每個 chunk 的清理、斷句與句子 token，查詢時的段落提取只需查表
+    SegmentStore.from_chunk_store(chunk_store, get_keyword_registry().document_title_markers).save(
+        index_dir / CHUNK_STORE_DIRNAME / SEGMENTS_DIRNAME
+    )
+    
+    # 建立 BM25 倒排索引，供混合檢索與向量結果融合
+    BM25Index.from_chunk_store(chunk_store).save(index_dir / LEXICAL_INDEX_DIRNAME)
+    
+    # 索引寫入後才更新清單，中斷時下次會重新處理這些檔案
+    remaining_ids = iter(doc_ids)
+    for path in diff.removed:
+        manifest.remove_file(path)
+    for path, path_chunks in file_chunks.items():
+        manifest.update_file(path, current_hashes[path], [next(remaining_ids) for _ in path_chunks])
+    manifest.save(manifest_path)
+    
+    # 5. 預計算回饋報告固定查詢的檢索結果（與索引指紋綁定，索引變更後自動失效）
+    print("正在預計算固定查詢的檢索結果...")
+    settings = settings.model_copy(update={
+        "faiss_index_dir": index_dir.resolve(),
+        "rag_model_name": EMBEDDING_MODEL,
+        "rag_background_loading": False
+    })
+    precomputed = RAGService(settings).precompute_results(get_feedback_query_vocabulary(), k=REPORT_RAG_K)
+    print(f"已預計算 {precomputed} 個查詢的檢索結果。")
+    
+    print(f"\n--- ✅ RAG 索引建立成功！（{time.perf_counter() - started_at:.1f}s，共 {vectorstore.index.ntotal} 個向量）---")
     print(f"索引檔案已儲存至 '{INDEX_PATH}' 資料夾。")
     print("重要：請確保你的 .gitignore 檔案中有 `faiss_index/` 這一行。")
 
 if __name__ == '__main__':
-    build_index()
+    parser = argparse.ArgumentParser(description="建立 ClinicSim-AI RAG 向量索引")
+    parser.add_argument("--full", action="store_true", help="忽略 manifest.json，完整重建索引")
+    parser.add_argument("--workers", type=int, default=None, help="PDF 解析與 OCR 的行程數（預設為 CPU 核心數）")
+    parser.add_argument("--embed-batch-size", type=int, default=64, help="每批送入 embedding 模型的 chunk 數")
+    parser.add_argument("--embed-workers", type=int, default=1, help="embedding 執行緒數")
+    parser.add_argument("--queue-size", type=int, default=8, help="管線各階段之間佇列的容量")
+    args = parser.parse_args()
+    build_index(
+        full_rebuild=args.full,
+        workers=args.workers,
+        embed_batch_size=args.embed_batch_size,
+        embed_workers=args.embed_workers,
+        queue_size=args.queue_size
+    )
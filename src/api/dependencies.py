@@ -7,6 +7,7 @@ from functools import lru_cache
 
 from ..config.settings import get_settings
 from ..services.ai_service import get_ai_service, AIServiceFactory, AIProvider
+from ..services.ai_scheduler import AIScheduler, RequestPriority
 from ..services.case_service import CaseService
 from ..services.conversation_service import ConversationService
 from ..services.rag_service import RAGService
@@ -28,17 +29,30 @@ def get_dependencies() -> Dict[str, Any]:
         ai_service = AIServiceFactory.create_service(AIProvider.MOCK)
         print("✅ 使用 Mock AI 服務作為備用")
     
+    # 問診對話優先於背景的詳細報告與對話摘要取得後端名額
+    chat_ai_service = report_ai_service = ai_service
+    if settings.ai_scheduler_enabled:
+        scheduler = AIScheduler(
+            ai_service,
+            max_parallel=settings.ai_scheduler_max_parallel,
+            coalesce=settings.ai_scheduler_coalesce
+        )
+        chat_ai_service = scheduler.client(RequestPriority.INTERACTIVE)
+        report_ai_service = scheduler.client(RequestPriority.BACKGROUND)
+    
     # 初始化其他服務
     case_service = CaseService(settings)
     rag_service = RAGService(settings)
-    conversation_service = ConversationService(settings, case_service, ai_service)
-    report_service = ReportService(settings, case_service, ai_service, rag_service)
+    conversation_service = ConversationService(
+        settings, case_service, chat_ai_service, summary_ai_service=report_ai_service
+    )
+    report_service = ReportService(settings, case_service, report_ai_service, rag_service)
     
     print(f"✅ 所有服務初始化完成")
     
     return {
         "settings": settings,
-        "ai_service": ai_service,
+        "ai_service": chat_ai_service,
         "case_service": case_service,
         "conversation_service": conversation_service,
         "rag_service": rag_service,
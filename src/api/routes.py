@@ -2,8 +2,9 @@
 API 路由定義
 """
 
-from flask import Flask, request, jsonify
-from typing import Dict, Any
+from flask import Flask, Response, request, jsonify, stream_with_context
+from typing import Dict, Any, Optional, Tuple
+import json
 import traceback
 
 from .dependencies import get_dependencies
@@ -43,50 +44,21 @@ def register_routes(app: Flask) -> None:
     def ask_patient_route():
         """詢問病人端點"""
         try:
-            data = request.json
-            if not data:
-                return jsonify({"error": "缺少請求數據"}), 400
-            
-            history = data.get('history', [])
-            case_id = data.get('case_id')
-            
-            if not case_id:
-                return jsonify({"error": "缺少 case_id"}), 400
-            
-            if not validate_conversation_data(history):
-                return jsonify({"error": "無效的對話數據格式"}), 400
-            
-            # 取得服務依賴
-            deps = get_dependencies()
-            conversation_service = deps['conversation_service']
-            
-            # 創建或取得對話
-            conversation_id = f"{case_id}_session"
-            conversation = conversation_service.get_conversation(conversation_id)
-            
-            if not conversation:
-                conversation, conversation_id = conversation_service.create_conversation(case_id)
-            
-            # 添加使用者訊息
-            last_user_message = history[-1] if history else None
-            if last_user_message and last_user_message.get('role') == 'user':
-                conversation_service.add_message(
-                    conversation_id, 
-                    MessageRole.USER, 
-                    last_user_message['content']
-                )
+            conversation_service, conversation_id, error = _prepare_patient_conversation(request.json)
+            if error:
+                return error
             
             # 生成 AI 回應
             print(f"[DEBUG] 開始生成 AI 回應，conversation_id: {conversation_id}")
             ai_reply = conversation_service.generate_ai_response(conversation_id)
             print(f"[DEBUG] AI 回應結果: {ai_reply}")
             
+            # 取得更新後的對話（回應後即移除，下次請求會以完整歷史重建）
+            updated_conversation = conversation_service.remove_conversation(conversation_id)
+            
             if not ai_reply:
                 return jsonify({"error": "無法生成 AI 回應"}), 500
             
-            # 取得更新後的對話
-            updated_conversation = conversation_service.get_conversation(conversation_id)
-            
             return jsonify({
                 "reply": ai_reply,
                 "coverage": updated_conversation.coverage if updated_conversation else 0,
@@ -101,6 +73,57 @@ def register_routes(app: Flask) -> None:
             app.logger.error(f"ask_patient 錯誤: {traceback.format_exc()}")
             return jsonify({"error": f"內部伺服器錯誤: {str(e)}"}), 500
     
+    @app.route('/ask_patient_stream', methods=['POST'])
+    def ask_patient_stream_route():
+        """詢問病人端點（串流版本）
+        
+        以 NDJSON（每行一個 JSON 事件）逐段返回 AI 回應：
+        - {"type": "token", "content": "..."}：模型產生的一段文字
+        - {"type": "done", "reply": "...", "coverage": 0, "vital_signs": {...}}：完整回應與更新後的指標
+        - {"type": "error", "error": "..."}：生成過程中發生錯誤
+        """
+        try:
+            conversation_service, conversation_id, error = _prepare_patient_conversation(request.json)
+            if error:
+                return error
+        except CaseNotFoundError as e:
+            return jsonify({"error": str(e)}), 404
+        except Exception as e:
+            app.logger.error(f"ask_patient_stream 錯誤: {traceback.format_exc()}")
+            return jsonify({"error": f"內部伺服器錯誤: {str(e)}"}), 500
+        
+        def generate_events():
+            reply_parts = []
+            try:
+                for token in conversation_service.stream_ai_response(conversation_id):
+                    reply_parts.append(token)
+                    yield _ndjson_event({"type": "token", "content": token})
+                
+                if not reply_parts:
+                    yield _ndjson_event({"type": "error", "error": "無法生成 AI 回應"})
+                    return
+                
+                # 取得更新後的對話
+                updated_conversation = conversation_service.get_conversation(conversation_id)
+                yield _ndjson_event({
+                    "type": "done",
+                    "reply": "".join(reply_parts),
+                    "coverage": updated_conversation.coverage if updated_conversation else 0,
+                    "vital_signs": updated_conversation.vital_signs if updated_conversation else None
+                })
+            except Exception as e:
+                app.logger.error(f"ask_patient_stream 錯誤: {traceback.format_exc()}")
+                yield _ndjson_event({"type": "error", "error": f"AI 服務錯誤: {str(e)}"})
+            finally:
+                # 下次請求會以完整歷史重建對話
+                conversation_service.remove_conversation(conversation_id)
+        
+        return Response(
+            stream_with_context(generate_events()),
+            content_type="application/x-ndjson; charset=utf-8",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
     @app.route('/get_feedback_report', methods=['POST'])
     def get_feedback_report_route():
         """生成即時回饋報告端點"""
@@ -161,53 +184,14 @@ def register_routes(app: Flask) -> None:
     def get_detailed_report_route():
         """生成詳細報告端點"""
         try:
-            data = request.json
-            if not data:
-                return jsonify({"error": "缺少請求數據"}), 400
-            
-            full_conversation = data.get('full_conversation', [])
-            case_id = data.get('case_id')
-            
-            if not case_id:
-                return jsonify({"error": "缺少 case_id"}), 400
-            
-            if not validate_conversation_data(full_conversation):
-                return jsonify({"error": "無效的對話數據格式"}), 400
-            
-            # 取得服務依賴
-            deps = get_dependencies()
-            conversation_service = deps['conversation_service']
-            report_service = deps['report_service']
-            
-            # 創建對話對象
-            conversation, conversation_id = conversation_service.create_conversation(case_id)
-            
-            # 添加對話歷史
-            for msg in full_conversation:
-                role = MessageRole(msg['role'])
-                conversation_service.add_message(conversation_id, role, msg['content'])
-            
-            # 取得對話對象
-            conversation = conversation_service.get_conversation(conversation_id)
-            if not conversation:
-                return jsonify({"error": "無法創建對話"}), 500
+            report_service, conversation, error = _prepare_report_conversation(request.json)
+            if error:
+                return error
             
             # 生成詳細報告
             report = report_service.generate_detailed_report(conversation)
             
-            # 使用安全的 JSON 序列化工具
-            citations_data = [safe_model_dump(citation) for citation in report.citations]
-            
-            response_data = safe_jsonify_data({
-                "report_text": report.content,
-                "citations": citations_data,
-                "rag_queries": report.rag_queries,
-                "coverage": report.coverage,
-                "metadata": report.metadata,
-                "filename": report.metadata.get('filename')
-            })
-            
-            return jsonify(response_data)
+            return jsonify(_detailed_report_payload(report))
             
         except CaseNotFoundError as e:
             return jsonify({"error": str(e)}), 404
@@ -215,6 +199,55 @@ def register_routes(app: Flask) -> None:
             app.logger.error(f"get_detailed_report 錯誤: {traceback.format_exc()}")
             return jsonify({"error": "內部伺服器錯誤"}), 500
     
+    @app.route('/get_detailed_report_stream', methods=['POST'])
+    def get_detailed_report_stream_route():
+        """生成詳細報告端點（串流版本）
+        
+        以 NDJSON 逐行返回各階段事件：
+        - {"type": "stage", "stage": "queries", "rag_queries": [...]}：已生成 RAG 查詢
+        - {"type": "stage", "stage": "citations", "citations": [...]}：已檢索臨床指引
+        - {"type": "stage", "stage": "llm"}：開始生成報告內容
+        - {"type": "token", "content": "..."}：LLM 產生的一段報告內容
+        - {"type": "done", ...}：完整報告，欄位與 /get_detailed_report 相同
+        - {"type": "error", "error": "..."}：生成過程中發生錯誤
+        """
+        try:
+            report_service, conversation, error = _prepare_report_conversation(request.json)
+            if error:
+                return error
+        except CaseNotFoundError as e:
+            return jsonify({"error": str(e)}), 404
+        except Exception as e:
+            app.logger.error(f"get_detailed_report_stream 錯誤: {traceback.format_exc()}")
+            return jsonify({"error": "內部伺服器錯誤"}), 500
+        
+        def generate_events():
+            try:
+                for event, payload in report_service.iter_detailed_report(conversation):
+                    if event == "queries":
+                        yield _ndjson_event({"type": "stage", "stage": "queries", "rag_queries": payload})
+                    elif event == "citations":
+                        yield _ndjson_event({
+                            "type": "stage",
+                            "stage": "citations",
+                            "citations": [safe_model_dump(citation) for citation in payload]
+                        })
+                    elif event == "llm":
+                        yield _ndjson_event({"type": "stage", "stage": "llm"})
+                    elif event == "token":
+                        yield _ndjson_event({"type": "token", "content": payload})
+                    elif event == "report":
+                        yield _ndjson_event({"type": "done", **_detailed_report_payload(payload)})
+            except Exception as e:
+                app.logger.error(f"get_detailed_report_stream 錯誤: {traceback.format_exc()}")
+                yield _ndjson_event({"type": "error", "error": f"無法生成詳細報告: {str(e)}"})
+        
+        return Response(
+            stream_with_context(generate_events()),
+            content_type="application/x-ndjson; charset=utf-8",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
     @app.route('/cases/random', methods=['GET'])
     def get_random_case_route():
         """隨機選擇一個案例"""
@@ -413,6 +446,116 @@ def register_routes(app: Flask) -> None:
         except Exception as e:
             app.logger.error(f"rag_status 錯誤: {traceback.format_exc()}")
             return jsonify({"error": "內部伺服器錯誤"}), 500
+    
+    @app.route('/ai/status', methods=['GET'])
+    def ai_status_route():
+        """AI 服務狀態與請求佇列指標"""
+        try:
+            deps = get_dependencies()
+            ai_service = deps['ai_service']
+            
+            return jsonify({
+                "service": type(ai_service).__name__,
+                "available": ai_service.is_available(),
+                "metrics": ai_service.get_metrics()
+            })
+            
+        except Exception as e:
+            app.logger.error(f"ai_status 錯誤: {traceback.format_exc()}")
+            return jsonify({"error": "內部伺服器錯誤"}), 500
+
+
+def _prepare_patient_conversation(data: Optional[Dict[str, Any]]) -> Tuple[Any, Optional[str], Optional[Tuple[Response, int]]]:
+    """驗證問診請求，並以請求中的對話歷史重建對話
+    
+    前端每次都會送出完整的對話歷史，後端不保留跨請求的對話狀態；
+    較早的對話摘要由 ConversationContextManager 依對話內容保存，重建後仍可沿用。
+    
+    Returns:
+        (對話服務, 對話 ID, 錯誤回應)；請求無效時只有錯誤回應不為 None
+    """
+    if not data:
+        return None, None, (jsonify({"error": "缺少請求數據"}), 400)
+    
+    history = data.get('history', [])
+    case_id = data.get('case_id')
+    
+    if not case_id:
+        return None, None, (jsonify({"error": "缺少 case_id"}), 400)
+    
+    if not validate_conversation_data(history):
+        return None, None, (jsonify({"error": "無效的對話數據格式"}), 400)
+    
+    # 取得服務依賴
+    deps = get_dependencies()
+    conversation_service = deps['conversation_service']
+    
+    # 以對話歷史重建對話（系統訊息由案例提供，不沿用前端送來的）
+    _, conversation_id = conversation_service.create_conversation(case_id)
+    for message in history:
+        if message['role'] in ('user', 'assistant'):
+            conversation_service.add_message(conversation_id, MessageRole(message['role']), message['content'])
+    
+    return conversation_service, conversation_id, None
+
+
+def _prepare_report_conversation(data: Optional[Dict[str, Any]]) -> Tuple[Any, Any, Optional[Tuple[Response, int]]]:
+    """驗證報告請求並以完整對話歷史建立對話
+    
+    案例在此先載入，找不到時拋出 CaseNotFoundError，串流端點可在開始串流前返回 404。
+    
+    Returns:
+        (報告服務, 對話, 錯誤回應)；請求無效時只有錯誤回應不為 None
+    """
+    if not data:
+        return None, None, (jsonify({"error": "缺少請求數據"}), 400)
+    
+    full_conversation = data.get('full_conversation', [])
+    case_id = data.get('case_id')
+    
+    if not case_id:
+        return None, None, (jsonify({"error": "缺少 case_id"}), 400)
+    
+    if not validate_conversation_data(full_conversation):
+        return None, None, (jsonify({"error": "無效的對話數據格式"}), 400)
+    
+    # 取得服務依賴
+    deps = get_dependencies()
+    conversation_service = deps['conversation_service']
+    report_service = deps['report_service']
+    deps['case_service'].load_case(case_id)
+    
+    # 創建對話對象
+    conversation, conversation_id = conversation_service.create_conversation(case_id)
+    
+    # 添加對話歷史
+    for msg in full_conversation:
+        role = MessageRole(msg['role'])
+        conversation_service.add_message(conversation_id, role, msg['content'])
+    
+    # 取得對話對象
+    conversation = conversation_service.get_conversation(conversation_id)
+    if not conversation:
+        return None, None, (jsonify({"error": "無法創建對話"}), 500)
+    
+    return report_service, conversation, None
+
+
+def _detailed_report_payload(report: Any) -> Dict[str, Any]:
+    """詳細報告的回應內容（使用安全的 JSON 序列化工具）"""
+    return safe_jsonify_data({
+        "report_text": report.content,
+        "citations": [safe_model_dump(citation) for citation in report.citations],
+        "rag_queries": report.rag_queries,
+        "coverage": report.coverage,
+        "metadata": report.metadata,
+        "filename": report.metadata.get('filename')
+    })
+
+
+def _ndjson_event(event: Dict[str, Any]) -> str:
+    """將串流事件序列化為一行 JSON"""
+    return json.dumps(safe_jsonify_data(event), ensure_ascii=False) + "\n"
 
 
 def setup_error_handlers(app: Flask) -> None:
@@ -3,5 +3,6 @@
 """
 
 from .settings import Settings, get_settings
+from .keyword_registry import KeywordRegistry, get_keyword_registry
 
-__all__ = ["Settings", "get_settings"]
+__all__ = ["Settings", "get_settings", "KeywordRegistry", "get_keyword_registry"]
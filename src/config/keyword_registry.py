@@ -0,0 +1,150 @@
+"""
+關鍵字與查詢模板登錄表
+從 keyword_registry.json 載入 RAG 查詢模板、相關性關鍵詞與報告評估關鍵字，啟動時載入並編譯一次
+"""
+
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from ..utils.keyword_matcher import KeywordMatcher
+
+
+# 依查詢快取的比對器數量上限
+QUERY_MATCHER_CACHE_SIZE = 256
+
+
+class KeywordRegistry:
+    """關鍵字與查詢模板登錄表
+
+    擴充詞彙只需修改 JSON 檔，不需修改程式碼；所有比對器在建立時編譯，
+    依查詢產生的比對器以 LRU 快取，檢索每個 chunk 時不再重新建立關鍵字表。
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        self.query_templates: Dict[str, Dict[str, List[str]]] = data["query_templates"]
+        if "default" not in self.query_templates:
+            raise ValueError("query_templates 必須包含 default 案例類型")
+
+        # 依對話內容插入到最前面的查詢：(觸發關鍵字, 插入的查詢)
+        self.conversation_query_rules: List[Tuple[List[str], List[str]]] = [
+            (rule["keywords"], rule["queries"]) for rule in data.get("conversation_query_rules", [])
+        ]
+        self.relevance_keyword_groups: Dict[str, List[str]] = data.get("relevance_keyword_groups", {})
+        self.paragraph_keyword_groups: Dict[str, List[str]] = data.get("paragraph_keyword_groups", {})
+        self.irrelevant_indicators: List[str] = data.get("irrelevant_indicators", [])
+        self.document_title_markers: List[str] = data.get("document_title_markers", [])
+
+        # 回饋內容關鍵詞 → RAG 查詢（依序比對）
+        self.feedback_query_rules: List[Tuple[List[str], List[str]]] = [
+            (rule["keywords"], rule["queries"]) for rule in data.get("feedback_query_rules", [])
+        ]
+        self.default_feedback_queries: List[str] = data.get("default_feedback_queries", [])
+
+        # 關鍵行動類型：行動描述包含 action_markers 之一時採用，action_markers 為空的規則作為預設
+        self.critical_action_rules: List[Dict[str, Any]] = data.get("critical_action_rules", [])
+
+        # 固定關鍵字表的比對器（群組名稱本身也是觸發詞）
+        self.relevance_trigger_matcher = KeywordMatcher(
+            {key: [key] + keywords for key, keywords in self.relevance_keyword_groups.items()}
+        )
+        self.paragraph_trigger_matcher = KeywordMatcher(
+            {key: [key] + keywords for key, keywords in self.paragraph_keyword_groups.items()}
+        )
+        self.conversation_query_matcher = KeywordMatcher(
+            {i: keywords for i, (keywords, _) in enumerate(self.conversation_query_rules)}
+        )
+        self.feedback_query_matcher = KeywordMatcher(
+            {i: keywords for i, (keywords, _) in enumerate(self.feedback_query_rules)}
+        )
+        self.critical_action_matcher = KeywordMatcher(
+            {rule["id"]: rule["keywords"] for rule in self.critical_action_rules}
+        )
+
+        # 依查詢建立的比對器（同一查詢只編譯一次）
+        self.relevance_matcher = lru_cache(maxsize=QUERY_MATCHER_CACHE_SIZE)(self._build_relevance_matcher)
+        self.paragraph_query_terms = lru_cache(maxsize=QUERY_MATCHER_CACHE_SIZE)(self._build_paragraph_query_terms)
+
+    @classmethod
+    def load(cls, path: Path) -> "KeywordRegistry":
+        """從 JSON 檔載入"""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def get_query_templates(self, case_type: str) -> Dict[str, List[str]]:
+        """取得案例類型的查詢模板，未定義時使用 default"""
+        return self.query_templates.get(case_type, self.query_templates["default"])
+
+    def match_conversation_queries(self, conversation_text: str) -> List[List[str]]:
+        """對話內容觸發的插入查詢（依規則順序）"""
+        matched_rules = self.conversation_query_matcher.match(conversation_text)
+        return [queries for i, (_, queries) in enumerate(self.conversation_query_rules) if i in matched_rules]
+
+    def match_feedback_queries(self, feedback_content: str) -> List[str]:
+        """回饋內容觸發的 RAG 查詢（依規則順序）"""
+        matched_rules = self.feedback_query_matcher.match(feedback_content)
+        return [query for i, (_, queries) in enumerate(self.feedback_query_rules) if i in matched_rules for query in queries]
+
+    def critical_action_type(self, action: str) -> Optional[str]:
+        """判斷關鍵行動的類型（比對行動描述，區分大小寫）"""
+        for rule in self.critical_action_rules:
+            markers = rule.get("action_markers", [])
+            if not markers or any(marker in action for marker in markers):
+                return rule["id"]
+        return None
+
+    def query_vocabulary(self) -> List[str]:
+        """查詢模板與對話插入規則中的所有查詢（去重、保持順序）"""
+        vocabulary = []
+        for case_queries in self.query_templates.values():
+            for queries in case_queries.values():
+                vocabulary.extend(queries)
+        for _, queries in self.conversation_query_rules:
+            vocabulary.extend(queries)
+        return list(dict.fromkeys(vocabulary))
+
+    def feedback_query_vocabulary(self) -> List[str]:
+        """回饋報告可能產生的所有 RAG 查詢（去重、保持順序）"""
+        vocabulary = [query for _, queries in self.feedback_query_rules for query in queries]
+        vocabulary.extend(self.default_feedback_queries)
+        return list(dict.fromkeys(vocabulary))
+
+    def _build_relevance_matcher(self, query: str) -> KeywordMatcher:
+        """依查詢建立內容相關性比對器
+
+        relevant 群組為查詢詞與查詢觸發的關鍵詞，irrelevant 群組為不相關內容的特徵。
+        """
+        query_lower = query.lower()
+        relevant_words = query_lower.split()
+        for key in self.relevance_trigger_matcher.match(query_lower):
+            relevant_words.extend(self.relevance_keyword_groups[key])
+        return KeywordMatcher({"relevant": relevant_words, "irrelevant": self.irrelevant_indicators})
+
+    def _build_paragraph_query_terms(self, query: str) -> Tuple[FrozenSet[str], KeywordMatcher]:
+        """依查詢取得擴展後的查詢詞與其比對器"""
+        query_lower = query.lower()
+        expanded_query_words = set(query_lower.split())
+        for key in self.paragraph_trigger_matcher.match(query_lower):
+            expanded_query_words.update(self.paragraph_keyword_groups[key])
+        return frozenset(expanded_query_words), KeywordMatcher({"query": expanded_query_words})
+
+
+# 全域登錄表實例
+_registry: Optional[KeywordRegistry] = None
+
+
+def get_keyword_registry() -> KeywordRegistry:
+    """取得全域關鍵字登錄表（單例模式，首次呼叫時載入設定中的 JSON 檔）"""
+    global _registry
+    if _registry is None:
+        from .settings import get_settings
+        _registry = KeywordRegistry.load(get_settings().keyword_registry_path)
+    return _registry
+
+
+def reload_keyword_registry() -> KeywordRegistry:
+    """重新載入關鍵字登錄表"""
+    global _registry
+    _registry = None
+    return get_keyword_registry()
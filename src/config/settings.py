@@ -20,11 +20,29 @@ class Settings(BaseSettings):
     # 伺服器設定
     host: str = Field(default="0.0.0.0", env="HOST")
     port: int = Field(default=5001, env="PORT")
+    api_connect_timeout: float = Field(default=5.0, env="API_CONNECT_TIMEOUT")  # 前端連線到後端的逾時秒數
+    api_stream_read_timeout: float = Field(default=300.0, env="API_STREAM_READ_TIMEOUT")  # 串流兩個事件之間的最長等待秒數
     
     # AI 模型設定
-    ai_provider: str = Field(default="ollama", env="AI_PROVIDER")  # ollama, lemonade, openai
+    ai_provider: str = Field(default="ollama", env="AI_PROVIDER")  # ollama, ollama_pooled, lemonade, openai
     ollama_host: str = Field(default="http://127.0.0.1:11434", env="OLLAMA_HOST")
     ollama_model: str = Field(default="llama3:8b", env="OLLAMA_MODEL")
+    ollama_max_concurrency: int = Field(default=4, env="OLLAMA_MAX_CONCURRENCY")  # ollama_pooled：每個模型同時送出的請求數（對應 OLLAMA_NUM_PARALLEL）
+    ollama_max_connections: int = Field(default=32, env="OLLAMA_MAX_CONNECTIONS")  # ollama_pooled：連線池大小
+    ollama_request_timeout: float = Field(default=300.0, env="OLLAMA_REQUEST_TIMEOUT")  # ollama_pooled：單一請求逾時秒數
+    ollama_keep_alive: str = Field(default="30m", env="OLLAMA_KEEP_ALIVE")  # 模型（及其 KV 快取）在閒置後保留的時間，空字串表示使用 Ollama 預設
+    ollama_num_ctx: int = Field(default=8192, env="OLLAMA_NUM_CTX")  # 上下文長度，固定後對話前綴不會被截斷；0 表示使用模型預設
+    ai_scheduler_enabled: bool = Field(default=True, env="AI_SCHEDULER_ENABLED")  # 問診與報告的 AI 請求經由排程器送出
+    ai_scheduler_max_parallel: int = Field(default=4, env="AI_SCHEDULER_MAX_PARALLEL")  # 同時送往後端的請求數（對應 OLLAMA_NUM_PARALLEL）
+    ai_scheduler_coalesce: bool = Field(default=True, env="AI_SCHEDULER_COALESCE")  # 合併同時送出的相同請求
+    response_cache_enabled: bool = Field(default=False, env="RESPONSE_CACHE_ENABLED")  # 相同案例與對話歷史直接返回快取的病人回應
+    response_cache_size: int = Field(default=512, env="RESPONSE_CACHE_SIZE")  # LRU 上限
+    response_cache_ttl: float = Field(default=3600.0, env="RESPONSE_CACHE_TTL")  # 秒，0 表示不過期
+    response_cache_max_turns: int = Field(default=3, env="RESPONSE_CACHE_MAX_TURNS")  # 只快取使用者訊息不超過此數的對話（開場），0 表示不限
+    response_cache_variants: int = Field(default=1, env="RESPONSE_CACHE_VARIANTS")  # 大於 1 時每個鍵收集多個回應並隨機返回
+    context_token_budget: int = Field(default=6144, env="CONTEXT_TOKEN_BUDGET")  # 每輪送給模型的訊息 token 上限（需小於 OLLAMA_NUM_CTX，預留回覆空間），0 表示不限
+    context_keep_turns: int = Field(default=8, env="CONTEXT_KEEP_TURNS")  # 以原文保留的最近對話輪數
+    context_summary_enabled: bool = Field(default=True, env="CONTEXT_SUMMARY_ENABLED")  # 較早的對話在背景摺疊成摘要
     
     # 路徑設定
     project_root: Path = Field(default_factory=lambda: Path(__file__).parent.parent.parent)
@@ -32,12 +50,48 @@ class Settings(BaseSettings):
     documents_dir: Path = Field(default_factory=lambda: Path(__file__).parent.parent.parent / "documents")
     faiss_index_dir: Path = Field(default_factory=lambda: Path(__file__).parent.parent.parent / "faiss_index")
     report_history_dir: Path = Field(default_factory=lambda: Path(__file__).parent.parent.parent / "report_history")
+    ocr_cache_dir: Path = Field(default_factory=lambda: Path(__file__).parent.parent.parent / "ocr_cache")
+    keyword_registry_path: Path = Field(default_factory=lambda: Path(__file__).parent / "keyword_registry.json")
     
     # RAG 設定
     rag_model_name: str = Field(default="nomic-ai/nomic-embed-text-v1.5", env="RAG_MODEL_NAME")
     rag_chunk_size: int = Field(default=800, env="RAG_CHUNK_SIZE")
     rag_chunk_overlap: int = Field(default=100, env="RAG_CHUNK_OVERLAP")
     rag_search_k: int = Field(default=3, env="RAG_SEARCH_K")
+    rag_engine: str = Field(default="faiss", env="RAG_ENGINE")  # faiss（直接檢索，延遲相同但每次查詢的物件配置較少）, langchain
+    rag_index_metric: str = Field(default="ip", env="RAG_INDEX_METRIC")  # 建立索引時使用：ip（內積）, l2
+    rag_min_similarity: float = Field(default=0.4, env="RAG_MIN_SIMILARITY")  # 餘弦相似度閾值（等同原 L2 距離 1.2）
+    rag_fetch_multiplier: int = Field(default=1, env="RAG_FETCH_MULTIPLIER")  # 初始候選數 = k * multiplier
+    rag_max_fetch_k: int = Field(default=32, env="RAG_MAX_FETCH_K")  # 自適應加大候選數的上限
+    rag_index_type: str = Field(default="flat", env="RAG_INDEX_TYPE")  # 建立索引時使用：flat, hnsw, ivfpq
+    rag_hnsw_m: int = Field(default=32, env="RAG_HNSW_M")
+    rag_hnsw_ef_construction: int = Field(default=200, env="RAG_HNSW_EF_CONSTRUCTION")
+    rag_hnsw_ef_search: int = Field(default=64, env="RAG_HNSW_EF_SEARCH")
+    rag_ivf_nlist: int = Field(default=0, env="RAG_IVF_NLIST")  # 0 表示依資料量自動決定
+    rag_ivf_pq_m: int = Field(default=16, env="RAG_IVF_PQ_M")
+    rag_ivf_nprobe: int = Field(default=16, env="RAG_IVF_NPROBE")
+    rag_mmap_index: bool = Field(default=False, env="RAG_MMAP_INDEX")  # 以記憶體映射載入索引，多 worker 共用實體記憶體
+    rag_hybrid_search: bool = Field(default=True, env="RAG_HYBRID_SEARCH")  # 有 BM25 詞彙索引時與向量檢索融合
+    rag_hybrid_candidates: int = Field(default=20, env="RAG_HYBRID_CANDIDATES")  # 向量與 BM25 各取回的候選數
+    rag_rrf_k: int = Field(default=60, env="RAG_RRF_K")  # 倒數排名融合常數
+    rag_query_cache_size: int = Field(default=1024, env="RAG_QUERY_CACHE_SIZE")  # 0 表示停用
+    rag_query_cache_persist: bool = Field(default=True, env="RAG_QUERY_CACHE_PERSIST")
+    rag_query_cache_save_every: int = Field(default=32, env="RAG_QUERY_CACHE_SAVE_EVERY")  # 每累積 N 筆新向量在背景寫入，其餘於結束時寫入
+    rag_precompute_results: bool = Field(default=True, env="RAG_PRECOMPUTE_RESULTS")
+    rag_background_loading: bool = Field(default=True, env="RAG_BACKGROUND_LOADING")
+    rag_ready_timeout: float = Field(default=120.0, env="RAG_READY_TIMEOUT")  # 報告等待索引載入的秒數
+    
+    # OCR 設定
+    ocr_cache_enabled: bool = Field(default=True, env="OCR_CACHE_ENABLED")  # 以圖片內容雜湊快取辨識結果
+    ocr_workers: int = Field(default=0, env="OCR_WORKERS")  # 批次 OCR 的工作行程數，0 表示 CPU 核心數
+    ocr_max_side: int = Field(default=2560, env="OCR_MAX_SIDE")  # 長邊超過時先縮小（EasyOCR 預設畫布大小），0 表示不縮小
+    ocr_tile_size: int = Field(default=0, env="OCR_TILE_SIZE")  # 縮小後仍超過時切片辨識，0 表示不切片
+    ocr_tile_overlap: int = Field(default=128, env="OCR_TILE_OVERLAP")
+    
+    # 報告設定
+    report_stage_workers: int = Field(default=4, env="REPORT_STAGE_WORKERS")  # 詳細報告各階段共用的執行緒數
+    report_stage_timeout: float = Field(default=30.0, env="REPORT_STAGE_TIMEOUT")  # 案例載入與基本分析的逾時秒數
+    report_retrieval_timeout: float = Field(default=30.0, env="REPORT_RETRIEVAL_TIMEOUT")  # 檢索逾時則不附引註
     
     # 案例設定
     default_case_id: str = Field(default="case_chest_pain_acs_01", env="DEFAULT_CASE_ID")
@@ -4,11 +4,12 @@ Streamlit 主應用程式
 
 import streamlit as st
 import requests
+import json
 import sys
 import time
 import os
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 from dotenv import load_dotenv
 
 # 載入 .env 檔案
@@ -175,34 +176,7 @@ class StreamlitApp:
             st.markdown(message)
         
         # 生成 AI 回應
-        with st.chat_message("assistant"):
-            with st.spinner("AI 病人正在思考..."):
-                try:
-                    response_data = self._call_api("/ask_patient", {
-                        "history": st.session_state.messages,
-                        "case_id": self.case_id
-                    })
-                    
-                    ai_reply = response_data.get("reply", "無法生成回應")
-                    
-                    # 更新覆蓋率和生命體徵（累加式）
-                    new_coverage = response_data.get("coverage", st.session_state.coverage)
-                    # 只會增加，不會減少
-                    if new_coverage > st.session_state.coverage:
-                        st.session_state.coverage = new_coverage
-                    
-                    if "vital_signs" in response_data:
-                        st.session_state.vital_signs = response_data["vital_signs"]
-                    
-                    # 添加 AI 回應
-                    st.session_state.messages.append({"role": "assistant", "content": ai_reply})
-                    st.markdown(ai_reply)
-                    
-                    # 重新整理頁面以更新側邊欄
-                    st.rerun()
-                    
-                except Exception as e:
-                    st.error(f"無法連接到後端服務，請確認伺服器正在運行。\n\n錯誤訊息：{e}")
+        self._ask_patient("AI 病人正在思考...")
     
     def _handle_quick_action(self, action: str):
         """處理快速操作"""
@@ -230,34 +204,37 @@ class StreamlitApp:
                 st.image(image_full_path, caption=f"{self._get_order_name_from_action(action)} 檢查結果", use_column_width=True)
         
         # 生成 AI 回應
+        self._ask_patient("AI 病人正在處理您的臨床指令...")
+    
+    def _ask_patient(self, thinking_text: str):
+        """以串流方式取得 AI 病人的回應，逐段顯示並更新覆蓋率與生命體徵"""
         with st.chat_message("assistant"):
-            with st.spinner("AI 病人正在處理您的臨床指令..."):
-                try:
-                    response_data = self._call_api("/ask_patient", {
-                        "history": st.session_state.messages,
-                        "case_id": self.case_id
-                    })
-                    
-                    ai_reply = response_data.get("reply", "無法生成回應")
-                    
-                    # 更新覆蓋率和生命體徵（累加式）
-                    new_coverage = response_data.get("coverage", st.session_state.coverage)
-                    # 只會增加，不會減少
-                    if new_coverage > st.session_state.coverage:
-                        st.session_state.coverage = new_coverage
-                    
-                    if "vital_signs" in response_data:
-                        st.session_state.vital_signs = response_data["vital_signs"]
-                    
-                    # 添加 AI 回應
-                    st.session_state.messages.append({"role": "assistant", "content": ai_reply})
-                    st.markdown(ai_reply)
-                    
-                    # 重新整理頁面以更新側邊欄
-                    st.rerun()
-                    
-                except Exception as e:
-                    st.error(f"無法連接到後端服務，請確認伺服器正在運行。\n\n錯誤訊息：{e}")
+            try:
+                events = self._stream_api("/ask_patient_stream", {
+                    "history": st.session_state.messages,
+                    "case_id": self.case_id
+                })
+                response_data = self.chat_interface.render_streaming_reply(events, thinking_text)
+                
+                ai_reply = response_data.get("reply", "無法生成回應")
+                
+                # 更新覆蓋率和生命體徵（累加式）
+                new_coverage = response_data.get("coverage", st.session_state.coverage)
+                # 只會增加，不會減少
+                if new_coverage > st.session_state.coverage:
+                    st.session_state.coverage = new_coverage
+                
+                if "vital_signs" in response_data:
+                    st.session_state.vital_signs = response_data["vital_signs"]
+                
+                # 添加 AI 回應
+                st.session_state.messages.append({"role": "assistant", "content": ai_reply})
+                
+                # 重新整理頁面以更新側邊欄
+                st.rerun()
+                
+            except Exception as e:
+                st.error(f"無法連接到後端服務，請確認伺服器正在運行。\n\n錯誤訊息：{e}")
     
     def _get_image_path(self, image_filename: str) -> Optional[str]:
         """獲取圖片完整路徑"""
@@ -336,50 +313,12 @@ class StreamlitApp:
             return
         
         try:
-            # 步驟 1: 分析對話內容
-            self.report_generation_manager.update_progress(
-                step=1,
-                status="分析對話內容",
-                details="正在分析您的問診表現和對話內容..."
-            )
-            time.sleep(0.5)  # 模擬處理時間
-            
-            # 步驟 2: 生成 RAG 查詢
-            self.report_generation_manager.update_progress(
-                step=2,
-                status="生成 RAG 查詢",
-                details="正在生成相關的臨床指引查詢..."
-            )
-            time.sleep(0.5)
-            
-            # 步驟 3: 搜尋臨床指引
-            self.report_generation_manager.update_progress(
-                step=3,
-                status="搜尋臨床指引",
-                details="正在從知識庫中搜尋相關的臨床指引..."
-            )
-            time.sleep(0.5)
-            
-            # 步驟 4: 整合 AI 分析
-            self.report_generation_manager.update_progress(
-                step=4,
-                status="整合 AI 分析",
-                details="正在整合 AI 分析和臨床指引..."
-            )
-            time.sleep(0.5)
-            
-            # 步驟 5: 生成最終報告
-            self.report_generation_manager.update_progress(
-                step=5,
-                status="生成最終報告",
-                details="正在生成最終的詳細分析報告..."
-            )
-            
-            # 實際的 API 呼叫
-            response_data = self._call_api("/get_detailed_report", {
+            # 依後端實際完成的階段推進進度
+            events = self._stream_api("/get_detailed_report_stream", {
                 "full_conversation": st.session_state.messages,
                 "case_id": self.case_id
             })
+            response_data = self.report_generation_manager.consume_report_stream(events)
             
             detailed_report_text = response_data.get("report_text")
             citations = response_data.get("citations", [])
@@ -417,6 +356,18 @@ class StreamlitApp:
         response.raise_for_status()
         return response.json()
     
+    def _stream_api(self, endpoint: str, payload: dict) -> Iterator[dict]:
+        """呼叫串流 API，逐行解析 NDJSON 事件
+
+        讀取逾時為兩個事件之間的最長等待時間，後端停止回應時不會無限期卡住頁面
+        """
+        timeout = (self.settings.api_connect_timeout, self.settings.api_stream_read_timeout)
+        with requests.post(f"{self.api_base_url}{endpoint}", json=payload, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    yield json.loads(line)
+    
     def _handle_select_random_case(self):
         """處理隨機選擇病例"""
         try:
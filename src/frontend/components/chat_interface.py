@@ -3,7 +3,7 @@
 """
 
 import streamlit as st
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Iterable
 
 from .base import BaseComponent
 
@@ -40,6 +40,35 @@ class ChatInterfaceComponent(BaseComponent):
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
     
+    def render_streaming_reply(self, events: Iterable[Dict[str, Any]], thinking_text: str = "AI 病人正在思考...") -> Dict[str, Any]:
+        """逐段渲染串流回應（需在 st.chat_message 內呼叫）
+        
+        收到第一段文字前顯示思考提示，之後每收到一段就更新同一個區塊；
+        收到 error 事件或串流在 done 事件前中斷時拋出 RuntimeError，由呼叫端顯示錯誤。
+        
+        Returns:
+            串流結束時的 done 事件（包含完整回應、覆蓋率與生命體徵）
+        """
+        placeholder = st.empty()
+        placeholder.markdown(f"_{thinking_text}_")
+        
+        reply = ""
+        for event in events:
+            event_type = event.get("type")
+            if event_type == "token":
+                reply += event.get("content", "")
+                placeholder.markdown(reply + "▌")
+            elif event_type == "done":
+                placeholder.markdown(event.get("reply", reply))
+                return event
+            elif event_type == "error":
+                placeholder.empty()
+                raise RuntimeError(event.get("error", "無法生成回應"))
+        
+        # 串流在 done 事件前中斷時視為失敗，不把不完整的片段當成回應
+        placeholder.empty()
+        raise RuntimeError("回應串流在完成前中斷")
+    
     def _render_chat_input(self, 
                           session_ended: bool, 
                           on_send_message: Optional[Callable[[str], None]]) -> None:
@@ -5,7 +5,7 @@
 
 import streamlit as st
 import time
-from typing import Optional, Callable, Dict, Any
+from typing import Optional, Callable, Dict, Any, Iterable
 from .base import BaseComponent
 from .styles import apply_custom_css
 
@@ -281,6 +281,42 @@ class ReportGenerationManager:
             details=details
         )
     
+    def consume_report_stream(self, events: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """依串流報告端點的事件推進進度，並即時預覽 LLM 產生的報告內容
+        
+        Returns:
+            done 事件（欄位與 /get_detailed_report 的回應相同）
+        """
+        self.update_progress(step=1, status="分析對話內容", details="正在分析您的問診表現和對話內容...")
+        preview = st.empty()
+        report_text = ""
+        
+        for event in events:
+            event_type = event.get("type")
+            if event_type == "stage":
+                stage = event.get("stage")
+                if stage == "queries":
+                    queries = event.get("rag_queries", [])
+                    self.update_progress(step=2, status="生成 RAG 查詢", details=f"已生成 {len(queries)} 個臨床指引查詢")
+                elif stage == "citations":
+                    citations = event.get("citations", [])
+                    self.update_progress(step=3, status="搜尋臨床指引", details=f"已找到 {len(citations)} 筆相關臨床指引")
+                elif stage == "llm":
+                    self.update_progress(step=4, status="整合 AI 分析", details="AI 教師正在撰寫報告...")
+            elif event_type == "token":
+                report_text += event.get("content", "")
+                preview.markdown(report_text + "▌")
+            elif event_type == "done":
+                preview.empty()
+                self.update_progress(step=5, status="生成最終報告", details="報告已完成")
+                return event
+            elif event_type == "error":
+                preview.empty()
+                raise RuntimeError(event.get("error", "無法生成詳細報告"))
+        
+        preview.empty()
+        raise RuntimeError("報告串流在完成前中斷")
+    
     def complete_generation(self, success: bool = True, error_message: str = ""):
         """完成報告生成"""
         if "report_generation_progress" in st.session_state:
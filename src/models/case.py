@@ -2,8 +2,9 @@
 案例相關數據模型
 """
 
+import json
 from typing import Dict, List, Any, Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 
 class PatientProfile(BaseModel):
@@ -43,18 +44,27 @@ class Case(BaseModel):
     data: CaseData
     is_loaded: bool = False
     
+    # 檢查清單關鍵字比對器（案例載入後快取，每個案例只編譯一次）
+    _checklist_matcher: Any = PrivateAttr(default=None)
+    # 系統提示詞（案例載入後快取，每輪對話送出完全相同的字串，讓模型後端的前綴 KV 快取能命中）
+    _system_prompt: Optional[str] = PrivateAttr(default=None)
+    
     def get_system_prompt(self) -> str:
-        """生成系統提示詞"""
-        return f"""
-        你是一位模擬病人（標準化病人）。你的所有輸出必須使用『繁體中文』。
-        【角色設定與回應規則】
-        1. 僅回答學生（user）直接詢問的內容，不主動透露未被詢問的資訊。
-        2. 回覆格式需為「[動作/情緒] 對話內容」。
-        3. 嚴格依據下方個案資料作答。
-        【個案行為規範】: {self.data.ai_instructions.model_dump_json(by_alias=False)}
-        【個案資料】: {self.data.patient_story_data}
-        請根據以上資訊和對話歷史，作為病人，以「繁體中文」回覆下一句話。切記絕對規則：所有輸出文字都要是繁體中文！！
-        """
+        """取得系統提示詞"""
+        if self._system_prompt is None:
+            instructions = self.data.ai_instructions.model_dump_json(by_alias=False)
+            story = json.dumps(self.data.patient_story_data, ensure_ascii=False, separators=(",", ":"))
+            self._system_prompt = "\n".join([
+                "你是一位模擬病人（標準化病人）。你的所有輸出必須使用『繁體中文』。",
+                "【角色設定與回應規則】",
+                "1. 僅回答學生（user）直接詢問的內容，不主動透露未被詢問的資訊。",
+                "2. 回覆格式需為「[動作/情緒] 對話內容」。",
+                "3. 嚴格依據下方個案資料作答。",
+                f"【個案行為規範】: {instructions}",
+                f"【個案資料】: {story}",
+                "請根據以上資訊和對話歷史，作為病人，以「繁體中文」回覆下一句話。切記絕對規則：所有輸出文字都要是繁體中文！！"
+            ])
+        return self._system_prompt
     
     def get_feedback_checklist(self) -> List[Dict[str, Any]]:
         """取得回饋檢查清單"""
@@ -62,6 +72,18 @@ class Case(BaseModel):
             return self.data.feedback_system.checklist
         return []
     
+    def get_checklist_matcher(self):
+        """取得檢查清單的關鍵字比對器（KeywordMatcher），群組 ID 為項目在清單中的索引"""
+        if self._checklist_matcher is None:
+            # 延遲匯入，避免 utils.validation 與 models 之間的循環匯入
+            from ..utils.keyword_matcher import KeywordMatcher
+
+            self._checklist_matcher = KeywordMatcher({
+                index: item.get('keywords', [])
+                for index, item in enumerate(self.get_feedback_checklist())
+            })
+        return self._checklist_matcher
+    
     def get_critical_actions(self) -> List[str]:
         """取得關鍵行動清單"""
         if self.data.feedback_system:
@@ -0,0 +1,187 @@
+"""
+AI 請求排程器
+位於 ConversationService / ReportService 與 AIService 之間：依優先順序分配後端的並行名額，
+並合併同時送出的相同請求
+"""
+
+import heapq
+import itertools
+import json
+import threading
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .ai_service import AIService, Message
+
+
+class RequestPriority(IntEnum):
+    """請求優先順序（數值越小越優先）"""
+    INTERACTIVE = 0  # 問診對話，學生正在等待回覆
+    BACKGROUND = 1   # 詳細報告等背景工作
+
+
+class _PrioritySlots:
+    """依優先順序分配的並行名額；同優先順序先到先得"""
+
+    def __init__(self, slots: int):
+        self._available = slots
+        self._condition = threading.Condition()
+        self._waiters: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+
+    def acquire(self, priority: RequestPriority) -> None:
+        """等待直到輪到此請求且有空出的名額"""
+        ticket = (int(priority), next(self._sequence))
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            while self._available <= 0 or self._waiters[0] != ticket:
+                self._condition.wait()
+            heapq.heappop(self._waiters)
+            self._available -= 1
+            # 可能還有空出的名額，讓下一位重新檢查
+            self._condition.notify_all()
+
+    def release(self) -> None:
+        """歸還名額"""
+        with self._condition:
+            self._available += 1
+            self._condition.notify_all()
+
+    def waiting(self) -> Dict[str, int]:
+        """各優先順序排隊中的請求數"""
+        with self._condition:
+            counts = {priority.name.lower(): 0 for priority in RequestPriority}
+            for priority, _ in self._waiters:
+                counts[RequestPriority(priority).name.lower()] += 1
+            return counts
+
+
+class AIScheduler:
+    """AI 請求排程器
+
+    - 同時送往後端的請求數不超過 max_parallel（對應 Ollama 的 OLLAMA_NUM_PARALLEL），
+      名額空出時先分配給優先順序較高的請求，讓後端的並行槽保持滿載
+    - 排隊中或進行中有相同的非串流請求（同優先順序、相同訊息與參數）時，
+      後到的請求直接等待並共用第一個請求的結果，不重複送往後端
+    - 串流請求不合併，但同樣需要取得名額，串流結束後才歸還
+    """
+
+    def __init__(self, ai_service: AIService, max_parallel: int = 4, coalesce: bool = True):
+        self.ai_service = ai_service
+        self.max_parallel = max(1, max_parallel)
+        self.coalesce = coalesce
+        self._slots = _PrioritySlots(self.max_parallel)
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._in_flight = 0
+        self._dispatched = 0
+        self._coalesced = 0
+
+    def client(self, priority: RequestPriority) -> "ScheduledAIService":
+        """取得以指定優先順序送出請求的 AI 服務"""
+        return ScheduledAIService(self, priority)
+
+    @staticmethod
+    def _request_key(messages: List[Message], priority: RequestPriority, kwargs: Dict[str, Any]) -> str:
+        """請求的合併鍵"""
+        return json.dumps(
+            [int(priority), [(msg.role.value, msg.content) for msg in messages], kwargs],
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+
+    def _dispatch_started(self) -> None:
+        with self._lock:
+            self._in_flight += 1
+            self._dispatched += 1
+
+    def _dispatch_finished(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def chat(self, messages: List[Message], priority: RequestPriority, **kwargs) -> str:
+        """排程聊天請求"""
+        key = self._request_key(messages, priority, kwargs) if self.coalesce else None
+
+        if key is not None:
+            with self._lock:
+                future = self._pending.get(key)
+                if future is not None:
+                    self._coalesced += 1
+                else:
+                    self._pending[key] = Future()
+            if future is not None:
+                return future.result()
+
+        try:
+            self._slots.acquire(priority)
+            self._dispatch_started()
+            try:
+                result = self.ai_service.chat(messages, **kwargs)
+            finally:
+                self._dispatch_finished()
+                self._slots.release()
+        except BaseException as e:
+            if key is not None:
+                self._resolve(key, exception=e)
+            raise
+
+        if key is not None:
+            self._resolve(key, result=result)
+        return result
+
+    def _resolve(self, key: str, result: Optional[str] = None, exception: Optional[BaseException] = None) -> None:
+        """將結果交給等待中的相同請求"""
+        with self._lock:
+            future = self._pending.pop(key)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def chat_stream(self, messages: List[Message], priority: RequestPriority, **kwargs) -> Iterator[str]:
+        """排程串流聊天請求，串流結束（或呼叫端提前關閉）時歸還名額"""
+        self._slots.acquire(priority)
+        self._dispatch_started()
+        try:
+            yield from self.ai_service.chat_stream(messages, **kwargs)
+        finally:
+            self._dispatch_finished()
+            self._slots.release()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """排程器與後端 AI 服務的指標"""
+        with self._lock:
+            scheduler = {
+                "max_parallel": self.max_parallel,
+                "in_flight": self._in_flight,
+                "dispatched": self._dispatched,
+                "coalesced": self._coalesced
+            }
+        scheduler["waiting"] = self._slots.waiting()
+        return {"scheduler": scheduler, **self.ai_service.get_metrics()}
+
+
+class ScheduledAIService(AIService):
+    """經由排程器以固定優先順序送出請求的 AI 服務"""
+
+    def __init__(self, scheduler: AIScheduler, priority: RequestPriority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    @property
+    def model(self) -> Optional[str]:
+        """後端 AI 服務使用的模型"""
+        return getattr(self.scheduler.ai_service, "model", None)
+
+    def chat(self, messages: List[Message], **kwargs) -> str:
+        return self.scheduler.chat(messages, self.priority, **kwargs)
+
+    def chat_stream(self, messages: List[Message], **kwargs) -> Iterator[str]:
+        return self.scheduler.chat_stream(messages, self.priority, **kwargs)
+
+    def is_available(self) -> bool:
+        return self.scheduler.ai_service.is_available()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        return self.scheduler.get_metrics()
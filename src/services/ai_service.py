@@ -2,8 +2,14 @@
 AI 服務抽象層
 """
 
+import asyncio
+import contextlib
+import queue
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional
+from concurrent.futures import Future
+from typing import List, Dict, Any, AsyncIterator, Callable, Iterator, Optional
 from enum import Enum
 
 from ..models.conversation import Message, MessageRole
@@ -12,6 +18,7 @@ from ..models.conversation import Message, MessageRole
 class AIProvider(str, Enum):
     """AI 提供者類型"""
     OLLAMA = "ollama"
+    OLLAMA_POOLED = "ollama_pooled"
     LEMONADE = "lemonade"
     OPENAI = "openai"
     MOCK = "mock"
@@ -25,18 +32,44 @@ class AIService(ABC):
         """發送聊天請求"""
         pass
     
+    def chat_stream(self, messages: List[Message], **kwargs) -> Iterator[str]:
+        """發送聊天請求並逐段返回回應（預設一次返回完整回應，支援串流的服務應覆寫）"""
+        yield self.chat(messages, **kwargs)
+    
     @abstractmethod
     def is_available(self) -> bool:
         """檢查服務是否可用"""
         pass
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """取得請求佇列指標（不支援的服務返回空字典）"""
+        return {}
+
+
+def ollama_request_options(kwargs: Dict[str, Any], keep_alive: Optional[str],
+                           options: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """在單次請求參數中補上服務預設的 keep_alive 與模型 options（請求指定的值優先）"""
+    kwargs = dict(kwargs)
+    if keep_alive is not None:
+        kwargs.setdefault("keep_alive", keep_alive)
+    if options:
+        kwargs["options"] = {**options, **(kwargs.get("options") or {})}
+    return kwargs
 
 
 class OllamaAIService(AIService):
-    """Ollama AI 服務實現"""
+    """Ollama AI 服務實現
+    
+    keep_alive 讓模型在請求之間留在記憶體中，options（例如 num_ctx）讓每個請求使用相同的執行參數；
+    兩者不變時，Ollama 能沿用上一輪相同前綴（系統提示與先前對話）的 KV 快取，只需處理新增的訊息。
+    """
     
-    def __init__(self, host: str, model: str):
+    def __init__(self, host: str, model: str, keep_alive: Optional[str] = None,
+                 options: Optional[Dict[str, Any]] = None):
         self.host = host
         self.model = model
+        self.keep_alive = keep_alive
+        self.options = options or {}
         self._client = None
         self._initialize_client()
     
@@ -62,10 +95,30 @@ class OllamaAIService(AIService):
         response = self._client.chat(
             model=self.model,
             messages=ollama_messages,
-            **kwargs
+            **ollama_request_options(kwargs, self.keep_alive, self.options)
         )
         return response['message']['content']
     
+    def chat_stream(self, messages: List[Message], **kwargs) -> Iterator[str]:
+        """發送串流聊天請求到 Ollama，模型每產生一段文字即返回"""
+        if not self._client:
+            raise RuntimeError("Ollama client not initialized")
+        
+        ollama_messages = [
+            {"role": msg.role.value, "content": msg.content}
+            for msg in messages
+        ]
+        
+        for part in self._client.chat(
+            model=self.model,
+            messages=ollama_messages,
+            stream=True,
+            **ollama_request_options(kwargs, self.keep_alive, self.options)
+        ):
+            content = part['message']['content']
+            if content:
+                yield content
+    
     def is_available(self) -> bool:
         """檢查 Ollama 服務是否可用"""
         try:
@@ -78,6 +131,204 @@ class OllamaAIService(AIService):
             return False
 
 
+class ModelQueueMetrics:
+    """單一模型的請求佇列指標"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    def enqueue(self) -> None:
+        """請求進入佇列"""
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+    
+    def start(self, wait_seconds: float) -> None:
+        """請求取得並行名額，開始送出"""
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.total_wait += wait_seconds
+            self.max_wait = max(self.max_wait, wait_seconds)
+    
+    def abandon(self) -> None:
+        """請求在等待中被取消"""
+        with self._lock:
+            self.waiting -= 1
+    
+    def finish(self, success: bool) -> None:
+        """請求完成"""
+        with self._lock:
+            self.in_flight -= 1
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """目前的指標"""
+        with self._lock:
+            started = self.completed + self.failed + self.in_flight
+            return {
+                "waiting": self.waiting,
+                "in_flight": self.in_flight,
+                "max_waiting": self.max_waiting,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_ms": round(self.total_wait / started * 1000, 1) if started else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 1)
+            }
+
+
+# 串流結束標記
+_STREAM_END = object()
+
+
+class PooledOllamaAIService(AIService):
+    """以共用連線池與每個模型的並行上限呼叫 Ollama 的 AI 服務
+    
+    提供的只有兩件事：所有請求共用一個 keep-alive 連線池，以及每個模型以 semaphore 限制同時送往 Ollama 的請求數，
+    超出的請求在佇列中等待並計入指標。實作上請求在一個背景事件迴圈上以 ollama.AsyncClient 送出，
+    但對外只有同步的 chat / chat_stream，呼叫端執行緒會等待結果。
+    """
+    
+    def __init__(self, host: str, model: str, max_concurrency: int = 4,
+                 max_connections: int = 32, timeout: Optional[float] = None,
+                 keep_alive: Optional[str] = None, options: Optional[Dict[str, Any]] = None):
+        self.host = host
+        self.model = model
+        self.keep_alive = keep_alive
+        self.options = options or {}
+        self.max_concurrency = max(1, max_concurrency)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._metrics: Dict[str, ModelQueueMetrics] = {}
+        self._client = self._create_client(max_connections, timeout)
+        
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="ollama-pool", daemon=True)
+        self._thread.start()
+    
+    def _create_client(self, max_connections: int, timeout: Optional[float]) -> Any:
+        """建立共用連線池的 Ollama 客戶端（在服務事件迴圈上使用）"""
+        try:
+            import httpx
+            import ollama
+        except ImportError:
+            raise ImportError("ollama package not installed. Run: pip install ollama")
+        
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        return ollama.AsyncClient(host=self.host, timeout=timeout, limits=limits)
+    
+    def _model_metrics(self, model: str) -> ModelQueueMetrics:
+        """取得模型的佇列指標"""
+        if model not in self._metrics:
+            self._metrics[model] = ModelQueueMetrics()
+        return self._metrics[model]
+    
+    @contextlib.asynccontextmanager
+    async def _acquire_slot(self, model: str):
+        """取得模型的並行名額（只在服務事件迴圈上使用）"""
+        semaphore = self._semaphores.get(model)
+        if semaphore is None:
+            semaphore = self._semaphores[model] = asyncio.Semaphore(self.max_concurrency)
+        metrics = self._model_metrics(model)
+        
+        metrics.enqueue()
+        queued_at = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            metrics.abandon()
+            raise
+        metrics.start(time.perf_counter() - queued_at)
+        
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            semaphore.release()
+            metrics.finish(success)
+    
+    @staticmethod
+    def _to_ollama_messages(messages: List[Message]) -> List[Dict[str, str]]:
+        """轉換訊息格式"""
+        return [{"role": msg.role.value, "content": msg.content} for msg in messages]
+    
+    async def _chat(self, messages: List[Message], kwargs: Dict[str, Any]) -> str:
+        """在服務事件迴圈上送出聊天請求"""
+        model = kwargs.pop("model", self.model)
+        async with self._acquire_slot(model):
+            response = await self._client.chat(
+                model=model,
+                messages=self._to_ollama_messages(messages),
+                **ollama_request_options(kwargs, self.keep_alive, self.options)
+            )
+        return response['message']['content']
+    
+    async def _stream(self, messages: List[Message], kwargs: Dict[str, Any]) -> AsyncIterator[str]:
+        """在服務事件迴圈上送出串流聊天請求，串流結束前持續佔用並行名額"""
+        model = kwargs.pop("model", self.model)
+        async with self._acquire_slot(model):
+            async for part in await self._client.chat(
+                model=model,
+                messages=self._to_ollama_messages(messages),
+                stream=True,
+                **ollama_request_options(kwargs, self.keep_alive, self.options)
+            ):
+                content = part['message']['content']
+                if content:
+                    yield content
+    
+    def _pump_stream(self, messages: List[Message], kwargs: Dict[str, Any], put: Callable[[Any], None]) -> Future:
+        """在服務事件迴圈上讀取串流，每段文字交給 put，結束時送出 _STREAM_END"""
+        async def pump():
+            async for content in self._stream(messages, kwargs):
+                put(content)
+        
+        future = asyncio.run_coroutine_threadsafe(pump(), self._loop)
+        future.add_done_callback(lambda _: put(_STREAM_END))
+        return future
+    
+    def chat(self, messages: List[Message], **kwargs) -> str:
+        """同步聊天請求：在服務事件迴圈上執行並等待結果"""
+        return asyncio.run_coroutine_threadsafe(self._chat(messages, kwargs), self._loop).result()
+    
+    def chat_stream(self, messages: List[Message], **kwargs) -> Iterator[str]:
+        """同步串流聊天請求：服務事件迴圈讀取串流，呼叫端執行緒逐段取得"""
+        chunks: queue.Queue = queue.Queue()
+        future = self._pump_stream(messages, kwargs, chunks.put)
+        try:
+            while (content := chunks.get()) is not _STREAM_END:
+                yield content
+        finally:
+            # 呼叫端提前結束（例如客戶端斷線）時取消請求，釋放並行名額
+            future.cancel()
+        future.result()
+    
+    def is_available(self) -> bool:
+        """檢查 Ollama 服務是否可用"""
+        try:
+            asyncio.run_coroutine_threadsafe(self._client.list(), self._loop).result(timeout=5)
+            return True
+        except Exception:
+            return False
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """各模型的佇列深度、進行中請求數與等待時間"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "models": {model: metrics.snapshot() for model, metrics in list(self._metrics.items())}
+        }
+
+
 class LemonadeAIService(AIService):
     """Lemonade AI 服務實現"""
     
@@ -116,6 +367,10 @@ class MockAIService(AIService):
             return f"[Mock AI] 回應: {last_message.content}"
         return "[Mock AI] 這是一個模擬回應"
     
+    def chat_stream(self, messages: List[Message], **kwargs) -> Iterator[str]:
+        """逐字返回模擬回應，用於測試前端的串流顯示"""
+        yield from self.chat(messages, **kwargs)
+    
     def is_available(self) -> bool:
         """模擬服務總是可用"""
         return True
@@ -130,7 +385,19 @@ class AIServiceFactory:
         if provider == AIProvider.OLLAMA:
             return OllamaAIService(
                 host=kwargs.get("host", "http://127.0.0.1:11434"),
-                model=kwargs.get("model", "llama3:8b")
+                model=kwargs.get("model", "llama3:8b"),
+                keep_alive=kwargs.get("keep_alive"),
+                options=kwargs.get("options")
+            )
+        elif provider == AIProvider.OLLAMA_POOLED:
+            return PooledOllamaAIService(
+                host=kwargs.get("host", "http://127.0.0.1:11434"),
+                model=kwargs.get("model", "llama3:8b"),
+                max_concurrency=kwargs.get("max_concurrency", 4),
+                max_connections=kwargs.get("max_connections", 32),
+                timeout=kwargs.get("timeout"),
+                keep_alive=kwargs.get("keep_alive"),
+                options=kwargs.get("options")
             )
         elif provider == AIProvider.LEMONADE:
             return LemonadeAIService()
@@ -139,6 +406,14 @@ class AIServiceFactory:
         else:
             raise ValueError(f"Unsupported AI provider: {provider}")
     
+    @staticmethod
+    def _ollama_options(config) -> Dict[str, Any]:
+        """由配置產生 Ollama 的模型 options"""
+        options = {}
+        if config.ollama_num_ctx > 0:
+            options["num_ctx"] = config.ollama_num_ctx
+        return options
+    
     @staticmethod
     def create_from_config(config) -> AIService:
         """從配置創建 AI 服務"""
@@ -147,7 +422,19 @@ class AIServiceFactory:
         if provider == AIProvider.OLLAMA:
             return OllamaAIService(
                 host=config.ollama_host,
-                model=config.ollama_model
+                model=config.ollama_model,
+                keep_alive=config.ollama_keep_alive or None,
+                options=AIServiceFactory._ollama_options(config)
+            )
+        elif provider == AIProvider.OLLAMA_POOLED:
+            return PooledOllamaAIService(
+                host=config.ollama_host,
+                model=config.ollama_model,
+                max_concurrency=config.ollama_max_concurrency,
+                max_connections=config.ollama_max_connections,
+                timeout=config.ollama_request_timeout,
+                keep_alive=config.ollama_keep_alive or None,
+                options=AIServiceFactory._ollama_options(config)
             )
         elif provider == AIProvider.LEMONADE:
             return LemonadeAIService()
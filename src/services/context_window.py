@@ -0,0 +1,161 @@
+"""
+對話上下文視窗
+依 token 預算決定送給模型的訊息：系統提示與最近的對話原文保留，較早的對話摺疊成滾動摘要，
+摘要在背景增量更新，不佔用問診請求的時間
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from .ai_service import AIService, Message, MessageRole
+
+
+# 較早的訊息以此數量為單位摺疊進摘要，避免每輪都呼叫模型；摺疊點固定，相同的對話前綴會對應到相同的摘要
+SUMMARY_FOLD_BLOCK = 4
+
+# 摘要長度上限（字元），模型未遵守字數要求時截斷，避免摘要本身不斷變長
+SUMMARY_MAX_CHARS = 600
+
+# 每則訊息的角色標記等額外 token
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+SUMMARY_INSTRUCTIONS = (
+    "你是病歷紀錄助理。請將以下醫學生與標準化病人的問診對話，整合進既有摘要，"
+    "以繁體中文條列：學生已詢問或執行的項目、病人已透露的資訊（症狀、病史、數值）。"
+    "只記錄對話中出現的事實，不要推測，總長度不超過 300 字。"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：中日韓文字與全形符號約一字一 token，其餘約四個字元一 token"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(messages: List[Message]) -> int:
+    """粗估訊息列表的 token 數"""
+    return sum(estimate_tokens(msg.content) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+
+class ConversationContextManager:
+    """以 token 預算組出每輪送給模型的訊息
+
+    - 系統提示一律保留
+    - 最近 keep_turns 輪（使用者與病人各一則為一輪）以原文保留
+    - 更早的訊息由背景執行緒以 summary_ai_service 摺疊進滾動摘要，摘要作為第二則系統訊息送出
+    - 摘要尚未涵蓋的訊息以原文送出；總量仍超過預算時從最舊的訊息開始，以 SUMMARY_FOLD_BLOCK 則為單位捨棄，
+      最新一則一定保留
+
+    模型後端的前綴 KV 快取：系統提示永遠是第一則且內容固定，一定能命中。
+    摘要與原文視窗的起點只在摺疊點（每 SUMMARY_FOLD_BLOCK 則訊息）改變，兩個摺疊點之間
+    每輪的訊息都是上一輪加上新訊息，整段前綴都能沿用；摺疊點改變的那一輪只有系統提示之後的部分需要重新處理。
+
+    摘要以 (scope, 被摘要的訊息前綴) 的雜湊為鍵保存，不依賴對話物件本身：
+    同一段對話在不同請求中重建，或多個對話有相同的開頭，都能沿用已算好的摘要。
+    新摘要由前一個摺疊點的摘要加上新摺疊的訊息增量產生。
+    """
+
+    def __init__(self, summary_ai_service: Optional[AIService], token_budget: int = 6144,
+                 keep_turns: int = 8, summarize: bool = True, max_summaries: int = 1024):
+        self.summary_ai_service = summary_ai_service
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.summarize = summarize and summary_ai_service is not None
+        self.max_summaries = max_summaries
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-summary")
+
+    def _fold_point(self, history_length: int) -> int:
+        """應摺疊進摘要的訊息數（SUMMARY_FOLD_BLOCK 的倍數）"""
+        foldable = history_length - self.keep_turns * 2
+        return max(0, foldable // SUMMARY_FOLD_BLOCK * SUMMARY_FOLD_BLOCK)
+
+    @staticmethod
+    def _prefix_keys(scope: str, history: List[Message], fold_until: int) -> List[Tuple[int, str]]:
+        """每個摺疊點的 (訊息數, 前綴雜湊)"""
+        hasher = hashlib.sha256(scope.encode("utf-8"))
+        keys = []
+        for count, msg in enumerate(history[:fold_until], 1):
+            hasher.update(f"\x00{msg.role.value}\x00{msg.content}".encode("utf-8"))
+            if count % SUMMARY_FOLD_BLOCK == 0:
+                keys.append((count, hasher.hexdigest()))
+        return keys
+
+    def _latest_summary(self, keys: List[Tuple[int, str]]) -> Tuple[int, str]:
+        """已算好的摘要中涵蓋最多訊息者，返回 (涵蓋的訊息數, 摘要)"""
+        with self._lock:
+            for count, key in reversed(keys):
+                summary = self._summaries.get(key)
+                if summary is not None:
+                    self._summaries.move_to_end(key)
+                    return count, summary
+        return 0, ""
+
+    def build_messages(self, scope: str, system_prompt: str, history: List[Message]) -> List[Message]:
+        """組出本輪送給模型的訊息"""
+        keys = self._prefix_keys(scope, history, self._fold_point(len(history))) if self.summarize else []
+        summarized_count, summary = self._latest_summary(keys)
+
+        prefix = [Message(role=MessageRole.SYSTEM, content=system_prompt)]
+        if summary:
+            prefix.append(Message(role=MessageRole.SYSTEM, content=f"【先前對話摘要】\n{summary}"))
+
+        start = summarized_count
+        if self.token_budget > 0 and history:
+            available = self.token_budget - estimate_message_tokens(prefix)
+            remaining = estimate_message_tokens(history[start:])
+            # 起點只落在摺疊單位的邊界上，避免每輪移動一則而使前綴快取失效
+            while start < len(history) - 1 and remaining > available:
+                next_start = min((start // SUMMARY_FOLD_BLOCK + 1) * SUMMARY_FOLD_BLOCK, len(history) - 1)
+                remaining -= estimate_message_tokens(history[start:next_start])
+                start = next_start
+        return prefix + list(history[start:])
+
+    def schedule_summary(self, scope: str, history: List[Message]) -> Optional[Future]:
+        """視需要在背景將較早的訊息摺疊進摘要；摘要已存在或正在產生時不做事"""
+        if not self.summarize:
+            return None
+        keys = self._prefix_keys(scope, history, self._fold_point(len(history)))
+        if not keys:
+            return None
+        fold_until, key = keys[-1]
+        with self._lock:
+            if key in self._summaries or key in self._pending:
+                return None
+        previous_count, previous = self._latest_summary(keys)
+        folded = list(history[previous_count:fold_until])
+        with self._lock:
+            if key in self._pending:
+                return None
+            future = self._pending[key] = self._executor.submit(self._summarize, key, previous, folded)
+            return future
+
+    def _summarize(self, key: str, previous: str, folded: List[Message]) -> None:
+        """產生新的摘要（在背景執行緒執行）"""
+        try:
+            transcript = "\n".join(
+                f"{'學生' if msg.role == MessageRole.USER else '病人'}：{msg.content}" for msg in folded
+            )
+            summary = self.summary_ai_service.chat([
+                Message(role=MessageRole.SYSTEM, content=SUMMARY_INSTRUCTIONS),
+                Message(role=MessageRole.USER, content=f"既有摘要：\n{previous or '（無）'}\n\n新的對話：\n{transcript}")
+            ]).strip()[:SUMMARY_MAX_CHARS]
+            if summary:
+                with self._lock:
+                    self._summaries[key] = summary
+                    while len(self._summaries) > self.max_summaries:
+                        self._summaries.popitem(last=False)
+        except Exception as e:
+            # 摘要失敗時沿用前一個摘要，未摘要的訊息仍以原文送出（受 token 預算限制）
+            print(f"⚠️ 對話摘要失敗: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
@@ -3,7 +3,8 @@
 """
 
 import re
-from typing import List, Dict, Any, Optional
+import uuid
+from typing import List, Dict, Any, Iterator, Optional
 from datetime import datetime
 
 from ..models.conversation import Conversation, Message, MessageRole, ConversationState
@@ -11,22 +12,35 @@ from ..models.case import Case
 from ..models.vital_signs import VitalSigns
 from ..services.ai_service import get_ai_service
 from ..services.case_service import CaseService
+from ..services.context_window import ConversationContextManager
+from ..services.response_cache import ResponseCache
 from ..config.settings import get_settings
 
 
 class ConversationService:
     """對話管理服務"""
     
-    def __init__(self, settings=None, case_service=None, ai_service=None):
+    def __init__(self, settings=None, case_service=None, ai_service=None, summary_ai_service=None):
         self.settings = settings or get_settings()
         self.case_service = case_service or CaseService(self.settings)
         self.ai_service = ai_service or get_ai_service(self.settings)
         self._conversations: Dict[str, Conversation] = {}
+        self.context_manager = ConversationContextManager(
+            summary_ai_service or self.ai_service,
+            token_budget=self.settings.context_token_budget,
+            keep_turns=self.settings.context_keep_turns,
+            summarize=self.settings.context_summary_enabled
+        )
+        self.response_cache = ResponseCache(
+            max_size=self.settings.response_cache_size,
+            ttl=self.settings.response_cache_ttl,
+            variants=self.settings.response_cache_variants
+        ) if self.settings.response_cache_enabled else None
     
     def create_conversation(self, case_id: str) -> tuple[Conversation, str]:
         """創建新對話"""
         conversation = Conversation(case_id=case_id)
-        conversation_id = f"{case_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        conversation_id = f"{case_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
         self._conversations[conversation_id] = conversation
         return conversation, conversation_id
     
@@ -34,6 +48,10 @@ class ConversationService:
         """取得對話"""
         return self._conversations.get(conversation_id)
     
+    def remove_conversation(self, conversation_id: str) -> Optional[Conversation]:
+        """移除並返回對話"""
+        return self._conversations.pop(conversation_id, None)
+    
     def add_message(self, conversation_id: str, role: MessageRole, content: str) -> Optional[Conversation]:
         """新增訊息到對話"""
         conversation = self._conversations.get(conversation_id)
@@ -54,13 +72,16 @@ class ConversationService:
         if not case:
             return "錯誤：找不到指定的案例檔案。"
         
-        # 構建訊息列表
-        messages = [Message(role=MessageRole.SYSTEM, content=case.get_system_prompt())]
-        messages.extend(conversation.messages)
+        messages = self._build_messages(conversation, case)
         
-        # 生成回應
+        # 生成回應（相同案例與對話歷史可直接使用快取）
         try:
-            response = self.ai_service.chat(messages)
+            cache_key = self._response_cache_key(conversation, messages)
+            response = self.response_cache.get(cache_key) if cache_key else None
+            if response is None:
+                response = self.ai_service.chat(messages)
+                if cache_key:
+                    self.response_cache.put(cache_key, response)
             
             # 更新覆蓋率和生命體徵
             self._update_conversation_metrics(conversation, case)
@@ -69,6 +90,57 @@ class ConversationService:
         except Exception as e:
             return f"AI 服務錯誤：{str(e)}"
     
+    def stream_ai_response(self, conversation_id: str) -> Iterator[str]:
+        """以串流方式生成 AI 回應，逐段返回模型產生的文字
+        
+        回應完整產生後才更新覆蓋率和生命體徵；AI 服務錯誤會直接拋出，由呼叫端回報。
+        """
+        conversation = self._conversations.get(conversation_id)
+        if not conversation:
+            return
+        
+        # 載入案例
+        case = self.case_service.get_case(conversation.case_id)
+        if not case:
+            yield "錯誤：找不到指定的案例檔案。"
+            return
+        
+        messages = self._build_messages(conversation, case)
+        
+        cache_key = self._response_cache_key(conversation, messages)
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            yield cached
+        else:
+            parts = []
+            for token in self.ai_service.chat_stream(messages):
+                parts.append(token)
+                yield token
+            if cache_key:
+                self.response_cache.put(cache_key, "".join(parts))
+        
+        # 更新覆蓋率和生命體徵
+        self._update_conversation_metrics(conversation, case)
+    
+    def _build_messages(self, conversation: Conversation, case: Case) -> List[Message]:
+        """構建訊息列表：系統提示、較早對話的摘要與 token 預算內的最近對話"""
+        messages = self.context_manager.build_messages(
+            conversation.case_id, case.get_system_prompt(), conversation.messages
+        )
+        # 較早的對話在背景摺疊進摘要，供之後的回合使用
+        self.context_manager.schedule_summary(conversation.case_id, conversation.messages)
+        return messages
+    
+    def _response_cache_key(self, conversation: Conversation, messages: List[Message]) -> Optional[str]:
+        """回應快取鍵；未啟用快取或對話已超過快取的輪數時返回 None"""
+        if self.response_cache is None:
+            return None
+        max_turns = self.settings.response_cache_max_turns
+        if max_turns and len(conversation.get_user_messages()) > max_turns:
+            return None
+        model = getattr(self.ai_service, "model", None) or type(self.ai_service).__name__
+        return ResponseCache.make_key(conversation.case_id, model, messages)
+    
     def _update_conversation_metrics(self, conversation: Conversation, case: Case) -> None:
         """更新對話指標（覆蓋率、生命體徵等）"""
         # 計算覆蓋率
@@ -90,14 +162,15 @@ class ConversationService:
         if not user_messages:
             return conversation.coverage
         
-        # 只分析最新的使用者訊息
-        latest_message = user_messages[-1].content.lower()
+        # 只分析最新的使用者訊息，單次掃描找出所有項目命中的關鍵字
+        latest_message = user_messages[-1].content
+        matched_by_item = case.get_checklist_matcher().matched_keywords(latest_message)
         
         # 檢查是否有新的覆蓋項目
         new_covered_items = []
         new_partially_covered_items = []
         
-        for item in checklist:
+        for index, item in enumerate(checklist):
             item_id = item.get('id', '')
             if not item_id:
                 continue
@@ -106,8 +179,7 @@ class ConversationService:
             if item_id in conversation.covered_items:
                 continue
             
-            keywords = item.get('keywords', [])
-            matched_keywords = [kw for kw in keywords if kw.lower() in latest_message]
+            matched_keywords = matched_by_item.get(index, [])
             
             # 完全覆蓋：匹配2個或以上關鍵字
             if len(matched_keywords) >= 2:
@@ -0,0 +1,249 @@
+"""
+RAG 快取
+"""
+
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from ..utils.text_processing import normalize_text
+
+
+class QueryEmbeddingCache:
+    """查詢向量 LRU 快取，可選擇持久化到磁碟
+
+    快取鍵為 (模型名稱, 正規化查詢文字)，命中時可完全跳過 embedding 模型的 forward pass。
+    持久化不佔用查詢的時間：每累積 save_every 筆新向量在背景執行緒寫入一次，其餘在行程結束時寫入。
+    """
+
+    def __init__(self, model_name: str, max_size: int = 1024, persist_path: Optional[Path] = None,
+                 save_every: int = 32):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.persist_path = persist_path
+        self.save_every = save_every
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.RLock()
+        # 寫檔期間持有，背景寫入與 save() 不會同時寫同一個暫存檔
+        self._save_lock = threading.Lock()
+        # 變更次數：_saved_version 為最後一次成功寫入時的值，_scheduled_version 為最後一次排程背景寫入時的值
+        self._version = 0
+        self._saved_version = 0
+        self._scheduled_version = 0
+        self._saver: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+
+        if self.persist_path:
+            self._load()
+            atexit.register(self.save)
+
+    def _make_key(self, text: str) -> str:
+        """產生快取鍵"""
+        return f"{self.model_name}\x00{normalize_text(text)}"
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """取得單一查詢的向量，未命中時返回 None"""
+        key = self._make_key(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, text: str, vector: np.ndarray) -> None:
+        """寫入查詢向量"""
+        if self.max_size <= 0:
+            return
+        key = self._make_key(text)
+        with self._lock:
+            self._entries[key] = np.asarray(vector, dtype=np.float32)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._version += 1
+            if self.persist_path and 0 < self.save_every <= self._version - self._scheduled_version:
+                self._save_in_background()
+
+    def _save_in_background(self) -> None:
+        """在背景執行緒寫入磁碟，前一次寫入尚未完成時不重複啟動（需持有鎖）"""
+        if self._saver is not None and self._saver.is_alive():
+            return
+        self._scheduled_version = self._version
+        self._saver = threading.Thread(target=self.save, name="query-cache-save", daemon=True)
+        self._saver.start()
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """批次取得向量，順序與 texts 對應"""
+        return [self.get(text) for text in texts]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """清除快取"""
+        with self._lock:
+            self._entries.clear()
+            self._version += 1
+
+    @property
+    def dirty(self) -> bool:
+        """是否有尚未寫入磁碟的變更"""
+        return self._version != self._saved_version
+
+    def save(self) -> bool:
+        """將快取寫入磁碟（僅在有變更時寫入）
+
+        寫入失敗或略過時保留未寫入狀態，下次呼叫會再嘗試。
+        """
+        # 不主動建立索引目錄，避免被誤判為已建立索引
+        if not self.persist_path or not self.persist_path.parent.exists():
+            return False
+
+        with self._save_lock:
+            with self._lock:
+                if not self.dirty:
+                    return False
+                keys = list(self._entries.keys())
+                vectors = list(self._entries.values())
+                version = self._version
+
+            try:
+                tmp_path = self.persist_path.with_name(self.persist_path.name + ".tmp")
+                with open(tmp_path, "wb") as f:
+                    np.savez(
+                        f,
+                        keys=np.array(keys, dtype=str),
+                        vectors=np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+                    )
+                os.replace(tmp_path, self.persist_path)
+            except Exception as e:
+                print(f"⚠️ [RAG] 查詢向量快取儲存失敗: {e}")
+                return False
+
+            # 寫入期間新增的向量仍視為未寫入
+            with self._lock:
+                self._saved_version = version
+            return True
+
+    def _load(self) -> None:
+        """從磁碟載入快取"""
+        if not self.persist_path.exists():
+            return
+
+        try:
+            with np.load(self.persist_path, allow_pickle=False) as data:
+                keys = data["keys"].tolist()
+                vectors = data["vectors"]
+
+            prefix = f"{self.model_name}\x00"
+            for key, vector in zip(keys, vectors):
+                # 只載入同一個 embedding 模型產生的向量
+                if key.startswith(prefix):
+                    self._entries[key] = vector
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            print(f"💡 [RAG] 已載入 {len(self._entries)} 筆查詢向量快取")
+        except Exception as e:
+            print(f"⚠️ [RAG] 查詢向量快取載入失敗: {e}")
+            self._entries.clear()
+
+
+# 快取未命中的標記（與「已快取但無結果」的 None 區分）
+CACHE_MISS = object()
+
+
+class RetrievalResultCache:
+    """預先計算的檢索結果快取
+
+    固定查詢詞彙的檢索結果在同一份索引下是常數，以 (類型, 查詢, k) 為鍵存放於記憶體，
+    並以索引指紋標記版本；索引改變時指紋不同，舊結果自動失效。
+    """
+
+    def __init__(self, persist_path: Optional[Path] = None):
+        self.persist_path = persist_path
+        self.fingerprint: Optional[str] = None
+        self._entries: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+
+    @staticmethod
+    def _make_key(kind: str, query: str, k: int) -> str:
+        """產生快取鍵"""
+        return f"{kind}\x00{k}\x00{normalize_text(query)}"
+
+    def reset(self, fingerprint: Optional[str]) -> None:
+        """切換到新的索引指紋並清空結果"""
+        with self._lock:
+            self.fingerprint = fingerprint
+            self._entries.clear()
+
+    def get(self, kind: str, query: str, k: int) -> Any:
+        """取得快取結果，未命中時返回 CACHE_MISS"""
+        with self._lock:
+            value = self._entries.get(self._make_key(kind, query, k), CACHE_MISS)
+            if value is not CACHE_MISS:
+                self.hits += 1
+            return value
+
+    def contains(self, kind: str, query: str, k: int) -> bool:
+        """檢查是否已有快取結果"""
+        with self._lock:
+            return self._make_key(kind, query, k) in self._entries
+
+    def put(self, kind: str, query: str, k: int, value: Any) -> None:
+        """寫入結果（value 必須可 JSON 序列化）"""
+        with self._lock:
+            self._entries[self._make_key(kind, query, k)] = value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def save(self) -> bool:
+        """將結果與索引指紋寫入磁碟"""
+        if not self.persist_path or not self.persist_path.parent.exists():
+            return False
+
+        with self._lock:
+            payload = {"fingerprint": self.fingerprint, "entries": dict(self._entries)}
+
+        try:
+            tmp_path = self.persist_path.with_name(self.persist_path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+            return True
+        except Exception as e:
+            print(f"⚠️ [RAG] 預計算結果儲存失敗: {e}")
+            return False
+
+    def load(self, fingerprint: str) -> bool:
+        """載入磁碟上的結果；指紋不符時視為失效，只重設指紋"""
+        self.reset(fingerprint)
+        if not self.persist_path or not self.persist_path.exists():
+            return False
+
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except Exception as e:
+            print(f"⚠️ [RAG] 預計算結果載入失敗: {e}")
+            return False
+
+        if payload.get("fingerprint") != fingerprint:
+            print("💡 [RAG] 索引已變更，預計算結果失效")
+            return False
+
+        with self._lock:
+            self._entries.update(payload.get("entries", {}))
+        print(f"💡 [RAG] 已載入 {len(self._entries)} 筆預計算檢索結果")
+        return True
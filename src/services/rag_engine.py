@@ -0,0 +1,287 @@
+"""
+FAISS 直接檢索引擎
+直接讀取 index.faiss 與欄式 chunk 儲存，不經過 langchain 的 FAISS 包裝與 pickle docstore；
+查詢延遲由 FAISS 搜尋主導，與 langchain 路徑相當，差別在每次查詢配置的 Python 物件較少
+"""
+
+import hashlib
+import json
+import mmap
+from pathlib import Path
+from typing import Any, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+CHUNK_STORE_DIRNAME = "chunk_store"
+
+
+def is_inner_product_index(index: Any) -> bool:
+    """索引是否使用內積（餘弦）度量"""
+    import faiss
+    return index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+
+def _faiss_metric(metric: str) -> int:
+    """將設定值轉換為 faiss 度量常數"""
+    import faiss
+    if metric == "ip":
+        return faiss.METRIC_INNER_PRODUCT
+    if metric == "l2":
+        return faiss.METRIC_L2
+    raise ValueError(f"Unsupported index metric: {metric}")
+
+
+def build_faiss_index(vectors: np.ndarray, metric: str = "l2", index_type: str = "flat",
+                      hnsw_m: int = 32, hnsw_ef_construction: int = 200,
+                      ivf_nlist: int = 0, ivf_pq_m: int = 16) -> Any:
+    """建立並填入 FAISS 索引
+
+    Args:
+        vectors: (n, d) float32 向量
+        metric: "l2" 或 "ip"
+        index_type: "flat"（精確搜尋）、"hnsw"（圖索引）或 "ivfpq"（倒排 + 乘積量化）
+        hnsw_m: HNSW 每個節點的連結數
+        hnsw_ef_construction: HNSW 建立時的搜尋寬度
+        ivf_nlist: IVF 分群數，0 表示依資料量自動決定（約 4·√n）
+        ivf_pq_m: PQ 子向量數（需整除向量維度）
+    """
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dimension = vectors.shape
+    faiss_metric = _faiss_metric(metric)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss_metric)
+        index.hnsw.efConstruction = hnsw_ef_construction
+    elif index_type == "ivfpq":
+        # PQ 每個子量化器需要至少 256 個訓練點，資料太少時退回平面索引
+        if num_vectors < 256:
+            print(f"⚠️ 向量數 ({num_vectors}) 不足以訓練 IVF-PQ，改用平面索引")
+            return build_faiss_index(vectors, metric, "flat")
+        nlist = ivf_nlist or int(4 * np.sqrt(num_vectors))
+        nlist = max(1, min(nlist, num_vectors // 39))
+        pq_m = max(m for m in range(1, min(ivf_pq_m, dimension) + 1) if dimension % m == 0)
+        quantizer = faiss.IndexFlat(dimension, faiss_metric)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, 8, faiss_metric)
+        index.train(vectors)
+    elif index_type == "flat":
+        index = faiss.IndexFlat(dimension, faiss_metric)
+    else:
+        raise ValueError(f"Unsupported index type: {index_type}")
+
+    index.add(vectors)
+    return index
+
+
+def configure_search_params(index: Any, hnsw_ef_search: int, ivf_nprobe: int) -> None:
+    """設定近似索引的搜尋參數（平面索引不受影響）"""
+    import faiss
+
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = hnsw_ef_search
+
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index.nprobe = ivf_nprobe
+
+
+def describe_index(index: Any) -> str:
+    """索引類型名稱"""
+    if getattr(index, "hnsw", None) is not None:
+        return "hnsw"
+    import faiss
+    if faiss.try_extract_index_ivf(index) is not None:
+        return "ivfpq"
+    return "flat"
+
+
+def _mmap_io_flags() -> int:
+    """唯讀記憶體映射的 faiss 讀取旗標
+
+    IO_FLAG_MMAP 只會映射 IVF 的倒排表，平面向量仍會複製到行程記憶體；
+    IO_FLAG_MMAP_IFC（faiss >= 1.8）才會直接映射平面向量與 HNSW 的儲存。
+    """
+    import faiss
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class RetrievedChunk(NamedTuple):
+    """檢索到的知識片段"""
+    chunk_id: int
+    text: str
+    source: str
+    page: int
+
+
+class ChunkStore:
+    """欄式 chunk 儲存
+
+    以 FAISS 向量位置為 chunk ID，各欄位分開存放：
+    - text.bin：所有 chunk 文字的 UTF-8 串接
+    - offsets.npy：每個 chunk 在 text.bin 中的起訖位置（長度 n+1）
+    - source_codes.npy / sources.json：來源檔案的字典編碼
+    - pages.npy：頁碼（從 0 開始）
+
+    text_blob 可以是 bytes 或唯讀 mmap，各欄位可以是一般陣列或 np.memmap。
+    """
+
+    def __init__(self, text_blob: bytes, offsets: np.ndarray, source_codes: np.ndarray,
+                 sources: List[str], pages: np.ndarray):
+        self.text_blob = text_blob
+        self.offsets = offsets
+        self.source_codes = source_codes
+        self.sources = sources
+        self.pages = pages
+        self._content_hash: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def content_hash(self) -> str:
+        """chunk 文字與切分位置的 SHA-256，供衍生索引（斷句結果、BM25）判斷是否由同一份內容建立"""
+        if self._content_hash is None:
+            digest = hashlib.sha256()
+            digest.update(np.ascontiguousarray(self.offsets, dtype=np.int64).tobytes())
+            digest.update(self.text_blob)
+            self._content_hash = digest.hexdigest()
+        return self._content_hash
+
+    def text(self, chunk_id: int) -> str:
+        """取得 chunk 文字"""
+        start, end = self.offsets[chunk_id], self.offsets[chunk_id + 1]
+        return bytes(self.text_blob[start:end]).decode("utf-8")
+
+    def source(self, chunk_id: int) -> str:
+        """取得 chunk 來源檔案"""
+        return self.sources[self.source_codes[chunk_id]]
+
+    def page(self, chunk_id: int) -> int:
+        """取得 chunk 頁碼（從 0 開始）"""
+        return int(self.pages[chunk_id])
+
+    def get(self, chunk_id: int) -> RetrievedChunk:
+        """取得完整 chunk"""
+        return RetrievedChunk(chunk_id, self.text(chunk_id), self.source(chunk_id), self.page(chunk_id))
+
+    @classmethod
+    def from_records(cls, records: Iterable[Tuple[str, str, int]]) -> "ChunkStore":
+        """由 (text, source, page) 記錄建立，記錄順序必須與向量加入索引的順序一致"""
+        encoded_texts = []
+        source_codes = []
+        pages = []
+        source_ids = {}
+
+        for text, source, page in records:
+            encoded_texts.append(text.encode("utf-8"))
+            source_codes.append(source_ids.setdefault(source, len(source_ids)))
+            pages.append(page)
+
+        offsets = np.zeros(len(encoded_texts) + 1, dtype=np.int64)
+        if encoded_texts:
+            np.cumsum([len(text) for text in encoded_texts], out=offsets[1:])
+
+        return cls(
+            text_blob=b"".join(encoded_texts),
+            offsets=offsets,
+            source_codes=np.asarray(source_codes, dtype=np.int32),
+            sources=list(source_ids),
+            pages=np.asarray(pages, dtype=np.int32)
+        )
+
+    @classmethod
+    def from_langchain(cls, vector_store: Any) -> "ChunkStore":
+        """由 langchain FAISS 向量庫匯出（依向量位置排序）"""
+        records = []
+        for position in range(vector_store.index.ntotal):
+            doc = vector_store.docstore.search(vector_store.index_to_docstore_id[position])
+            records.append((
+                doc.page_content,
+                doc.metadata.get("source", "未知來源"),
+                int(doc.metadata.get("page", 0))
+            ))
+        return cls.from_records(records)
+
+    def save(self, directory: Path) -> None:
+        """寫入目錄"""
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / "text.bin").write_bytes(bytes(self.text_blob))
+        np.save(directory / "offsets.npy", self.offsets)
+        np.save(directory / "source_codes.npy", self.source_codes)
+        np.save(directory / "pages.npy", self.pages)
+        with open(directory / "sources.json", "w", encoding="utf-8") as f:
+            json.dump(self.sources, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: Path, use_mmap: bool = False) -> "ChunkStore":
+        """從目錄載入
+
+        use_mmap=True 時以唯讀記憶體映射開啟 text.bin 與各 .npy 欄位，
+        多個 worker 行程透過 page cache 共用同一份實體記憶體。
+        """
+        with open(directory / "sources.json", "r", encoding="utf-8") as f:
+            sources = json.load(f)
+        mmap_mode = "r" if use_mmap else None
+        return cls(
+            text_blob=cls._read_text_blob(directory / "text.bin", use_mmap),
+            offsets=np.load(directory / "offsets.npy", mmap_mode=mmap_mode),
+            source_codes=np.load(directory / "source_codes.npy", mmap_mode=mmap_mode),
+            sources=sources,
+            pages=np.load(directory / "pages.npy", mmap_mode=mmap_mode)
+        )
+
+    @staticmethod
+    def _read_text_blob(path: Path, use_mmap: bool) -> Any:
+        """讀取 chunk 文字檔（空檔案無法映射，直接讀取）"""
+        if not use_mmap or path.stat().st_size == 0:
+            return path.read_bytes()
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def exists(directory: Path) -> bool:
+        """檢查目錄中是否有完整的 chunk 儲存"""
+        return all((directory / name).exists() for name in
+                   ("text.bin", "offsets.npy", "source_codes.npy", "pages.npy", "sources.json"))
+
+
+class FaissRetrievalEngine:
+    """直接使用 faiss 與 numpy 的檢索引擎"""
+
+    def __init__(self, index: Any, chunk_store: ChunkStore):
+        if index.ntotal != len(chunk_store):
+            raise ValueError(f"索引向量數 ({index.ntotal}) 與 chunk 數 ({len(chunk_store)}) 不一致")
+        self.index = index
+        self.chunk_store = chunk_store
+
+    @classmethod
+    def load(cls, index_dir: Path, use_mmap: bool = False) -> "FaissRetrievalEngine":
+        """從索引目錄載入 index.faiss 與 chunk 儲存
+
+        use_mmap=True 時索引與 chunk 儲存皆以唯讀記憶體映射載入，不複製到行程私有記憶體。
+        """
+        import faiss
+        index_path = str(index_dir / "index.faiss")
+        if use_mmap:
+            index = faiss.read_index(index_path, _mmap_io_flags())
+        else:
+            index = faiss.read_index(index_path)
+        return cls(index, ChunkStore.load(index_dir / CHUNK_STORE_DIRNAME, use_mmap=use_mmap))
+
+    def search(self, query_vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """多列向量搜尋，返回 (scores, chunk_ids)，無結果的位置 chunk_id 為 -1"""
+        return self.index.search(np.ascontiguousarray(query_vectors, dtype=np.float32), k)
+
+    def search_chunks(self, query_vectors: np.ndarray, k: int) -> List[List[Tuple[RetrievedChunk, float]]]:
+        """多列向量搜尋並取出對應的 chunk"""
+        scores, chunk_ids = self.search(query_vectors, k)
+        return [
+            [
+                (self.chunk_store.get(int(chunk_id)), float(score))
+                for score, chunk_id in zip(row_scores, row_ids)
+                if chunk_id != -1
+            ]
+            for row_scores, row_ids in zip(scores, chunk_ids)
+        ]
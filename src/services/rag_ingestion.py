@@ -0,0 +1,266 @@
+"""
+RAG 文件匯入管線
+分成三個階段並行處理：
+1. 載入：以行程池解析 PDF、OCR 圖片（CPU 密集）
+2. 切塊：單一執行緒依檔案切塊與過濾，透過有界佇列接收載入結果
+3. Embedding：以固定批次大小送入 embedding 模型，可多執行緒
+各階段之間以有界佇列連接，下游較慢時上游會自動等待，不會把所有頁面堆在記憶體中
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# 佇列結束標記
+_DONE = object()
+
+
+@dataclass
+class IngestionStats:
+    """匯入進度與吞吐量"""
+    total_files: int = 0
+    files: int = 0
+    pages: int = 0
+    chunks: int = 0
+    vectors: int = 0
+    failed: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.perf_counter() - self.started_at, 1e-9)
+
+    def rates(self) -> Dict[str, float]:
+        """每秒處理的頁數、chunk 數與向量數"""
+        return {
+            "pages_per_s": self.pages / self.elapsed,
+            "chunks_per_s": self.chunks / self.elapsed,
+            "vectors_per_s": self.vectors / self.elapsed,
+        }
+
+    def progress_line(self) -> str:
+        """單行進度"""
+        rates = self.rates()
+        return (f"📈 文件 {self.files}/{self.total_files}｜頁面 {self.pages}（{rates['pages_per_s']:.1f}/s）｜"
+                f"chunks {self.chunks}（{rates['chunks_per_s']:.1f}/s）｜"
+                f"向量 {self.vectors}（{rates['vectors_per_s']:.1f}/s）")
+
+    def report(self) -> str:
+        """完成後的吞吐量報告"""
+        rates = self.rates()
+        return "\n".join([
+            f"📊 匯入完成，耗時 {self.elapsed:.1f}s（{self.files} 個文件，失敗 {self.failed} 個）",
+            f"  - 頁面: {self.pages:>8}  {rates['pages_per_s']:>10.1f} pages/s",
+            f"  - chunks: {self.chunks:>6}  {rates['chunks_per_s']:>10.1f} chunks/s",
+            f"  - 向量: {self.vectors:>8}  {rates['vectors_per_s']:>10.1f} vectors/s",
+        ])
+
+
+@dataclass
+class IngestionResult:
+    """匯入結果，file_chunks 與 file_vectors 依輸入檔案順序排列（不含載入失敗的檔案）"""
+    file_chunks: Dict[str, List[Any]]
+    file_vectors: Dict[str, np.ndarray]
+    failed: List[str]
+    stats: IngestionStats
+
+
+class IngestionPipeline:
+    """載入 → 切塊 → Embedding 的分段管線
+
+    Args:
+        load_fn: path -> 頁面 Document 列表；使用行程池時必須是模組層級函式
+        split_fn: 頁面 Document 列表 -> chunk 列表
+        embed_fn: 文字列表 -> 向量列表
+        load_workers: 載入行程數，預設為 CPU 核心數
+        embed_batch_size: 每批送入 embedding 模型的 chunk 數
+        embed_workers: embedding 執行緒數
+        queue_size: 各階段之間佇列的容量
+        use_processes: False 時改用執行緒池載入（除錯或無法 pickle 時）
+        progress_interval: 進度輸出間隔秒數，0 表示不輸出
+    """
+
+    def __init__(self, load_fn: Callable[[Any], List[Any]], split_fn: Callable[[List[Any]], List[Any]],
+                 embed_fn: Callable[[List[str]], List[List[float]]], load_workers: Optional[int] = None,
+                 embed_batch_size: int = 64, embed_workers: int = 1, queue_size: int = 8,
+                 use_processes: bool = True, progress_interval: float = 5.0):
+        self.load_fn = load_fn
+        self.split_fn = split_fn
+        self.embed_fn = embed_fn
+        self.load_workers = max(1, load_workers or os.cpu_count() or 1)
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.embed_workers = max(1, embed_workers)
+        self.queue_size = max(1, queue_size)
+        self.use_processes = use_processes
+        self.progress_interval = progress_interval
+
+    def run(self, paths: List[str], preloaded: Optional[Dict[str, List[Any]]] = None) -> IngestionResult:
+        """處理所有檔案並返回各檔案的 chunk 與向量
+
+        Args:
+            paths: 所有要處理的檔案
+            preloaded: 已在管線外載入的檔案與其頁面 Document（例如批次 OCR 的圖片），直接進入切塊階段
+        """
+        preloaded = preloaded or {}
+        stats = IngestionStats(total_files=len(paths))
+        lock = threading.Lock()
+        abort = threading.Event()
+        errors: List[BaseException] = []
+        doc_queue: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        batch_queue: "queue.Queue" = queue.Queue(maxsize=self.queue_size)
+        file_chunks: Dict[str, List[Any]] = {}
+        chunk_vectors: Dict[Tuple[str, int], np.ndarray] = {}
+        failed: List[str] = []
+
+        def put(target: "queue.Queue", item: Any) -> bool:
+            """放入佇列；其他階段失敗時放棄等待"""
+            while not abort.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def get(source: "queue.Queue") -> Any:
+            """取出佇列項目；其他階段失敗時返回結束標記"""
+            while not abort.is_set():
+                try:
+                    return source.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _DONE
+
+        def guarded(stage: Callable[[], None]) -> Callable[[], None]:
+            def runner():
+                try:
+                    stage()
+                except BaseException as e:
+                    errors.append(e)
+                    abort.set()
+            return runner
+
+        def load_stage():
+            for path in paths:
+                if path in preloaded and not put(doc_queue, (path, preloaded[path])):
+                    return
+            to_load = [path for path in paths if path not in preloaded]
+            if not to_load:
+                put(doc_queue, _DONE)
+                return
+            
+            # 限制同時進行中的工作數，避免一次把所有檔案送進行程池
+            max_in_flight = self.load_workers * 2
+            pending_paths = iter(to_load)
+            with self._create_executor(min(self.load_workers, len(to_load))) as executor:
+                in_flight = {}
+                while not abort.is_set():
+                    while len(in_flight) < max_in_flight:
+                        path = next(pending_paths, None)
+                        if path is None:
+                            break
+                        in_flight[executor.submit(self.load_fn, path)] = path
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, timeout=0.5, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = in_flight.pop(future)
+                        try:
+                            item = (path, future.result())
+                        except Exception as e:
+                            print(f"載入檔案 {os.path.basename(str(path))} 失敗: {e}")
+                            item = (path, None)
+                        if not put(doc_queue, item):
+                            return
+                if abort.is_set():
+                    for future in in_flight:
+                        future.cancel()
+            put(doc_queue, _DONE)
+
+        def chunk_stage():
+            batch: List[Tuple[str, int, str]] = []
+            while True:
+                item = get(doc_queue)
+                if item is _DONE:
+                    break
+                path, docs = item
+                if docs is None:
+                    with lock:
+                        failed.append(path)
+                        stats.failed += 1
+                        stats.files += 1
+                    continue
+
+                chunks = self.split_fn(docs)
+                with lock:
+                    file_chunks[path] = chunks
+                    stats.files += 1
+                    stats.pages += len(docs)
+                    stats.chunks += len(chunks)
+
+                for position, chunk in enumerate(chunks):
+                    batch.append((path, position, chunk.page_content))
+                    if len(batch) >= self.embed_batch_size:
+                        if not put(batch_queue, batch):
+                            return
+                        batch = []
+            if batch:
+                put(batch_queue, batch)
+            for _ in range(self.embed_workers):
+                put(batch_queue, _DONE)
+
+        def embed_stage():
+            while True:
+                batch = get(batch_queue)
+                if batch is _DONE:
+                    break
+                vectors = np.asarray(self.embed_fn([text for _, _, text in batch]), dtype=np.float32)
+                with lock:
+                    for (path, position, _), vector in zip(batch, vectors):
+                        chunk_vectors[(path, position)] = vector
+                    stats.vectors += len(batch)
+
+        threads = [threading.Thread(target=guarded(load_stage), name="ingest-load", daemon=True),
+                   threading.Thread(target=guarded(chunk_stage), name="ingest-chunk", daemon=True)]
+        threads += [threading.Thread(target=guarded(embed_stage), name=f"ingest-embed-{i}", daemon=True)
+                    for i in range(self.embed_workers)]
+        for thread in threads:
+            thread.start()
+
+        last_report = time.perf_counter()
+        while any(thread.is_alive() for thread in threads):
+            threads[-1].join(timeout=0.2)
+            if self.progress_interval and time.perf_counter() - last_report >= self.progress_interval:
+                with lock:
+                    print(stats.progress_line())
+                last_report = time.perf_counter()
+
+        if errors:
+            raise errors[0]
+
+        # 依輸入順序整理結果，使索引內容不受各檔案完成順序影響
+        ordered_chunks = {}
+        ordered_vectors = {}
+        for path in paths:
+            if path not in file_chunks:
+                continue
+            chunks = file_chunks[path]
+            ordered_chunks[path] = chunks
+            ordered_vectors[path] = (
+                np.stack([chunk_vectors[(path, position)] for position in range(len(chunks))])
+                if chunks else np.zeros((0, 0), dtype=np.float32)
+            )
+        return IngestionResult(ordered_chunks, ordered_vectors, failed, stats)
+
+    def _create_executor(self, max_workers: int) -> Executor:
+        """建立載入階段的執行器"""
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=max_workers)
+        return ThreadPoolExecutor(max_workers=max_workers)
@@ -0,0 +1,187 @@
+"""
+BM25 詞彙索引與倒數排名融合（RRF）
+中文以字元雙連詞（bigram）切分、英數以單字切分，建立倒排索引後與向量檢索的排名融合
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .rag_engine import ChunkStore
+
+
+LEXICAL_INDEX_DIRNAME = "lexical_index"
+
+# 倒排索引格式版本，修改 token 化規則時需遞增
+LEXICAL_INDEX_VERSION = 2
+
+# 英數單字（保留 ck-mb、12-lead 這類連字詞）與連續的中日韓文字
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-.][a-z0-9]+)*|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """將文字切分為 BM25 token
+
+    英數以單字為 token；中文沒有空白分詞，連續的漢字切成重疊的雙字詞（「心電圖」→「心電」「電圖」），
+    只有一個字時保留單字。
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        word = match.group()
+        if word[0] < "\u3400":
+            tokens.append(word)
+        elif len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], rrf_k: int = 60) -> List[Tuple[int, float]]:
+    """倒數排名融合：score(d) = Σ 1 / (rrf_k + rank)，rank 從 1 開始
+
+    只使用排名、不使用原始分數，因此不需校準向量相似度與 BM25 分數的尺度。
+    同分時以較小的 chunk ID 優先，結果具決定性。
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, 1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+class BM25Index:
+    """以 numpy 陣列儲存的 BM25 倒排索引（chunk ID 對應 FAISS 向量位置）
+
+    各欄位分開存放：
+    - postings_ptr.npy：每個 term 在 postings 中的起訖位置（長度 V+1）
+    - postings_docs.npy / postings_tf.npy：posting 的 chunk ID 與詞頻
+    - doc_lengths.npy：每個 chunk 的 token 數
+    - terms.json：term 詞彙表；meta.json：格式版本、BM25 參數與來源 chunk 內容的雜湊
+    """
+
+    def __init__(self, terms: List[str], postings_ptr: np.ndarray, postings_docs: np.ndarray,
+                 postings_tf: np.ndarray, doc_lengths: np.ndarray, k1: float = 1.2, b: float = 0.75,
+                 content_hash: str = ""):
+        self.terms = terms
+        self.postings_ptr = postings_ptr
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.content_hash = content_hash
+        self._term_index: Dict[str, int] = {term: i for i, term in enumerate(terms)}
+
+        num_docs = len(doc_lengths)
+        document_frequency = np.diff(postings_ptr).astype(np.float64)
+        self._idf = np.log1p((num_docs - document_frequency + 0.5) / (document_frequency + 0.5))
+        average_length = float(doc_lengths.mean()) if num_docs else 0.0
+        # BM25 分母中與查詢無關的部分：k1 · (1 - b + b · |d| / avgdl)
+        self._length_norm = k1 * (1.0 - b + b * doc_lengths / (average_length or 1.0))
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def is_compatible(self, chunk_store: ChunkStore) -> bool:
+        """是否由目前的 chunk 內容建立（chunk 數相同但內容已更新時也會重建）"""
+        return len(self) == len(chunk_store) and self.content_hash == chunk_store.content_hash()
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 搜尋，返回 (chunk_ids, scores)，只包含分數大於 0 的 chunk（由高排起）"""
+        term_ids = {self._term_index[token] for token in tokenize(query) if token in self._term_index}
+        if not term_ids or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        scores = np.zeros(len(self), dtype=np.float64)
+        for term_id in term_ids:
+            start, end = self.postings_ptr[term_id], self.postings_ptr[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end].astype(np.float64)
+            # 同一 term 的 posting 中 chunk ID 不重複，可直接以索引累加
+            scores[docs] += self._idf[term_id] * tf * (self.k1 + 1.0) / (tf + self._length_norm[docs])
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        # 依分數由高到低排序，同分時 chunk ID 小者優先
+        order = np.lexsort((candidates, -scores[candidates]))
+        candidates = candidates[order]
+        return candidates, scores[candidates]
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.2, b: float = 0.75, content_hash: str = "") -> "BM25Index":
+        """由 chunk 文字建立（順序需與向量位置一致），content_hash 為來源 chunk 儲存的內容雜湊"""
+        term_ids: Dict[str, int] = {}
+        postings: List[List[Tuple[int, int]]] = []
+        doc_lengths = []
+
+        for chunk_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_id = term_ids.setdefault(token, len(term_ids))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((chunk_id, count))
+
+        postings_ptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        if postings:
+            np.cumsum([len(term_postings) for term_postings in postings], out=postings_ptr[1:])
+        flat = [posting for term_postings in postings for posting in term_postings]
+
+        return cls(
+            terms=list(term_ids),
+            postings_ptr=postings_ptr,
+            postings_docs=np.asarray([chunk_id for chunk_id, _ in flat], dtype=np.int32),
+            postings_tf=np.asarray([count for _, count in flat], dtype=np.int32),
+            doc_lengths=np.asarray(doc_lengths, dtype=np.int32),
+            k1=k1,
+            b=b,
+            content_hash=content_hash
+        )
+
+    @classmethod
+    def from_chunk_store(cls, chunk_store: ChunkStore) -> "BM25Index":
+        """由 chunk 儲存建立"""
+        return cls.build((chunk_store.text(i) for i in range(len(chunk_store))),
+                         content_hash=chunk_store.content_hash())
+
+    def save(self, directory: Path) -> None:
+        """寫入目錄"""
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ("postings_ptr", "postings_docs", "postings_tf", "doc_lengths"):
+            np.save(directory / f"{name}.npy", getattr(self, name))
+        with open(directory / "terms.json", "w", encoding="utf-8") as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+        # meta.json 最後寫入，作為索引完整的標記
+        with open(directory / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({"version": LEXICAL_INDEX_VERSION, "k1": self.k1, "b": self.b,
+                       "content_hash": self.content_hash}, f)
+
+    @classmethod
+    def load(cls, directory: Path, use_mmap: bool = False) -> Optional["BM25Index"]:
+        """從目錄載入，不存在或格式版本不符時返回 None"""
+        meta_path = directory / "meta.json"
+        if not meta_path.exists():
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != LEXICAL_INDEX_VERSION:
+            return None
+        with open(directory / "terms.json", "r", encoding="utf-8") as f:
+            terms = json.load(f)
+
+        mmap_mode = "r" if use_mmap else None
+        arrays = {
+            name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode)
+            for name in ("postings_ptr", "postings_docs", "postings_tf", "doc_lengths")
+        }
+        return cls(terms=terms, k1=meta.get("k1", 1.2), b=meta.get("b", 0.75),
+                   content_hash=meta.get("content_hash", ""), **arrays)
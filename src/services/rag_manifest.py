@@ -0,0 +1,96 @@
+"""
+RAG 索引清單（manifest）
+記錄每個來源檔案的內容雜湊與對應的 chunk ID，供增量建立索引時判斷哪些檔案需要重新處理
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+class ManifestDiff(NamedTuple):
+    """目前檔案與清單的差異（皆為來源路徑）"""
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+    unchanged: List[str]
+
+    @property
+    def to_process(self) -> List[str]:
+        """需要重新載入、切塊與 embedding 的檔案"""
+        return self.added + self.changed
+
+    @property
+    def stale(self) -> List[str]:
+        """需要從索引中刪除舊向量的檔案"""
+        return self.changed + self.removed
+
+    def is_empty(self) -> bool:
+        """索引是否已是最新"""
+        return not (self.added or self.changed or self.removed)
+
+
+class IndexManifest:
+    """索引清單
+
+    config 記錄影響向量內容的建立參數（embedding 模型、度量、索引類型、切塊參數），
+    參數改變時舊向量無法沿用，必須完整重建。
+    """
+
+    def __init__(self, config: Dict[str, Any], files: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.config = config
+        self.files: Dict[str, Dict[str, Any]] = files or {}
+
+    def diff(self, current_hashes: Dict[str, str]) -> ManifestDiff:
+        """比較目前檔案的雜湊與清單"""
+        added, changed, unchanged = [], [], []
+        for path, sha256 in current_hashes.items():
+            entry = self.files.get(path)
+            if entry is None:
+                added.append(path)
+            elif entry["sha256"] != sha256:
+                changed.append(path)
+            else:
+                unchanged.append(path)
+        removed = [path for path in self.files if path not in current_hashes]
+        return ManifestDiff(added, changed, removed, unchanged)
+
+    def chunk_ids(self, paths: Iterable[str]) -> List[str]:
+        """取得檔案對應的所有 chunk ID"""
+        return [chunk_id for path in paths if path in self.files for chunk_id in self.files[path]["chunk_ids"]]
+
+    def update_file(self, path: str, sha256: str, chunk_ids: List[str]) -> None:
+        """記錄檔案的雜湊與 chunk ID"""
+        self.files[path] = {"sha256": sha256, "chunk_ids": list(chunk_ids)}
+
+    def remove_file(self, path: str) -> None:
+        """移除檔案記錄"""
+        self.files.pop(path, None)
+
+    def save(self, path: Path) -> None:
+        """寫入磁碟（先寫暫存檔再替換，避免中斷時留下不完整的清單）"""
+        payload = {"version": MANIFEST_VERSION, "config": self.config, "files": self.files}
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["IndexManifest"]:
+        """從磁碟載入，不存在或版本不符時返回 None"""
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except Exception as e:
+            print(f"⚠️ 索引清單載入失敗: {e}")
+            return None
+        if payload.get("version") != MANIFEST_VERSION:
+            return None
+        return cls(payload.get("config", {}), payload.get("files", {}))
@@ -0,0 +1,292 @@
+"""
+chunk 清理與斷句的預計算儲存
+建立索引時先完成每個 chunk 的清理（移除標題與 Markdown 格式、串接各行）、以「。」斷句與句子 token 化，
+查詢時的段落提取只需查表與計分
+"""
+
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Collection, Dict, FrozenSet, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from .rag_engine import ChunkStore
+
+
+SEGMENTS_DIRNAME = "segments"
+
+# 預計算格式版本，修改清理、斷句或 token 化規則時需遞增
+SEGMENTS_VERSION = 2
+
+# 句子分數（重疊詞數 / 查詢詞數）需超過此值才視為相關
+MIN_SENTENCE_SCORE = 0.1
+
+# 找不到相關句子時，擷取關鍵詞前後的字元數
+KEYWORD_WINDOW = 200
+
+# 解碼後保留在記憶體中的 chunk 數量，檢索結果集中在少數熱門 chunk，重複查詢不需再次解碼
+SEGMENT_CACHE_SIZE = 4096
+
+
+def clean_chunk_text(content: str, title_markers: Iterable[str]) -> str:
+    """移除文檔開頭的標題與 Markdown 格式，將各行以空格串接"""
+    title_markers = list(title_markers)
+
+    # 跳過開頭的標題行（通常是文檔標題）
+    content_lines = []
+    skip_title = True
+
+    for line in content.strip().split('\n'):
+        line = line.strip()
+
+        # 如果是空行，跳過
+        if not line:
+            continue
+
+        # 如果遇到Markdown標題（## 或 ###），移除標題標記但保留內容
+        if line.startswith('##'):
+            if skip_title:
+                continue
+            else:
+                # 移除標題標記，保留內容
+                line = line.lstrip('#').strip()
+
+        # 跳過文檔開頭的標題（包含特定關鍵詞的短行）
+        if skip_title and len(line) < 50 and any(marker in line for marker in title_markers):
+            skip_title = False
+            continue
+
+        # 移除Markdown格式標記
+        line = line.replace('**', '').replace('*', '')
+
+        skip_title = False
+        if line:  # 只添加非空行
+            content_lines.append(line)
+
+    # 重新組合內容，用空格分隔，讓內容更自然
+    return ' '.join(content_lines)
+
+
+def sentence_tokens(sentence: str) -> FrozenSet[str]:
+    """句子的 token 集合（以空白切分、不分大小寫）"""
+    return frozenset(sentence.lower().split())
+
+
+class ChunkSegment(NamedTuple):
+    """清理並斷句後的 chunk
+
+    sentence_tokens 為每個句子的 token：即時計算時為字串集合，預計算時為 token ID 列表，
+    計分時只需與同一種表示的查詢詞比對。
+    """
+    text: str
+    sentence_starts: List[int]
+    sentence_tokens: List[Collection]
+
+    def sentence(self, index: int) -> str:
+        """第 index 個句子（不含句號）"""
+        start = self.sentence_starts[index]
+        end = self.sentence_starts[index + 1] - 1 if index + 1 < len(self.sentence_starts) else len(self.text)
+        return self.text[start:end]
+
+    def join_sentences(self, start: int, end: int) -> str:
+        """第 start 到 end-1 個句子以句號串接（等同 '。'.join(sentences[start:end])）"""
+        if start >= end:
+            return ""
+        text_end = self.sentence_starts[end] - 1 if end < len(self.sentence_starts) else len(self.text)
+        return self.text[self.sentence_starts[start]:text_end]
+
+
+def segment_text(content: str, title_markers: Iterable[str]) -> ChunkSegment:
+    """即時清理並斷句（沒有預計算結果時使用）"""
+    text = clean_chunk_text(content, title_markers)
+    sentences = text.split('。')
+    starts = []
+    position = 0
+    for sentence in sentences:
+        starts.append(position)
+        position += len(sentence) + 1
+    return ChunkSegment(text, starts, [sentence_tokens(sentence) for sentence in sentences])
+
+
+def extract_relevant_paragraph(segment: ChunkSegment, query_terms: Collection, num_query_words: int,
+                               query_matcher: Any) -> str:
+    """從 chunk 中提取與查詢最相關的段落
+
+    Args:
+        segment: 清理並斷句後的 chunk
+        query_terms: 擴展後的查詢詞，表示方式需與 segment.sentence_tokens 相同
+        num_query_words: 擴展後的查詢詞數量（計分的分母）
+        query_matcher: 查詢詞的 KeywordMatcher，找不到相關句子時用來定位關鍵詞
+    """
+    # 計算每個句子與查詢的相關性（重疊詞數 / 查詢詞數），取第一個最高分的句子
+    best_index = -1
+    best_score = 0
+    for i, tokens in enumerate(segment.sentence_tokens):
+        overlap = sum(1 for token in tokens if token in query_terms)
+        if overlap > 0:
+            score = overlap / num_query_words
+            if score > best_score:
+                best_score = score
+                best_index = i
+
+    # 如果找到相關句子，返回該句子及其前後文
+    if best_index >= 0 and best_score > MIN_SENTENCE_SCORE:
+        # 相同內容的句子以最先出現者為準
+        best_sentence = segment.sentence(best_index).strip()
+        best_index = next(i for i in range(best_index + 1) if segment.sentence(i).strip() == best_sentence)
+
+        # 返回最佳句子及其前後各一句
+        start = max(0, best_index - 1)
+        end = min(len(segment.sentence_starts), best_index + 2)
+        return segment.join_sentences(start, end)
+
+    # 如果沒有找到足夠相關的句子，返回最早出現的關鍵詞所在段落
+    content = segment.text
+    occurrence = query_matcher.first_occurrence(content)
+    if occurrence:
+        keyword_pos, keyword = occurrence
+        start = max(0, keyword_pos - KEYWORD_WINDOW)
+        end = min(len(content), keyword_pos + len(keyword) + KEYWORD_WINDOW)
+        return content[start:end]
+
+    # 如果都沒有找到，返回前幾句
+    return segment.join_sentences(0, 2) if len(segment.sentence_starts) >= 2 else content
+
+
+class SegmentStore:
+    """預計算的 chunk 清理與斷句結果（以 chunk ID 對應 FAISS 向量位置）
+
+    各欄位分開存放：
+    - text.bin / text_offsets.npy：清理後文字的 UTF-8 串接與每個 chunk 的起訖位置
+    - sentence_ptr.npy：每個 chunk 的句子在 sentence_starts 中的起訖位置（長度 n+1）
+    - sentence_starts.npy：每個句子在所屬 chunk 清理後文字中的起點（字元位置）
+    - token_ptr.npy / token_ids.npy：每個句子的 token ID
+    - tokens.json：token 詞彙表；meta.json：格式版本、清理時使用的標題關鍵詞與來源 chunk 內容的雜湊
+
+    陣列逐筆切片與解碼的成本不低於即時斷句，查詢時以 get 取得快取的解碼結果（最多 SEGMENT_CACHE_SIZE 個 chunk）。
+    """
+
+    def __init__(self, text_blob: Any, text_offsets: np.ndarray, sentence_ptr: np.ndarray,
+                 sentence_starts: np.ndarray, token_ptr: np.ndarray, token_ids: np.ndarray,
+                 vocabulary: List[str], title_markers: List[str], content_hash: str = ""):
+        self.text_blob = text_blob
+        self.text_offsets = text_offsets
+        self.sentence_ptr = sentence_ptr
+        self.sentence_starts = sentence_starts
+        self.token_ptr = token_ptr
+        self.token_ids = token_ids
+        self.vocabulary = vocabulary
+        self.title_markers = title_markers
+        self.content_hash = content_hash
+        self._token_index: Dict[str, int] = {token: i for i, token in enumerate(vocabulary)}
+        self.query_token_ids = lru_cache(maxsize=256)(self._query_token_ids)
+        self.get = lru_cache(maxsize=SEGMENT_CACHE_SIZE)(self._decode)
+
+    def __len__(self) -> int:
+        return len(self.text_offsets) - 1
+
+    def is_compatible(self, title_markers: Iterable[str], chunk_store: ChunkStore) -> bool:
+        """是否與目前的清理規則與 chunk 內容一致（chunk 數相同但內容已更新時也會重建）"""
+        return (self.title_markers == list(title_markers) and len(self) == len(chunk_store)
+                and self.content_hash == chunk_store.content_hash())
+
+    def _decode(self, chunk_id: int) -> ChunkSegment:
+        """由陣列解碼 chunk 的清理後文字、句子起點與句子 token ID
+
+        透過 self.get 呼叫，每個 chunk 只在第一次查詢時轉成 Python 物件，之後直接返回快取的結果
+        """
+        start, end = self.text_offsets[chunk_id], self.text_offsets[chunk_id + 1]
+        text = bytes(self.text_blob[start:end]).decode("utf-8")
+
+        first, last = int(self.sentence_ptr[chunk_id]), int(self.sentence_ptr[chunk_id + 1])
+        token_ptr = self.token_ptr[first:last + 1].tolist()
+        token_ids = self.token_ids[token_ptr[0]:token_ptr[-1]].tolist()
+        base = token_ptr[0]
+        tokens = [token_ids[token_ptr[i] - base:token_ptr[i + 1] - base] for i in range(last - first)]
+        return ChunkSegment(text, self.sentence_starts[first:last].tolist(), tokens)
+
+    def _query_token_ids(self, query_words: FrozenSet[str]) -> FrozenSet[int]:
+        """查詢詞對應的 token ID（詞彙表中沒有的詞不可能命中，直接略過）"""
+        return frozenset(self._token_index[word] for word in query_words if word in self._token_index)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], title_markers: Iterable[str], content_hash: str = "") -> "SegmentStore":
+        """由 chunk 原始文字建立（順序需與向量位置一致），content_hash 為來源 chunk 儲存的內容雜湊"""
+        title_markers = list(title_markers)
+        vocabulary: Dict[str, int] = {}
+        encoded_texts = []
+        sentence_ptr = [0]
+        sentence_starts: List[int] = []
+        token_ptr = [0]
+        token_ids: List[int] = []
+
+        for content in texts:
+            segment = segment_text(content, title_markers)
+            encoded_texts.append(segment.text.encode("utf-8"))
+            sentence_starts.extend(segment.sentence_starts)
+            sentence_ptr.append(len(sentence_starts))
+            for tokens in segment.sentence_tokens:
+                token_ids.extend(vocabulary.setdefault(token, len(vocabulary)) for token in sorted(tokens))
+                token_ptr.append(len(token_ids))
+
+        text_offsets = np.zeros(len(encoded_texts) + 1, dtype=np.int64)
+        if encoded_texts:
+            np.cumsum([len(text) for text in encoded_texts], out=text_offsets[1:])
+
+        return cls(
+            text_blob=b"".join(encoded_texts),
+            text_offsets=text_offsets,
+            sentence_ptr=np.asarray(sentence_ptr, dtype=np.int64),
+            sentence_starts=np.asarray(sentence_starts, dtype=np.int32),
+            token_ptr=np.asarray(token_ptr, dtype=np.int64),
+            token_ids=np.asarray(token_ids, dtype=np.int32),
+            vocabulary=list(vocabulary),
+            title_markers=title_markers,
+            content_hash=content_hash
+        )
+
+    @classmethod
+    def from_chunk_store(cls, chunk_store: ChunkStore, title_markers: Iterable[str]) -> "SegmentStore":
+        """由 chunk 儲存建立"""
+        return cls.build((chunk_store.text(i) for i in range(len(chunk_store))), title_markers,
+                         chunk_store.content_hash())
+
+    def save(self, directory: Path) -> None:
+        """寫入目錄"""
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / "text.bin").write_bytes(bytes(self.text_blob))
+        for name in ("text_offsets", "sentence_ptr", "sentence_starts", "token_ptr", "token_ids"):
+            np.save(directory / f"{name}.npy", getattr(self, name))
+        with open(directory / "tokens.json", "w", encoding="utf-8") as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+        # meta.json 最後寫入，作為儲存完整的標記
+        with open(directory / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({"version": SEGMENTS_VERSION, "title_markers": self.title_markers,
+                       "content_hash": self.content_hash}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: Path, use_mmap: bool = False) -> Optional["SegmentStore"]:
+        """從目錄載入，不存在或格式版本不符時返回 None"""
+        meta_path = directory / "meta.json"
+        if not meta_path.exists():
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != SEGMENTS_VERSION:
+            return None
+        with open(directory / "tokens.json", "r", encoding="utf-8") as f:
+            vocabulary = json.load(f)
+
+        mmap_mode = "r" if use_mmap else None
+        arrays = {
+            name: np.load(directory / f"{name}.npy", mmap_mode=mmap_mode)
+            for name in ("text_offsets", "sentence_ptr", "sentence_starts", "token_ptr", "token_ids")
+        }
+        return cls(
+            text_blob=ChunkStore._read_text_blob(directory / "text.bin", use_mmap),
+            vocabulary=vocabulary,
+            title_markers=meta.get("title_markers", []),
+            content_hash=meta.get("content_hash", ""),
+            **arrays
+        )
@@ -3,11 +3,45 @@ RAG (Retrieval-Augmented Generation) 服務
 """
 
 import os
-from typing import List, Dict, Any, Optional
+import re
+import time
+import hashlib
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 
+import numpy as np
+
 from ..config.settings import get_settings
+from ..config.keyword_registry import get_keyword_registry
 from ..models.report import Citation
+from .rag_cache import QueryEmbeddingCache, RetrievalResultCache, CACHE_MISS
+from .rag_engine import (
+    ChunkStore, FaissRetrievalEngine, RetrievedChunk, CHUNK_STORE_DIRNAME,
+    is_inner_product_index, configure_search_params, describe_index
+)
+from .rag_segments import (
+    SegmentStore, SEGMENTS_DIRNAME, clean_chunk_text, segment_text, extract_relevant_paragraph
+)
+from .rag_lexical import BM25Index, LEXICAL_INDEX_DIRNAME, reciprocal_rank_fusion
+
+
+# 檢索結果格式版本，修改過濾或格式化邏輯時需遞增，使預計算結果失效
+RESULT_FORMAT_VERSION = 4
+
+# 清理多餘空白
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def get_rag_query_vocabulary() -> List[str]:
+    """查詢模板與對話插入規則中的所有查詢（去重、保持順序），供預計算與基準測試使用"""
+    return get_keyword_registry().query_vocabulary()
+
+
+def clean_source_name(source: str) -> str:
+    """美化檔名顯示"""
+    filename = source.split('/')[-1]
+    return filename.replace('.pdf', '').replace('.txt', '').replace('.jpg', '').replace('_', ' ')
 
 
 class RAGService:
@@ -16,299 +50,545 @@ class RAGService:
     def __init__(self, settings=None):
         self.settings = settings or get_settings()
         self.vector_store = None
+        self.engine: Optional[FaissRetrievalEngine] = None
+        self.segments: Optional[SegmentStore] = None
+        self.lexical_index: Optional[BM25Index] = None
         self.embeddings = None
-        self._initialize_rag()
+        self.query_cache = QueryEmbeddingCache(
+            model_name=self.settings.rag_model_name,
+            max_size=self.settings.rag_query_cache_size,
+            persist_path=(
+                self.settings.faiss_index_dir / "query_embedding_cache.npz"
+                if self.settings.rag_query_cache_persist else None
+            ),
+            save_every=self.settings.rag_query_cache_save_every
+        )
+        self.result_cache = RetrievalResultCache(
+            persist_path=self.settings.faiss_index_dir / "precomputed_results.json"
+        )
+        self._precompute_plan: List[Tuple[List[str], int]] = []
+        
+        # 啟動時載入並編譯關鍵字與查詢模板登錄表，檢索時不再重建關鍵字表
+        get_keyword_registry()
+        
+        # 索引載入狀態：loading / initialized / not_initialized / failed
+        self.status = "loading"
+        self.load_error: Optional[str] = None
+        self._ready_event = threading.Event()
+        self._state_lock = threading.Lock()
+        
+        if self.settings.rag_background_loading:
+            # 在背景執行緒載入模型與索引，不阻塞服務啟動與聊天請求
+            self._loader_thread = threading.Thread(
+                target=self._initialize_rag, name="rag-warmup", daemon=True
+            )
+            self._loader_thread.start()
+        else:
+            self._initialize_rag()
     
     def _initialize_rag(self) -> None:
         """初始化 RAG 系統"""
-        if not self.settings.faiss_index_dir.exists():
-            print(f"⚠️ 警告：RAG 索引目錄不存在: {self.settings.faiss_index_dir}")
-            print("   請先執行 `python build_index.py` 來建立索引")
-            return
-        
         try:
+            if not self.settings.faiss_index_dir.exists():
+                print(f"⚠️ 警告：RAG 索引目錄不存在: {self.settings.faiss_index_dir}")
+                print("   請先執行 `python build_index.py` 來建立索引")
+                self.status = "not_initialized"
+                return
+            
+            started_at = time.perf_counter()
             print("💡 [RAG] 正在載入 RAG 向量索引...")
             
             # 初始化 embedding 模型
             from langchain_community.embeddings import HuggingFaceEmbeddings
-            self.embeddings = HuggingFaceEmbeddings(
+            embeddings = HuggingFaceEmbeddings(
                 model_name=self.settings.rag_model_name,
                 model_kwargs={'trust_remote_code': True},
                 encode_kwargs={'normalize_embeddings': True}
             )
             
-            # 載入 FAISS 索引
-            from langchain_community.vectorstores import FAISS
-            self.vector_store = FAISS.load_local(
-                str(self.settings.faiss_index_dir),
-                self.embeddings,
-                allow_dangerous_deserialization=True
+            # 載入 FAISS 索引，並套用近似索引的搜尋參數（efSearch / nprobe）
+            engine, vector_store = self._load_index(embeddings)
+            configure_search_params(
+                engine.index if engine is not None else vector_store.index,
+                hnsw_ef_search=self.settings.rag_hnsw_ef_search,
+                ivf_nprobe=self.settings.rag_ivf_nprobe
             )
             
-            print("✅ [RAG] RAG 索引載入成功")
+            # 載入預計算的 chunk 清理與斷句結果，以及混合檢索使用的 BM25 詞彙索引
+            segments = self._load_segments(engine)
+            lexical_index = self._load_lexical_index(engine, vector_store)
+            
+            # 載入與目前索引相符的預計算檢索結果
+            self.result_cache.load(self._compute_index_fingerprint())
+            
+            with self._state_lock:
+                self.embeddings = embeddings
+                self.engine = engine
+                self.vector_store = vector_store
+                self.segments = segments
+                self.lexical_index = lexical_index
+                self.status = "initialized"
+                precompute_plan = list(self._precompute_plan)
+            
+            print(f"✅ [RAG] RAG 索引載入成功（{time.perf_counter() - started_at:.1f}s）")
             
         except Exception as e:
             print(f"❌ [RAG] RAG 索引載入失敗: {e}")
             self.vector_store = None
+            self.engine = None
+            self.segments = None
+            self.lexical_index = None
             self.embeddings = None
+            self.status = "failed"
+            self.load_error = str(e)
+            return
+        finally:
+            self._ready_event.set()
+        
+        # 索引就緒後計算已登記的固定查詢
+        if self.settings.rag_precompute_results:
+            for queries, k in precompute_plan:
+                self.precompute_results(queries, k)
+    
+    def _load_index(self, embeddings: Any) -> Tuple[Optional[FaissRetrievalEngine], Any]:
+        """載入檢索後端，返回 (FAISS 直接檢索引擎, langchain 向量庫)，兩者擇一
+        
+        rag_engine 為 "faiss" 且 chunk 儲存存在時使用直接檢索引擎；
+        否則（或 chunk 儲存與索引不一致、無法讀取時）退回 langchain FAISS，並重新匯出 chunk 儲存供下次啟動使用。
+        """
+        index_dir = self.settings.faiss_index_dir
+        chunk_store_dir = index_dir / CHUNK_STORE_DIRNAME
+        
+        if self.settings.rag_engine == "faiss" and ChunkStore.exists(chunk_store_dir):
+            use_mmap = self.settings.rag_mmap_index
+            try:
+                engine = FaissRetrievalEngine.load(index_dir, use_mmap=use_mmap)
+                print(f"💡 [RAG] 使用 FAISS 直接檢索引擎{'（記憶體映射）' if use_mmap else ''}")
+                return engine, None
+            except Exception as e:
+                print(f"⚠️ [RAG] FAISS 直接檢索引擎載入失敗，改用 langchain 索引: {e}")
+        
+        from langchain_community.vectorstores import FAISS
+        vector_store = FAISS.load_local(
+            str(index_dir),
+            embeddings,
+            allow_dangerous_deserialization=True
+        )
+        
+        if self.settings.rag_engine == "faiss":
+            try:
+                ChunkStore.from_langchain(vector_store).save(chunk_store_dir)
+                print(f"💡 [RAG] 已匯出 chunk 儲存至 {chunk_store_dir}，下次啟動將使用直接檢索引擎")
+            except Exception as e:
+                print(f"⚠️ [RAG] chunk 儲存匯出失敗: {e}")
+        
+        return None, vector_store
+    
+    def _load_segments(self, engine: Optional[FaissRetrievalEngine]) -> Optional[SegmentStore]:
+        """載入預計算的 chunk 清理與斷句結果
+        
+        不存在或與目前的標題關鍵詞、chunk 內容（以內容雜湊比對）不一致時，由 chunk 儲存重新建立並寫回；
+        langchain 路徑沒有 chunk 儲存，查詢時改為即時清理。
+        """
+        if engine is None:
+            return None
+        
+        segments_dir = self.settings.faiss_index_dir / CHUNK_STORE_DIRNAME / SEGMENTS_DIRNAME
+        title_markers = get_keyword_registry().document_title_markers
+        
+        try:
+            segments = SegmentStore.load(segments_dir, use_mmap=self.settings.rag_mmap_index)
+            if segments is not None and segments.is_compatible(title_markers, engine.chunk_store):
+                return segments
+        except Exception as e:
+            print(f"⚠️ [RAG] chunk 斷句結果載入失敗: {e}")
+        
+        print("💡 [RAG] 正在預計算 chunk 清理與斷句結果...")
+        segments = SegmentStore.from_chunk_store(engine.chunk_store, title_markers)
+        try:
+            segments.save(segments_dir)
+        except Exception as e:
+            print(f"⚠️ [RAG] chunk 斷句結果寫入失敗: {e}")
+        return segments
+    
+    def _load_lexical_index(self, engine: Optional[FaissRetrievalEngine], vector_store: Any) -> Optional[BM25Index]:
+        """載入 BM25 詞彙索引（停用混合檢索時返回 None）
+        
+        不存在或與目前的 chunk 內容（以內容雜湊比對）不符時，由 chunk 內容重新建立並寫回；
+        langchain 路徑需先由 docstore 匯出 chunk 才能比對。
+        """
+        if not self.settings.rag_hybrid_search:
+            return None
+        
+        lexical_dir = self.settings.faiss_index_dir / LEXICAL_INDEX_DIRNAME
+        chunk_store = engine.chunk_store if engine is not None else ChunkStore.from_langchain(vector_store)
+        
+        try:
+            lexical_index = BM25Index.load(lexical_dir, use_mmap=self.settings.rag_mmap_index)
+            if lexical_index is not None and lexical_index.is_compatible(chunk_store):
+                return lexical_index
+        except Exception as e:
+            print(f"⚠️ [RAG] BM25 詞彙索引載入失敗: {e}")
+        
+        print("💡 [RAG] 正在建立 BM25 詞彙索引...")
+        lexical_index = BM25Index.from_chunk_store(chunk_store)
+        try:
+            lexical_index.save(lexical_dir)
+        except Exception as e:
+            print(f"⚠️ [RAG] BM25 詞彙索引寫入失敗: {e}")
+        return lexical_index
     
     def search(self, query: str, k: Optional[int] = None) -> str:
         """執行 RAG 搜尋"""
-        if not self.vector_store:
+        if not self.is_available():
             return "RAG 系統未初始化，無法執行搜尋。"
         
         k = k or self.settings.rag_search_k
+        
+        cached = self.result_cache.get("search", query, k)
+        if cached is not CACHE_MISS:
+            return cached
+        
+        return self._search_uncached(query, k)
+    
+    def _search_uncached(self, query: str, k: int) -> str:
+        """執行 RAG 搜尋（不使用預計算結果）"""
         print(f"[RAG] 正在搜尋關於 '{query}' 的資料...")
         
         try:
-            # 使用相似度搜尋，並獲取分數
-            results_with_scores = self.vector_store.similarity_search_with_score(query, k=k*2)  # 獲取更多結果以便過濾
-            
-            if not results_with_scores:
+            if self._index_size() == 0:
                 return "在知識庫中找不到相關資料。"
             
-            # 過濾低相關性的結果
-            filtered_results = []
-            for doc, score in results_with_scores:
-                # 相似度分數越小表示越相似，設定更嚴格的閾值
-                if score < 1.2:  # 更嚴格的閾值以確保相關性
-                    # 額外檢查內容是否與查詢相關
-                    if self._is_content_relevant(doc.page_content, query):
-                        filtered_results.append(doc)
-                if len(filtered_results) >= k:  # 限制結果數量
-                    break
+            # 使用相似度搜尋並過濾低相關性的結果
+            filtered_results = self._search_filtered([query], k)[0]
             
+            # 如果還是沒有相關結果，返回空
             if not filtered_results:
-                # 如果過濾後沒有結果，使用前k個結果，但再次檢查相關性
-                for doc, score in results_with_scores[:k]:
-                    if self._is_content_relevant(doc.page_content, query):
-                        filtered_results.append(doc)
-                        if len(filtered_results) >= k:
-                            break
-                
-                # 如果還是沒有相關結果，返回空
-                if not filtered_results:
-                    return "在知識庫中找不到與查詢相關的資料。"
+                return "在知識庫中找不到與查詢相關的資料。"
             
             # 格式化結果，確保內容與查詢相關
-            context = "\n---\n".join([
-                self._format_document_content_with_query(doc.metadata.get('source', '未知'), doc.page_content, query)
-                for doc in filtered_results
-            ])
-            
-            return context
+            return self._format_chunks(query, [chunk for chunk, _ in filtered_results])
             
         except Exception as e:
             print(f"[RAG] 搜尋失敗: {e}")
             return f"RAG 搜尋發生錯誤: {str(e)}"
     
-    def _format_document_content(self, source: str, content: str) -> str:
-        """格式化文檔內容，移除不必要的標題和格式"""
-        # 移除文檔開頭的標題（通常是第一行或前幾行）
-        lines = content.strip().split('\n')
+    def _format_chunks(self, query: str, chunks: List[RetrievedChunk]) -> str:
+        """依查詢格式化多個 chunk 並以分隔線串接"""
+        return "\n---\n".join(
+            self._format_document_content_with_query(chunk.source, chunk.text, query, chunk.chunk_id)
+            for chunk in chunks
+        )
+    
+    def search_merged(self, queries: List[str], k: Optional[int] = None,
+                      max_sections: Optional[int] = None) -> List[Tuple[str, str]]:
+        """多查詢合併檢索：跨查詢以 chunk ID 去重，每個 chunk 只格式化一次
         
-        # 跳過開頭的標題行（通常是文檔標題）
-        content_lines = []
-        skip_title = True
+        依查詢順序取用結果，已由前面查詢取得的 chunk 不再重複輸出；
+        湊滿 max_sections 個段落後即停止，後面的查詢不再格式化。
         
-        for line in lines:
-            line = line.strip()
+        Returns:
+            [(查詢, 格式化內容)]，只包含帶來新 chunk 的查詢
+        """
+        if not self.is_available() or not queries:
+            return []
+        
+        k = k or self.settings.rag_search_k
+        
+        try:
+            batch_results = self._retrieve_hits(queries, k)
+        except Exception as e:
+            print(f"[RAG] 搜尋失敗: {e}")
+            return []
+        
+        sections = []
+        seen_chunk_ids = set()
+        for query, hits in zip(queries, batch_results):
+            if max_sections is not None and len(sections) >= max_sections:
+                break
             
-            # 如果是空行，跳過
-            if not line:
+            new_chunks = [chunk for chunk, _ in hits if chunk.chunk_id not in seen_chunk_ids]
+            if not new_chunks:
                 continue
+            seen_chunk_ids.update(chunk.chunk_id for chunk in new_chunks)
+            sections.append((query, self._format_chunks(query, new_chunks)))
+        
+        return sections
+    
+    def _retrieve_hits(self, queries: List[str], k: int) -> List[List[Tuple[RetrievedChunk, Optional[float]]]]:
+        """取得各查詢過濾後的 (chunk, score)：已預計算的查詢依 chunk ID 查表，其餘批次搜尋"""
+        results: Dict[int, List[Tuple[RetrievedChunk, Optional[float]]]] = {}
+        pending = []
+        for i, query in enumerate(queries):
+            cached = self.result_cache.get("hits", query, k)
+            if cached is CACHE_MISS:
+                pending.append(i)
+            else:
+                results[i] = [(self._get_chunk(chunk_id), score) for chunk_id, score in cached]
+        
+        if pending:
+            batch_results = self._search_filtered([queries[i] for i in pending], k)
+            results.update(zip(pending, batch_results))
+        
+        return [results[i] for i in range(len(queries))]
+    
+    def _search_vectors(self, query_vectors: np.ndarray, fetch_k: int) -> List[List[Tuple[RetrievedChunk, float]]]:
+        """多列向量搜尋，返回與查詢向量對應的 (chunk, score) 列表（由最相似排起）"""
+        if self.engine is not None:
+            return self.engine.search_chunks(query_vectors, fetch_k)
+        
+        return self._search_langchain_store(query_vectors, fetch_k)
+    
+    def _search_filtered(self, queries: List[str], k: int) -> List[List[Tuple[RetrievedChunk, float]]]:
+        """批次搜尋並過濾：所有查詢共用一次 embedding 計算與一次多列 FAISS 搜尋
+        
+        初始只取回 k * rag_fetch_multiplier 個候選；若通過過濾的結果不足 k 個且最後一個候選仍高於
+        相似度閾值（代表後面可能還有合格結果），才對這些查詢加倍 fetch_k 重新搜尋，直到 rag_max_fetch_k。
+        已載入 BM25 詞彙索引時改用混合檢索（見 _search_hybrid）。
+        
+        Returns:
+            與 queries 對應的已過濾 (chunk, score) 列表
+        """
+        if not queries:
+            return []
+        
+        index_size = self._index_size()
+        if index_size == 0:
+            return [[] for _ in queries]
+        
+        if self.lexical_index is not None:
+            return self._search_hybrid(queries, k)
+        
+        query_vectors = self._embed_queries(queries)
+        fetch_k = min(max(k, k * self.settings.rag_fetch_multiplier), index_size)
+        max_fetch_k = min(max(fetch_k, self.settings.rag_max_fetch_k), index_size)
+        
+        candidates: List[List[Tuple[RetrievedChunk, float]]] = [[] for _ in queries]
+        filtered: List[List[Tuple[RetrievedChunk, float]]] = [[] for _ in queries]
+        pending = list(range(len(queries)))
+        
+        while pending:
+            batch_results = self._search_vectors(query_vectors[pending], fetch_k)
+            
+            next_pending = []
+            for qi, hits in zip(pending, batch_results):
+                # 只檢查本輪新增的候選
+                new_hits = hits[len(candidates[qi]):]
+                candidates[qi] = hits
+                filtered[qi].extend(self._filter_relevant_results(new_hits, queries[qi], k - len(filtered[qi])))
                 
-            # 如果遇到Markdown標題（## 或 ###），移除標題標記但保留內容
-            if line.startswith('##') or line.startswith('###'):
-                if skip_title:
-                    continue
-                else:
-                    # 移除標題標記，保留內容
-                    line = line.lstrip('#').strip()
+                tail_passes = bool(hits) and self._to_similarity(hits[-1][1]) >= self.settings.rag_min_similarity
+                if len(filtered[qi]) < k and tail_passes and len(hits) == fetch_k < max_fetch_k:
+                    next_pending.append(qi)
             
-            # 跳過文檔開頭的標題（包含特定關鍵詞的短行）
-            if skip_title and len(line) < 50 and ('指引' in line or '指南' in line or '臨床' in line):
-                skip_title = False
-                continue
+            pending = next_pending
+            fetch_k = min(fetch_k * 2, max_fetch_k)
+        
+        for qi, query in enumerate(queries):
+            if not filtered[qi]:
+                # 如果過濾後沒有結果，使用前k個結果，但再次檢查相關性
+                for chunk, score in candidates[qi][:k]:
+                    if self._is_content_relevant(chunk.text, query):
+                        filtered[qi].append((chunk, score))
+                        if len(filtered[qi]) >= k:
+                            break
+        
+        return filtered
+    
+    def _search_hybrid(self, queries: List[str], k: int) -> List[List[Tuple[RetrievedChunk, Optional[float]]]]:
+        """混合檢索：向量與 BM25 各取回候選，以倒數排名融合（RRF）排序後取前 k 個
+        
+        向量候選需通過相似度閾值，BM25 候選只需有詞彙重疊；融合後的結果與純向量檢索一樣
+        需通過 _is_content_relevant（排除案例示範、OCR 等不相關內容），依融合排名取前 k 個通過者。
+        """
+        candidate_k = min(max(k, self.settings.rag_hybrid_candidates), self._index_size())
+        query_vectors = self._embed_queries(queries)
+        vector_results = self._search_vectors(query_vectors, candidate_k)
+        
+        results = []
+        for query, query_vector, hits in zip(queries, query_vectors, vector_results):
+            hits_by_id = {chunk.chunk_id: (chunk, score) for chunk, score in hits}
+            vector_ranking = [
+                chunk.chunk_id for chunk, score in hits
+                if self._to_similarity(score) >= self.settings.rag_min_similarity
+            ]
+            lexical_ids, _ = self.lexical_index.search(query, candidate_k)
+            fused = reciprocal_rank_fusion([vector_ranking, lexical_ids.tolist()], self.settings.rag_rrf_k)
             
-            # 移除Markdown格式標記
-            line = line.replace('**', '').replace('*', '')
+            selected = []
+            lexical_only = []
+            for chunk_id, _ in fused:
+                chunk = hits_by_id[chunk_id][0] if chunk_id in hits_by_id else self._get_chunk(chunk_id)
+                if not self._is_content_relevant(chunk.text, query):
+                    continue
+                selected.append(chunk_id)
+                if chunk_id not in hits_by_id:
+                    lexical_only.append(chunk_id)
+                if len(selected) >= k:
+                    break
             
-            skip_title = False
-            if line:  # 只添加非空行
-                content_lines.append(line)
+            # 只由 BM25 命中的 chunk 需另外計算向量分數
+            if lexical_only:
+                hits_by_id.update(self._lookup_chunks(lexical_only, query_vector))
+            results.append([hits_by_id[chunk_id] for chunk_id in selected])
         
-        # 重新組合內容，用空格分隔，讓內容更自然
-        formatted_content = ' '.join(content_lines)
+        return results
+    
+    def _lookup_chunks(self, chunk_ids: List[int], query_vector: np.ndarray) -> Dict[int, Tuple[RetrievedChunk, Optional[float]]]:
+        """依 chunk ID 取出 chunk，並以索引重建的向量計算向量分數（索引無法重建向量時為 None）"""
+        scores: List[Optional[float]] = [None] * len(chunk_ids)
+        try:
+            vectors = self._active_index().reconstruct_batch(np.asarray(chunk_ids, dtype=np.int64))
+            if self._inner_product:
+                scores = (vectors @ query_vector).tolist()
+            else:
+                scores = ((vectors - query_vector) ** 2).sum(axis=1).tolist()
+        except Exception:
+            # IVF-PQ 等索引未建立 direct map 時無法重建向量
+            pass
+        return {chunk_id: (self._get_chunk(chunk_id), score) for chunk_id, score in zip(chunk_ids, scores)}
+    
+    def _get_chunk(self, chunk_id: int) -> RetrievedChunk:
+        """依向量位置取得 chunk"""
+        if self.engine is not None:
+            return self.engine.chunk_store.get(chunk_id)
+        
+        doc = self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[chunk_id])
+        return RetrievedChunk(
+            chunk_id=chunk_id,
+            text=doc.page_content,
+            source=doc.metadata.get('source', '未知來源'),
+            page=doc.metadata.get('page', 0)
+        )
+    
+    def _search_langchain_store(self, query_vectors: np.ndarray, fetch_k: int) -> List[List[Tuple[RetrievedChunk, float]]]:
+        """透過 langchain FAISS 向量庫的索引與 docstore 搜尋（備用路徑）"""
+        scores, indices = self.vector_store.index.search(query_vectors, fetch_k)
+        
+        batch_results = []
+        for row_scores, row_indices in zip(scores, indices):
+            hits = []
+            for score, idx in zip(row_scores, row_indices):
+                if idx == -1:  # 索引中的向量不足 fetch_k 個
+                    continue
+                hits.append((self._get_chunk(int(idx)), float(score)))
+            batch_results.append(hits)
         
+        return batch_results
+    
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """計算查詢向量，優先使用快取，未命中的查詢合併為一次 embedding 呼叫"""
+        vectors = self.query_cache.get_many(queries)
+        
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # 同一批次中重複的查詢只計算一次
+            unique_texts = list(dict.fromkeys(queries[i] for i in missing))
+            computed = dict(zip(unique_texts, self.embeddings.embed_documents(unique_texts)))
+            for i in missing:
+                vectors[i] = np.asarray(computed[queries[i]], dtype=np.float32)
+            # 寫入磁碟由快取在背景批次進行，不阻塞本次查詢
+            for text, vector in computed.items():
+                self.query_cache.put(text, vector)
+        
+        return np.stack(vectors).astype(np.float32, copy=False)
+    
+    def _filter_relevant_results(self, results_with_scores: List[Tuple[RetrievedChunk, float]], query: str, k: int) -> List[Tuple[RetrievedChunk, float]]:
+        """依相似度閾值與內容相關性過濾搜尋結果（最多 k 個）"""
+        filtered_results = []
+        if k <= 0:
+            return filtered_results
+        
+        for chunk, score in results_with_scores:
+            if self._to_similarity(score) >= self.settings.rag_min_similarity and self._is_content_relevant(chunk.text, query):
+                filtered_results.append((chunk, score))
+                if len(filtered_results) >= k:  # 限制結果數量
+                    break
+        
+        return filtered_results
+    
+    def _active_index(self) -> Any:
+        """取得目前使用中的 faiss 索引"""
+        return self.engine.index if self.engine is not None else self.vector_store.index
+    
+    def _index_size(self) -> int:
+        """索引中的向量數量"""
+        return self._active_index().ntotal
+    
+    def _to_similarity(self, score: float) -> float:
+        """將 FAISS 分數轉換為餘弦相似度
+        
+        向量皆已正規化：內積索引的分數即為餘弦相似度；
+        L2 索引回傳平方距離，d² = 2 - 2·cos，故 cos = 1 - d² / 2。
+        """
+        if self._inner_product:
+            return score
+        return 1.0 - score / 2.0
+    
+    @property
+    def _inner_product(self) -> bool:
+        """目前索引是否使用內積度量"""
+        return is_inner_product_index(self._active_index())
+    
+    def _clean_document_content(self, content: str) -> str:
+        """移除文檔開頭的標題與 Markdown 格式，將各行以空格串接"""
+        return clean_chunk_text(content, get_keyword_registry().document_title_markers)
+    
+    def _format_document_content(self, source: str, content: str) -> str:
+        """格式化文檔內容，移除不必要的標題和格式"""
         # 清理多餘的空格
-        import re
-        formatted_content = re.sub(r'\s+', ' ', formatted_content).strip()
+        formatted_content = _WHITESPACE_RE.sub(' ', self._clean_document_content(content)).strip()
         
         # 限制內容長度，避免過長的引用
         if len(formatted_content) > 600:
             formatted_content = formatted_content[:600] + "..."
         
-        # 美化檔名顯示
-        filename = source.split('/')[-1]
-        clean_name = filename.replace('.pdf', '').replace('.txt', '').replace('.jpg', '').replace('_', ' ')
-        return f"📚 **{clean_name}**\n\n{formatted_content}"
+        return f"📚 **{clean_source_name(source)}**\n\n{formatted_content}"
     
-    def _format_document_content_with_query(self, source: str, content: str, query: str) -> str:
+    def _format_document_content_with_query(self, source: str, content: str, query: str,
+                                            chunk_id: Optional[int] = None) -> str:
         """格式化文檔內容，確保與查詢相關，並提取最相關的段落"""
-        # 移除文檔開頭的標題（通常是第一行或前幾行）
-        lines = content.strip().split('\n')
-        
-        # 跳過開頭的標題行（通常是文檔標題）
-        content_lines = []
-        skip_title = True
-        
-        for line in lines:
-            line = line.strip()
-            
-            # 如果是空行，跳過
-            if not line:
-                continue
-                
-            # 如果遇到Markdown標題（## 或 ###），移除標題標記但保留內容
-            if line.startswith('##') or line.startswith('###'):
-                if skip_title:
-                    continue
-                else:
-                    # 移除標題標記，保留內容
-                    line = line.lstrip('#').strip()
-            
-            # 跳過文檔開頭的標題（包含特定關鍵詞的短行）
-            if skip_title and len(line) < 50 and ('指引' in line or '指南' in line or '臨床' in line):
-                skip_title = False
-                continue
-            
-            # 移除Markdown格式標記
-            line = line.replace('**', '').replace('*', '')
-            
-            skip_title = False
-            if line:  # 只添加非空行
-                content_lines.append(line)
-        
-        # 重新組合內容
-        full_content = ' '.join(content_lines)
-        
         # 根據查詢提取最相關的段落
-        relevant_content = self._extract_relevant_paragraph(full_content, query)
+        relevant_content = self._extract_relevant_paragraph(content, query, chunk_id)
         
         # 清理多餘的空格
-        import re
-        relevant_content = re.sub(r'\s+', ' ', relevant_content).strip()
+        relevant_content = _WHITESPACE_RE.sub(' ', relevant_content).strip()
         
         # 限制內容長度，避免過長的引用
         if len(relevant_content) > 500:  # 減少長度以提高精準度
             relevant_content = relevant_content[:500] + "..."
         
-        # 美化檔名顯示
-        filename = source.split('/')[-1]
-        clean_name = filename.replace('.pdf', '').replace('.txt', '').replace('.jpg', '').replace('_', ' ')
-        return f"📚 **{clean_name}**\n\n{relevant_content}"
-    
-    def _extract_relevant_paragraph(self, content: str, query: str) -> str:
-        """從內容中提取與查詢最相關的段落"""
-        # 將內容按句號分割成段落
-        sentences = content.split('。')
-        
-        # 計算每個句子與查詢的相關性
-        query_words = set(query.lower().split())
-        best_sentence = ""
-        best_score = 0
-        
-        # 定義查詢相關的關鍵詞映射
-        query_keywords = {
-            'ecg': ['ecg', '心電圖', '12導程', '心電'],
-            'opqrst': ['opqrst', '問診', '病史', 'onset', 'quality', 'radiation', 'severity', 'time'],
-            '急性冠心症': ['急性冠心症', 'acs', '心肌梗塞', '心絞痛'],
-            '心肌鈣蛋白': ['troponin', '心肌鈣蛋白', '心肌酵素', 'ck-mb', '檢驗', '抽血']
-        }
-        
-        # 擴展查詢關鍵詞
-        expanded_query_words = query_words.copy()
-        for key, keywords in query_keywords.items():
-            if any(word in query.lower() for word in [key] + keywords):
-                expanded_query_words.update(keywords)
-        
-        for sentence in sentences:
-            if not sentence.strip():
-                continue
-                
-            sentence_words = set(sentence.lower().split())
-            
-            # 計算詞彙重疊度
-            overlap = len(expanded_query_words.intersection(sentence_words))
-            if overlap > 0:
-                # 計算相關性分數（重疊詞數 / 查詢詞數）
-                score = overlap / len(expanded_query_words)
-                if score > best_score:
-                    best_score = score
-                    best_sentence = sentence.strip()
-        
-        # 如果找到相關句子，返回該句子及其前後文
-        if best_sentence and best_score > 0.1:  # 設定最小相關性閾值
-            # 找到最佳句子在原文中的位置
-            best_index = -1
-            for i, sent in enumerate(sentences):
-                if sent.strip() == best_sentence:
-                    best_index = i
-                    break
-            
-            if best_index >= 0:
-                # 返回最佳句子及其前後各一句
-                start = max(0, best_index - 1)
-                end = min(len(sentences), best_index + 2)
-                relevant_sentences = sentences[start:end]
-                return '。'.join(relevant_sentences)
-        
-        # 如果沒有找到足夠相關的句子，嘗試在整個內容中搜尋關鍵詞
-        if best_score <= 0.1:
-            # 直接在內容中搜尋關鍵詞，返回包含關鍵詞的段落
-            for keyword in expanded_query_words:
-                if keyword in content.lower():
-                    # 找到關鍵詞的位置
-                    keyword_pos = content.lower().find(keyword)
-                    if keyword_pos >= 0:
-                        # 提取關鍵詞前後各200個字符
-                        start = max(0, keyword_pos - 200)
-                        end = min(len(content), keyword_pos + len(keyword) + 200)
-                        relevant_content = content[start:end]
-                        return relevant_content
-        
-        # 如果都沒有找到，返回前幾句
-        return '。'.join(sentences[:2]) if len(sentences) >= 2 else content
+        return f"📚 **{clean_source_name(source)}**\n\n{relevant_content}"
+    
+    def _extract_relevant_paragraph(self, content: str, query: str, chunk_id: Optional[int] = None) -> str:
+        """從 chunk 中提取與查詢最相關的段落
+        
+        有預計算的斷句結果時直接查表並以 token ID 計分，否則即時清理與斷句。
+        """
+        registry = get_keyword_registry()
+        expanded_query_words, query_matcher = registry.paragraph_query_terms(query)
+        
+        segments = self.segments
+        if segments is not None and chunk_id is not None and 0 <= chunk_id < len(segments):
+            segment = segments.get(chunk_id)
+            query_terms = segments.query_token_ids(expanded_query_words)
+        else:
+            segment = segment_text(content, registry.document_title_markers)
+            query_terms = expanded_query_words
+        
+        return extract_relevant_paragraph(segment, query_terms, len(expanded_query_words), query_matcher)
     
     def _is_content_relevant(self, content: str, query: str) -> bool:
         """檢查內容是否與查詢相關"""
-        content_lower = content.lower()
-        query_lower = query.lower()
-        
-        # 定義查詢相關的關鍵詞映射
-        query_keywords = {
-            'ecg': ['ecg', '心電圖', '12導程', '心電', 'electrocardiogram'],
-            'opqrst': ['opqrst', '問診', '病史', 'onset', 'quality', 'radiation', 'severity', 'time', '發作', '性質', '放射', '嚴重', '時間'],
-            '急性冠心症': ['急性冠心症', 'acs', '心肌梗塞', '心絞痛', 'acute coronary syndrome', 'myocardial infarction'],
-            '心肌鈣蛋白': ['troponin', '心肌鈣蛋白', '心肌酵素', 'ck-mb', '檢驗', '抽血', 'cardiac troponin'],
-            '實驗室檢查': ['實驗室', '檢驗', '血液', 'laboratory', 'test', 'blood test'],
-            '血液檢驗': ['血液', '檢驗', '抽血', 'blood', 'test', 'laboratory']
-        }
+        # 單次掃描同時比對查詢詞、查詢觸發的關鍵詞與不相關內容特徵
+        matched_groups = get_keyword_registry().relevance_matcher(query).match(content)
         
-        # 檢查直接匹配
-        if any(word in content_lower for word in query_lower.split()):
+        # 直接匹配或關鍵詞映射匹配
+        if "relevant" in matched_groups:
             return True
         
-        # 檢查關鍵詞映射
-        for key, keywords in query_keywords.items():
-            if any(word in query_lower for word in [key] + keywords):
-                if any(keyword in content_lower for keyword in keywords):
-                    return True
-        
         # 檢查是否包含不相關的內容（如圖片OCR結果）
-        irrelevant_indicators = ['案例', '案例2', '案例3', '案例4', '案例5', '特雷弗', '雅各布先生']
-        if any(indicator in content for indicator in irrelevant_indicators):
+        if "irrelevant" in matched_groups:
             return False
         
         # 檢查內容長度，太短的內容可能不相關
@@ -318,129 +598,84 @@ class RAGService:
         return True
     
     def search_with_citations(self, queries: List[str], k: Optional[int] = None) -> List[Citation]:
-        """執行多個查詢並返回帶引註的結果"""
-        citations = []
+        """執行多個查詢並返回帶引註的結果（未預計算的查詢批次搜尋）"""
+        if not self.is_available() or not queries:
+            return []
         
+        k = k or self.settings.rag_search_k
+        
+        citations_by_id: Dict[int, Optional[Citation]] = {}
+        pending = []
         for i, query in enumerate(queries, 1):
-            if not self.vector_store:
-                continue
-                
-            k = k or self.settings.rag_search_k
-            print(f"[RAG] 正在搜尋關於 '{query}' 的資料...")
-            
+            cached = self.result_cache.get("citation", query, k)
+            if cached is CACHE_MISS:
+                pending.append((i, query))
+            else:
+                citations_by_id[i] = Citation(id=i, **cached) if cached else None
+        
+        if pending:
+            try:
+                citations_by_id.update(self._compute_citations(pending, k))
+            except Exception as e:
+                print(f"[RAG] 搜尋失敗: {e}")
+        
+        return [citations_by_id[i] for i in sorted(citations_by_id) if citations_by_id[i]]
+    
+    def _compute_citations(self, indexed_queries: List[Tuple[int, str]], k: int) -> Dict[int, Optional[Citation]]:
+        """批次搜尋並建立引註，返回 {引註編號: 引註或 None}"""
+        print(f"[RAG] 正在批次搜尋 {len(indexed_queries)} 個查詢...")
+        batch_results = self._search_filtered([query for _, query in indexed_queries], k)
+        
+        citations: Dict[int, Optional[Citation]] = {}
+        for (i, query), filtered_results in zip(indexed_queries, batch_results):
+            citations[i] = None
             try:
-                # 使用相似度搜尋，並獲取分數
-                results_with_scores = self.vector_store.similarity_search_with_score(query, k=k*2)
-                
-                if not results_with_scores:
-                    continue
-                
-                # 過濾低相關性的結果
-                filtered_results = []
-                for doc, score in results_with_scores:
-                    if score < 1.2 and self._is_content_relevant(doc.page_content, query):
-                        filtered_results.append((doc, score))
-                    if len(filtered_results) >= k:
-                        break
-                
-                if not filtered_results:
-                    # 如果過濾後沒有結果，使用前k個結果
-                    for doc, score in results_with_scores[:k]:
-                        if self._is_content_relevant(doc.page_content, query):
-                            filtered_results.append((doc, score))
-                            if len(filtered_results) >= k:
-                                break
-                
                 if not filtered_results:
                     continue
                 
                 # 取最相關的結果作為引註
-                best_doc, best_score = filtered_results[0]
-                
-                # 提取來源資訊
-                source_file = best_doc.metadata.get('source', '未知來源')
-                page_number = best_doc.metadata.get('page', 0) + 1  # page 是從 0 開始的
-                
-                # 美化檔名顯示
-                filename = source_file.split('/')[-1]
-                clean_name = filename.replace('.pdf', '').replace('.txt', '').replace('.jpg', '').replace('_', ' ')
-                
-                # 格式化內容
-                formatted_content = self._format_document_content_with_query(
-                    source_file, best_doc.page_content, query
-                )
-                
-                citation = Citation(
-                    id=i,
-                    query=query,
-                    source=clean_name,
-                    content=formatted_content,
-                    page_number=page_number,
-                    metadata={
-                        "search_k": k,
-                        "score": float(best_score),  # 轉換為 Python float
-                        "original_source": source_file
-                    }
-                )
-                citations.append(citation)
+                best_chunk, best_score = filtered_results[0]
+                citations[i] = self._build_citation(i, query, best_chunk, best_score, k)
                 
             except Exception as e:
-                print(f"[RAG] 搜尋失敗: {e}")
+                print(f"[RAG] 處理查詢 '{query}' 結果失敗: {e}")
                 continue
         
         return citations
     
+    def _build_citation(self, citation_id: int, query: str, chunk: RetrievedChunk, score: Optional[float], k: int) -> Citation:
+        """根據搜尋結果建立引註"""
+        # 提取來源資訊
+        source_file = chunk.source
+        page_number = chunk.page + 1  # page 是從 0 開始的
+        
+        # 美化檔名顯示
+        clean_name = clean_source_name(source_file)
+        
+        # 格式化內容
+        formatted_content = self._format_document_content_with_query(
+            source_file, chunk.text, query, chunk.chunk_id
+        )
+        
+        return Citation(
+            id=citation_id,
+            query=query,
+            source=clean_name,
+            content=formatted_content,
+            page_number=page_number,
+            metadata={
+                "search_k": k,
+                "score": float(score) if score is not None else None,  # 轉換為 Python float
+                "similarity": round(float(self._to_similarity(score)), 4) if score is not None else None,
+                "original_source": source_file
+            }
+        )
+    
     def generate_rag_queries(self, conversation_text: str, case_type: str = "chest_pain") -> List[str]:
         """根據對話內容和案例類型生成多語言 RAG 查詢"""
-        # 多語言查詢模板
-        multilingual_queries = {
-            "chest_pain": {
-                "chinese": [
-                    "急性胸痛診斷流程和檢查順序",
-                    "ECG 心電圖在胸痛評估中的重要性",
-                    "STEMI 和不穩定型心絞痛的診斷標準",
-                    "胸痛問診的 OPQRST 技巧和重點",
-                    "OSCE 問診技巧和病史詢問指南",
-                    "急性胸痛的鑑別診斷和檢查項目"
-                ],
-                "english": [
-                    "acute chest pain diagnostic protocol and examination sequence",
-                    "ECG electrocardiogram importance in chest pain evaluation",
-                    "STEMI and unstable angina diagnostic criteria",
-                    "OPQRST technique for chest pain history taking",
-                    "OSCE history taking skills and guidelines",
-                    "differential diagnosis and investigations for acute chest pain"
-                ],
-                "medical_terms": [
-                    "acute coronary syndrome diagnosis",
-                    "myocardial infarction diagnostic criteria",
-                    "chest pain emergency evaluation",
-                    "cardiac enzymes troponin",
-                    "12-lead ECG interpretation",
-                    "chest pain red flags"
-                ]
-            },
-            "default": {
-                "chinese": [
-                    "臨床診斷流程和檢查順序",
-                    "關鍵症狀的評估方法",
-                    "診斷標準和治療指引",
-                    "問診技巧和重點"
-                ],
-                "english": [
-                    "clinical diagnostic protocol and examination sequence",
-                    "key symptoms evaluation methods",
-                    "diagnostic criteria and treatment guidelines",
-                    "history taking skills and key points"
-                ]
-            }
-        }
-        
+        registry = get_keyword_registry()
         queries = []
-        case_queries = multilingual_queries.get(case_type, multilingual_queries["default"])
-        
-        # 根據對話內容選擇最相關的查詢
-        conversation_lower = conversation_text.lower()
+        case_queries = registry.get_query_templates(case_type)
         
         # 中文查詢（確保本地化內容）
         queries.extend(case_queries["chinese"][:2])
@@ -453,32 +688,135 @@ class RAGService:
             queries.extend(case_queries["medical_terms"][:2])
         
         # 根據對話內容動態調整
-        if any(keyword in conversation_lower for keyword in ["ecg", "心電圖", "12導程", "electrocardiogram"]):
-            queries.insert(0, "12-lead ECG interpretation")
-            queries.insert(1, "ECG electrocardiogram importance in chest pain evaluation")
-            
-        if any(keyword in conversation_lower for keyword in ["問診", "病史", "osce", "history taking"]):
-            queries.insert(0, "OSCE history taking skills and guidelines")
-            queries.insert(1, "OPQRST technique for chest pain history taking")
-            
-        if any(keyword in conversation_lower for keyword in ["鑑別", "診斷", "檢查", "diagnosis", "investigation"]):
-            queries.insert(0, "acute chest pain diagnostic protocol")
-            queries.insert(1, "differential diagnosis and investigations")
+        for inserted_queries in registry.match_conversation_queries(conversation_text):
+            queries[0:0] = inserted_queries
         
         return queries[:6]  # 返回前6個最相關的查詢
     
+    def register_precompute_queries(self, queries: List[str], k: int) -> None:
+        """登記固定查詢詞彙，索引可用時預先計算其檢索結果（索引載入中則於載入完成後計算）"""
+        with self._state_lock:
+            self._precompute_plan.append((list(queries), k))
+            ready = self.is_available()
+        if ready and self.settings.rag_precompute_results:
+            self.precompute_results(queries, k)
+    
+    def precompute_results(self, queries: List[str], k: int) -> int:
+        """預先計算並快取查詢的 search / search_with_citations / search_merged 結果
+        
+        已有快取的查詢會略過；新結果會連同索引指紋一併寫入磁碟。
+        
+        Returns:
+            新計算的查詢數量
+        """
+        if not self.is_available():
+            return 0
+        
+        pending = [
+            query for query in dict.fromkeys(queries)
+            if not all(self.result_cache.contains(kind, query, k) for kind in ("citation", "search", "hits"))
+        ]
+        if not pending:
+            return 0
+        
+        print(f"💡 [RAG] 正在預計算 {len(pending)} 個固定查詢的檢索結果...")
+        try:
+            # 三種結果共用同一次批次檢索
+            batch_results = self._search_filtered(pending, k)
+            for query, hits in zip(pending, batch_results):
+                citation = self._build_citation(1, query, hits[0][0], hits[0][1], k) if hits else None
+                self.result_cache.put(
+                    "citation", query, k,
+                    citation.model_dump(exclude={"id"}) if citation else None
+                )
+                self.result_cache.put(
+                    "search", query, k,
+                    self._format_chunks(query, [chunk for chunk, _ in hits]) if hits
+                    else "在知識庫中找不到與查詢相關的資料。"
+                )
+                self.result_cache.put(
+                    "hits", query, k,
+                    [[chunk.chunk_id, float(score) if score is not None else None] for chunk, score in hits]
+                )
+        except Exception as e:
+            print(f"⚠️ [RAG] 預計算失敗: {e}")
+            return 0
+        
+        self.result_cache.save()
+        self.query_cache.save()
+        return len(pending)
+    
+    def _compute_index_fingerprint(self) -> str:
+        """計算索引指紋（索引檔案大小與修改時間、embedding 模型、結果格式版本、混合檢索設定）"""
+        hasher = hashlib.sha1()
+        hasher.update(
+            f"v{RESULT_FORMAT_VERSION}:{self.settings.rag_model_name}:{self.settings.rag_min_similarity}".encode("utf-8")
+        )
+        if self.settings.rag_hybrid_search:
+            hasher.update(
+                f"|hybrid:{self.settings.rag_hybrid_candidates}:{self.settings.rag_rrf_k}".encode("utf-8")
+            )
+        for name in ("index.faiss", "index.pkl", f"{LEXICAL_INDEX_DIRNAME}/meta.json"):
+            path = self.settings.faiss_index_dir / name
+            if path.exists():
+                stat = path.stat()
+                hasher.update(f"|{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+        return hasher.hexdigest()[:16]
+    
     def is_available(self) -> bool:
-        """檢查 RAG 服務是否可用"""
-        return self.vector_store is not None
+        """檢查 RAG 服務是否可用（不等待背景載入）"""
+        return self.engine is not None or self.vector_store is not None
+    
+    def is_loading(self) -> bool:
+        """檢查索引是否仍在背景載入中"""
+        return not self._ready_event.is_set()
+    
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """等待背景載入完成，返回 RAG 服務是否可用
+        
+        Args:
+            timeout: 最長等待秒數，None 表示使用設定值 rag_ready_timeout
+        """
+        if timeout is None:
+            timeout = self.settings.rag_ready_timeout
+        if not self._ready_event.wait(timeout):
+            print(f"⚠️ [RAG] 等待索引載入逾時（{timeout}s）")
+        return self.is_available()
     
     def get_index_info(self) -> Dict[str, Any]:
         """取得索引資訊"""
-        if not self.vector_store:
-            return {"status": "not_initialized", "index_path": str(self.settings.faiss_index_dir)}
+        if not self.is_available():
+            info = {"status": self.status, "ready": False, "index_path": str(self.settings.faiss_index_dir)}
+            if self.load_error:
+                info["error"] = self.load_error
+            return info
         
         return {
-            "status": "initialized",
+            "status": self.status,
+            "ready": True,
             "index_path": str(self.settings.faiss_index_dir),
             "embedding_model": self.settings.rag_model_name,
-            "search_k": self.settings.rag_search_k
+            "engine": "faiss" if self.engine is not None else "langchain",
+            "mmap": self.engine is not None and self.settings.rag_mmap_index,
+            "metric": "inner_product" if self._inner_product else "l2",
+            "index_type": describe_index(self._active_index()),
+            "num_vectors": self._index_size(),
+            "min_similarity": self.settings.rag_min_similarity,
+            "search_k": self.settings.rag_search_k,
+            "hybrid": {
+                "enabled": self.lexical_index is not None,
+                "num_terms": len(self.lexical_index.terms) if self.lexical_index is not None else 0,
+                "candidates": self.settings.rag_hybrid_candidates,
+                "rrf_k": self.settings.rag_rrf_k
+            },
+            "query_cache": {
+                "size": len(self.query_cache),
+                "hits": self.query_cache.hits,
+                "misses": self.query_cache.misses
+            },
+            "precomputed_results": {
+                "size": len(self.result_cache),
+                "hits": self.result_cache.hits,
+                "fingerprint": self.result_cache.fingerprint
+            }
         }
@@ -3,7 +3,9 @@
 """
 
 import re
-from typing import List, Dict, Any, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
 
@@ -14,9 +16,22 @@ from ..services.ai_service import get_ai_service
 from ..services.rag_service import RAGService
 from ..services.case_service import CaseService
 from ..config.settings import get_settings
+from ..config.keyword_registry import get_keyword_registry
 from ..utils.file_utils import save_report_to_file, generate_report_filename
 
 
+# 報告中 RAG 搜尋使用的 k 值
+REPORT_RAG_K = 2
+
+# 即時回饋報告中「相關臨床指引」最多列出的查詢段落數
+REPORT_RAG_SECTIONS = 2
+
+
+def get_feedback_query_vocabulary() -> List[str]:
+    """取得回饋報告可能產生的所有 RAG 查詢（用於預計算檢索結果）"""
+    return get_keyword_registry().feedback_query_vocabulary()
+
+
 class ReportService:
     """報告生成服務"""
     
@@ -25,6 +40,14 @@ class ReportService:
         self.case_service = case_service or CaseService(self.settings)
         self.ai_service = ai_service or get_ai_service(self.settings)
         self.rag_service = rag_service or RAGService(self.settings)
+        
+        # 詳細報告各階段共用的執行緒池
+        self._stage_executor = ThreadPoolExecutor(
+            max_workers=max(1, self.settings.report_stage_workers), thread_name_prefix="report-stage"
+        )
+        
+        # 回饋查詢只有少數固定字串，預先計算其檢索結果
+        self.rag_service.register_precompute_queries(get_feedback_query_vocabulary(), k=REPORT_RAG_K)
     
     def generate_feedback_report(self, conversation: Conversation) -> Report:
         """生成即時回饋報告"""
@@ -40,14 +63,14 @@ class ReportService:
         # 生成基本分析報告
         report_content = self._generate_basic_analysis(conversation, case)
         
-        # 如果有 RAG 服務，基於回饋內容添加相關指引
-        if self.rag_service.is_available():
+        # 如果有 RAG 服務，基於回饋內容添加相關指引（索引仍在背景載入時等待）
+        if self.rag_service.wait_until_ready():
             # 基於已生成的回饋內容生成相關查詢
             rag_queries = self._generate_queries_from_feedback(report_content)
             
             # 使用查詢獲取最相關的指引
             if rag_queries:
-                rag_context = self._search_multiple_queries(rag_queries, k=2)
+                rag_context = self._search_multiple_queries(rag_queries, k=REPORT_RAG_K)
                 if rag_context and "RAG 系統未初始化" not in rag_context:
                     report_content += f"\n\n### 相關臨床指引\n{rag_context}"
         
@@ -71,26 +94,69 @@ class ReportService:
     
     def generate_detailed_report(self, conversation: Conversation) -> Report:
         """生成詳細分析報告（使用 LLM + RAG）"""
-        case = self.case_service.get_case(conversation.case_id)
-        if not case:
-            raise ValueError(f"Case not found: {conversation.case_id}")
-        
-        # 先生成初步分析報告
-        initial_feedback = self._generate_basic_analysis(conversation, case)
-        
-        # 基於初步回饋內容生成更精準的 RAG 查詢
-        rag_queries = self._generate_queries_from_feedback(initial_feedback)
-        
-        citations = []
-        if self.rag_service.is_available():
-            # 使用新的 search_with_citations 方法生成帶有完整來源資訊的引註
-            citations = self.rag_service.search_with_citations(rag_queries, k=2)
+        for event, payload in self.iter_detailed_report(conversation, stream_llm=False):
+            if event == "report":
+                return payload
+        raise RuntimeError("詳細報告生成未完成")
+    
+    def iter_detailed_report(self, conversation: Conversation, stream_llm: bool = True) -> Iterator[Tuple[str, Any]]:
+        """逐階段生成詳細分析報告，每個階段完成即返回 (事件, 內容)
+        
+        事件依序為：
+        - ("queries", RAG 查詢列表)
+        - ("citations", 引註列表)
+        - ("llm", None)：開始呼叫 LLM
+        - ("token", 文字)：LLM 產生的一段報告內容（stream_llm 為 True 時）
+        - ("report", Report)：完整報告，報告檔案只在此時寫入一次
+        """
+        stages: Dict[str, Any] = {}
+        for stage, result in self._iter_detailed_report_stages(conversation):
+            stages[stage] = result
+            if stage in ("queries", "citations"):
+                yield stage, result
+        
+        case, citations, stage_timings = stages["case"], stages["citations"], stages["timings"]
+        messages = self._build_detailed_prompt_messages(conversation, case, citations)
+        
+        # 生成詳細報告內容（LLM 失敗時的備用報告沿用已生成的基本分析）
+        yield "llm", None
+        started = time.perf_counter()
+        if stream_llm:
+            report_content = yield from self._stream_llm_report(messages, citations, stages["basic_analysis"])
+        else:
+            report_content = self._generate_detailed_analysis_with_llm(
+                conversation, case, citations, basic_analysis=stages["basic_analysis"], messages=messages
+            )
+        stage_timings["llm"] = round(time.perf_counter() - started, 3)
         
-        # 生成詳細報告內容
-        report_content = self._generate_detailed_analysis_with_llm(
-            conversation, case, citations
+        yield "report", self._finish_detailed_report(
+            conversation, report_content, citations, stages["queries"], stage_timings
         )
+    
+    def _stream_llm_report(self, messages: List[Any], citations: List[Citation],
+                           basic_analysis: str) -> Iterator[Tuple[str, Any]]:
+        """以串流方式呼叫 LLM，逐段返回 ("token", 文字)，最後返回完整報告內容
         
+        LLM 失敗時返回備用報告；串流中已送出的內容由最終報告取代。
+        """
+        parts: List[str] = []
+        try:
+            for token in self.ai_service.chat_stream(messages):
+                parts.append(token)
+                yield "token", token
+        except Exception as e:
+            print(f"⚠️ [Report] LLM 串流失敗，改用備用報告: {e}")
+            return self._build_fallback_report(basic_analysis, citations)
+        
+        content = "".join(parts)
+        report_content = self._finalize_llm_report(content, citations)
+        if len(report_content) > len(content):
+            yield "token", report_content[len(content):]
+        return report_content
+    
+    def _finish_detailed_report(self, conversation: Conversation, report_content: str, citations: List[Citation],
+                                rag_queries: List[str], stage_timings: Dict[str, float]) -> Report:
+        """建立詳細報告並寫入檔案"""
         report = Report(
             report_type=ReportType.DETAILED,
             content=report_content,
@@ -102,7 +168,8 @@ class ReportService:
                 "generated_at": datetime.now().isoformat(),
                 "conversation_length": len(conversation.messages),
                 "rag_available": self.rag_service.is_available(),
-                "citations_count": len(citations)
+                "citations_count": len(citations),
+                "stage_timings": stage_timings
             }
         )
         
@@ -118,22 +185,91 @@ class ReportService:
         
         return report
     
+    def _iter_detailed_report_stages(self, conversation: Conversation) -> Iterator[Tuple[str, Any]]:
+        """在執行緒池上執行詳細報告 LLM 前的各階段，每個階段完成即返回 (階段, 結果)
+        
+        案例 → 基本分析 → 查詢 → 檢索彼此相依，只能依序執行；與它們重疊的只有索引的背景載入。
+        等待索引就緒不佔用共用執行緒池：呼叫端執行緒在檢索前等待剩餘的 rag_ready_timeout，
+        避免多份報告同時等待索引時佔滿執行緒池，讓其他報告的案例載入與基本分析逾時。
+        各階段結果只計算一次，後續階段（含 LLM 失敗時的備用報告）直接沿用。
+        案例載入與基本分析逾時（report_stage_timeout）會中止報告；
+        索引未就緒或檢索逾時（report_retrieval_timeout）則不附引註，繼續生成報告。
+        
+        階段依序為 case、basic_analysis、queries、citations，最後是 timings（各階段耗時秒數）。
+        """
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        
+        def timed(name, func, *args):
+            def run():
+                stage_started = time.perf_counter()
+                try:
+                    return func(*args)
+                finally:
+                    timings[name] = round(time.perf_counter() - stage_started, 3)
+            return run
+        
+        case_future = self._stage_executor.submit(timed("case", self.case_service.get_case, conversation.case_id))
+        
+        try:
+            case = case_future.result(timeout=self.settings.report_stage_timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"載入案例逾時: {conversation.case_id}")
+        if not case:
+            raise ValueError(f"Case not found: {conversation.case_id}")
+        yield "case", case
+        
+        # 先生成初步分析報告，並基於初步回饋內容生成更精準的 RAG 查詢
+        analysis_future = self._stage_executor.submit(
+            timed("basic_analysis", self._generate_basic_analysis, conversation, case)
+        )
+        try:
+            initial_feedback = analysis_future.result(timeout=self.settings.report_stage_timeout)
+        except FutureTimeoutError:
+            raise TimeoutError("生成基本分析逾時")
+        yield "basic_analysis", initial_feedback
+        
+        rag_queries = self._generate_queries_from_feedback(initial_feedback)
+        yield "queries", rag_queries
+        
+        # 索引在背景載入，從報告開始算起最多等待 rag_ready_timeout（在呼叫端執行緒等待，不佔用執行緒池）
+        ready_timeout = max(0.0, self.settings.rag_ready_timeout - (time.perf_counter() - started))
+        rag_ready = timed("rag_ready", self.rag_service.wait_until_ready, ready_timeout)()
+        
+        retrieval_future = self._stage_executor.submit(
+            timed("retrieval", self.rag_service.search_with_citations, rag_queries, REPORT_RAG_K)
+        ) if rag_ready else None
+        try:
+            citations = retrieval_future.result(
+                timeout=self.settings.report_retrieval_timeout
+            ) if retrieval_future else []
+        except FutureTimeoutError:
+            print("⚠️ [Report] RAG 檢索逾時，報告將不附引註")
+            citations = []
+        except Exception as e:
+            print(f"⚠️ [Report] RAG 檢索失敗: {e}")
+            citations = []
+        yield "citations", citations
+        
+        timings["total_before_llm"] = round(time.perf_counter() - started, 3)
+        yield "timings", dict(timings)
+    
     def _generate_basic_analysis(self, conversation: Conversation, case: Case) -> str:
         """生成基本分析報告（不使用 LLM）"""
         checklist = case.get_feedback_checklist()
         critical_actions = case.get_critical_actions()
         user_messages = conversation.get_user_messages()
         
-        # 分析覆蓋率
-        conversation_text = conversation.get_conversation_text().lower()
+        # 分析覆蓋率（單次掃描找出所有項目命中的關鍵字）
+        conversation_text = conversation.get_conversation_text()
+        matched_by_item = case.get_checklist_matcher().matched_keywords(conversation_text)
         
         report_items = []
         covered_count = 0
         partial_count = 0
         
-        for item in checklist:
-            keywords = item.get('keywords', [])
-            matched_keywords = [kw for kw in keywords if kw.lower() in conversation_text]
+        for index, item in enumerate(checklist):
+            matched_keywords = matched_by_item.get(index, [])
             
             if len(matched_keywords) >= 2:
                 report_items.append(f"- ✅ {item['point']}：學生透過提問「{matched_keywords[0]}」等成功問診")
@@ -144,30 +280,16 @@ class ReportService:
             else:
                 report_items.append(f"- ❌ {item['point']}：學生未詢問此項目")
         
-        # 分析關鍵行動
+        # 分析關鍵行動（單次掃描比對各類行動的關鍵字）
+        registry = get_keyword_registry()
+        matched_action_types = registry.critical_action_matcher.match(conversation_text)
         critical_analysis = []
         for action in critical_actions:
             # 針對不同的關鍵行動使用不同的關鍵字匹配
-            if "ECG" in action or "心電圖" in action:
-                # ECG相關行動的關鍵字
-                ecg_keywords = ["心電圖", "ECG", "12導程", "12導", "立刻", "馬上", "立即", "10分", "十分"]
-                if any(keyword in conversation_text for keyword in ecg_keywords):
-                    critical_analysis.append(f"- ✅ 關鍵決策：學生提及了「{action}」")
-                else:
-                    critical_analysis.append(f"- ❌ 關鍵決策：學生未提及「{action}」")
-            elif "Troponin" in action or "心肌鈣蛋白" in action:
-                # Troponin相關行動的關鍵字
-                troponin_keywords = ["troponin", "心肌鈣蛋白", "心肌酵素", "抽血", "檢驗", "血液"]
-                if any(keyword in conversation_text for keyword in troponin_keywords):
-                    critical_analysis.append(f"- ✅ 關鍵決策：學生提及了「{action}」")
-                else:
-                    critical_analysis.append(f"- ❌ 關鍵決策：學生未提及「{action}」")
+            if registry.critical_action_type(action) in matched_action_types:
+                critical_analysis.append(f"- ✅ 關鍵決策：學生提及了「{action}」")
             else:
-                # 其他關鍵行動的通用匹配
-                if any(keyword in conversation_text for keyword in ["心電圖", "ECG", "12導程", "立刻", "馬上", "10分"]):
-                    critical_analysis.append(f"- ✅ 關鍵決策：學生提及了「{action}」")
-                else:
-                    critical_analysis.append(f"- ❌ 關鍵決策：學生未提及「{action}」")
+                critical_analysis.append(f"- ❌ 關鍵決策：學生未提及「{action}」")
         
         coverage_percentage = conversation.coverage
         
@@ -202,13 +324,41 @@ class ReportService:
 
 *註：此為即時分析報告，詳細報告請點擊「生成完整報告」按鈕。*"""
     
-    def _generate_detailed_analysis_with_llm(self, conversation: Conversation, case: Case, citations: List[Citation]) -> str:
-        """使用 LLM 生成詳細分析報告"""
-        # 構建 RAG 上下文
-        rag_context = "\n\n".join([
+    def _generate_detailed_analysis_with_llm(self, conversation: Conversation, case: Case, citations: List[Citation],
+                                             basic_analysis: Optional[str] = None,
+                                             messages: Optional[List[Any]] = None) -> str:
+        """使用 LLM 生成詳細分析報告
+        
+        Args:
+            basic_analysis: 已生成的基本分析，LLM 失敗時的備用報告直接使用，不重新計算
+            messages: 已構建的提示詞訊息，None 時重新構建
+        """
+        if messages is None:
+            messages = self._build_detailed_prompt_messages(conversation, case, citations)
+        
+        try:
+            # 使用 AI 服務生成報告
+            return self._finalize_llm_report(self.ai_service.chat(messages), citations)
+            
+        except Exception as e:
+            # 備用方案：使用基本分析 + RAG 內容
+            if basic_analysis is None:
+                basic_analysis = self._generate_basic_analysis(conversation, case)
+            return self._build_fallback_report(basic_analysis, citations)
+    
+    @staticmethod
+    def _build_rag_context(citations: List[Citation]) -> str:
+        """構建提示詞與備用報告中的 RAG 上下文"""
+        return "\n\n".join([
             f"### 關於 {citation.query} [引註 {citation.id}]\n{citation.content}"
             for citation in citations
         ]) if citations else "未找到相關臨床指引"
+    
+    def _build_detailed_prompt_messages(self, conversation: Conversation, case: Case,
+                                        citations: List[Citation]) -> List[Any]:
+        """構建詳細報告的 LLM 提示詞訊息"""
+        # 構建 RAG 上下文
+        rag_context = self._build_rag_context(citations)
         
         # 構建詳細提示詞
         detailed_prompt = f"""
@@ -265,22 +415,17 @@ class ReportService:
         
         # 構建訊息
         from ..models.conversation import Message
-        messages = [Message(role=MessageRole.SYSTEM, content=detailed_prompt)]
-        
-        try:
-            # 使用 AI 服務生成報告
-            report_content = self.ai_service.chat(messages)
-            
-            # 如果 AI 沒有生成引註標記，手動添加
-            if not re.search(r'\[引註 \d+\]', report_content) and citations:
-                report_content += self._append_citation_suggestions(citations)
-            
-            return report_content
-            
-        except Exception as e:
-            # 備用方案：使用基本分析 + RAG 內容
-            basic_analysis = self._generate_basic_analysis(conversation, case)
-            return f"""
+        return [Message(role=MessageRole.SYSTEM, content=detailed_prompt)]
+    
+    def _finalize_llm_report(self, report_content: str, citations: List[Citation]) -> str:
+        """整理 LLM 產生的報告：如果 AI 沒有生成引註標記，手動添加"""
+        if not re.search(r'\[引註 \d+\]', report_content) and citations:
+            report_content += self._append_citation_suggestions(citations)
+        return report_content
+    
+    def _build_fallback_report(self, basic_analysis: str, citations: List[Citation]) -> str:
+        """備用方案：使用基本分析 + RAG 內容"""
+        return f"""
 # 詳細診後分析報告
 
 {basic_analysis}
@@ -289,7 +434,7 @@ class ReportService:
 
 ## RAG 提供的臨床指引
 
-{rag_context}
+{self._build_rag_context(citations)}
 
 ---
 
@@ -317,58 +462,23 @@ class ReportService:
     
     def _generate_queries_from_feedback(self, feedback_content: str) -> List[str]:
         """基於AI回饋內容生成相關的RAG查詢"""
-        queries = []
-        content_lower = feedback_content.lower()
+        registry = get_keyword_registry()
         
-        # 根據回饋內容中的關鍵詞生成查詢
-        if any(keyword in content_lower for keyword in ["問診", "病史", "osce", "覆蓋率"]):
-            queries.append("OSCE 問診技巧和病史詢問指南")
-            
-        if any(keyword in content_lower for keyword in ["ecg", "心電圖", "12導程", "關鍵決策"]):
-            queries.append("ECG 心電圖在胸痛評估中的重要性")
-            
-        if any(keyword in content_lower for keyword in ["鑑別", "診斷", "檢查", "stemi"]):
-            queries.append("STEMI 和不穩定型心絞痛的診斷標準")
-            queries.append("急性胸痛的鑑別診斷和檢查項目")
-            
-        if any(keyword in content_lower for keyword in ["opqrst", "疼痛", "性質", "位置", "放射"]):
-            queries.append("胸痛問診的 OPQRST 技巧和重點")
-            
-        if any(keyword in content_lower for keyword in ["系統性", "流程", "順序"]):
-            queries.append("急性胸痛診斷流程和檢查順序")
-            
-        if any(keyword in content_lower for keyword in ["改進", "建議", "練習"]):
-            queries.append("臨床診斷技巧和最佳實踐")
+        # 根據回饋內容中的關鍵詞生成查詢（單次掃描，依規則順序加入）
+        queries = registry.match_feedback_queries(feedback_content)
             
         # 如果沒有找到特定關鍵詞，使用通用查詢
         if not queries:
-            queries = [
-                "急性胸痛診斷流程和檢查順序",
-                "ECG 心電圖在胸痛評估中的重要性"
-            ]
+            queries = list(registry.default_feedback_queries)
             
         return queries[:3]  # 返回最多3個查詢
     
     def _search_multiple_queries(self, queries: List[str], k: int = 2) -> str:
-        """執行多個查詢並合併結果"""
-        all_results = []
-        
-        for i, query in enumerate(queries, 1):
-            try:
-                result = self.rag_service.search(query, k=k)
-                if result and "RAG 系統未初始化" not in result and "找不到相關資料" not in result:
-                    # 添加查詢標識
-                    formatted_result = f"📚 **{query}**\n\n{result}"
-                    all_results.append(formatted_result)
-            except Exception as e:
-                print(f"查詢失敗: {query} - {e}")
-                continue
-                
-        # 合併結果，避免重複
-        if all_results:
-            return "\n\n---\n\n".join(all_results[:2])  # 最多返回2個結果
-        else:
-            return ""
+        """執行多個查詢並合併結果（跨查詢去重，湊滿段落數後不再處理其餘查詢）"""
+        sections = self.rag_service.search_merged(queries, k=k, max_sections=REPORT_RAG_SECTIONS)
+        
+        # 添加查詢標識
+        return "\n\n---\n\n".join(f"📚 **{query}**\n\n{context}" for query, context in sections)
     
     def _save_report_to_file(self, report: Report) -> Optional[str]:
         """將報告儲存到本地 md 檔案"""
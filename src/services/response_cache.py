@@ -0,0 +1,100 @@
+"""
+標準化病人回應快取
+病人回應只取決於系統提示與對話歷史，相同案例、相同模型、相同歷史的請求可直接返回先前的回應
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from ..utils.text_processing import normalize_text
+from .ai_service import Message
+
+
+def normalize_message(text: str) -> str:
+    """正規化訊息內容（全半形統一、合併空白、英文小寫），讓「哪裡痛？」與「哪裡痛?」命中同一筆"""
+    return normalize_text(text).lower()
+
+
+class ResponseCache:
+    """病人回應的 LRU 快取，項目超過 TTL 後失效
+
+    快取鍵為 (案例 ID, 模型, 正規化後的完整訊息列表) 的雜湊。
+    variants > 1 時為抽樣模式：同一個鍵先由模型產生 variants 次回應，
+    收集滿之前一律視為未命中，之後隨機返回其中一個（重複的回應只保留一份）。
+    """
+
+    def __init__(self, max_size: int = 512, ttl: float = 3600.0, variants: int = 1):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(case_id: str, model: str, messages: List[Message]) -> str:
+        """產生快取鍵"""
+        payload = json.dumps(
+            [case_id, model, [(msg.role.value, normalize_message(msg.content)) for msg in messages]],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, entry: Dict[str, Any]) -> bool:
+        return self.ttl > 0 and time.monotonic() - entry["created_at"] > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """取得快取的回應，未命中（或抽樣模式下尚未收集滿）時返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry):
+                del self._entries[key]
+                entry = None
+            if entry is None or entry["samples"] < self.variants:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry["responses"])
+
+    def put(self, key: str, response: str) -> None:
+        """寫入模型產生的回應"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry):
+                entry = self._entries[key] = {"created_at": time.monotonic(), "responses": [], "samples": 0}
+            if entry["samples"] < self.variants:
+                entry["samples"] += 1
+                if response not in entry["responses"]:
+                    entry["responses"].append(response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """清除快取"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """快取統計"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "variants": self.variants
+            }
@@ -3,6 +3,7 @@
 """
 
 import os
+import hashlib
 from pathlib import Path
 from typing import List, Optional
 
@@ -28,6 +29,15 @@ def get_file_size(file_path: Path) -> Optional[int]:
         return None
 
 
+def hash_file(file_path: Path, block_size: int = 1 << 20) -> str:
+    """計算檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 def list_files_in_directory(directory_path: Path, extensions: List[str] = None) -> List[Path]:
     """列出目錄中的檔案"""
     if not directory_path.exists() or not directory_path.is_dir():
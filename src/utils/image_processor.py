@@ -4,30 +4,101 @@
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Sequence, Tuple
+import numpy as np
 from PIL import Image
-import pytesseract
-import easyocr
 from langchain.schema import Document
 
+from .file_utils import hash_file
+from .ocr_cache import OCRCache
+
+
+EASYOCR_LANGUAGES = ['ch_sim', 'en']  # 支援中文和英文
+TESSERACT_LANGUAGES = ['chi_sim', 'eng']
+MIN_CONFIDENCE = 0.5  # 只保留信心度較高的文字
+
+
+@lru_cache(maxsize=None)
+def _get_easyocr_reader(languages: tuple):
+    """取得 EasyOCR Reader（同一行程內共用，避免每次建立 ImageProcessor 都重新載入模型）"""
+    try:
+        import easyocr
+        reader = easyocr.Reader(list(languages), gpu=False)
+        print("✅ EasyOCR 初始化成功")
+        return reader
+    except Exception as e:
+        print(f"⚠️ EasyOCR 初始化失敗: {e}")
+        return None
+
+
+def plan_tiles(length: int, tile_size: int, overlap: int) -> List[Tuple[int, int, float, float]]:
+    """沿單一軸切片，返回 (start, end, own_start, own_end)
+
+    相鄰切片重疊 overlap 像素；重疊區以中線分界，框選中心落在 [own_start, own_end) 的片段才屬於該切片，
+    避免同一段文字在兩個切片中重複出現。
+    """
+    if tile_size <= 0 or length <= tile_size:
+        return [(0, length, 0.0, float(length))]
+
+    step = max(1, tile_size - overlap)
+    starts = list(range(0, length - tile_size, step)) + [length - tile_size]
+    spans = [(start, start + tile_size) for start in starts]
+
+    tiles = []
+    for i, (start, end) in enumerate(spans):
+        own_start = 0.0 if i == 0 else (spans[i - 1][1] + start) / 2
+        own_end = float(length) if i == len(spans) - 1 else (end + spans[i + 1][0]) / 2
+        tiles.append((start, end, own_start, own_end))
+    return tiles
+
+
+def ocr_result_text(result: Dict[str, Any]) -> str:
+    """由辨識結果組出文字（略過低信心度的片段）"""
+    return "\n".join(
+        detection["text"] for detection in result.get("detections", [])
+        if detection["confidence"] is None or detection["confidence"] > MIN_CONFIDENCE
+    )
+
 
 class ImageProcessor:
-    """圖片處理器"""
+    """圖片處理器
     
-    def __init__(self):
-        self.easyocr_reader = None
-        self._init_easyocr()
+    辨識結果以「圖片內容雜湊 + OCR 方法 + 語言組合」快取在磁碟上，
+    未變更的圖片只需計算一次檔案雜湊，不必重新執行 OCR；EasyOCR 模型只在快取未命中時才載入。
+    """
     
-    def _init_easyocr(self):
-        """初始化 EasyOCR"""
-        try:
-            # 支援中文和英文
-            self.easyocr_reader = easyocr.Reader(['ch_sim', 'en'], gpu=False)
-            print("✅ EasyOCR 初始化成功")
-        except Exception as e:
-            print(f"⚠️ EasyOCR 初始化失敗: {e}")
-            self.easyocr_reader = None
+    def __init__(self, languages: Optional[List[str]] = None, cache_dir: Optional[Path] = None,
+                 use_cache: Optional[bool] = None, max_side: Optional[int] = None,
+                 tile_size: Optional[int] = None, tile_overlap: Optional[int] = None):
+        """
+        Args:
+            languages: EasyOCR 語言組合
+            cache_dir: OCR 快取目錄（預設為設定中的 ocr_cache_dir）
+            use_cache: 是否使用 OCR 快取（預設依設定 ocr_cache_enabled）
+            max_side: 長邊超過此像素數的圖片先等比例縮小，0 表示不縮小
+            tile_size: 縮小後仍超過此像素數的圖片切片辨識，0 表示不切片
+            tile_overlap: 相鄰切片的重疊像素數
+        """
+        from ..config.settings import get_settings
+        settings = get_settings()
+        self.languages = list(languages or EASYOCR_LANGUAGES)
+        self.max_side = settings.ocr_max_side if max_side is None else max_side
+        self.tile_size = settings.ocr_tile_size if tile_size is None else tile_size
+        self.tile_overlap = settings.ocr_tile_overlap if tile_overlap is None else tile_overlap
+        use_cache = settings.ocr_cache_enabled if use_cache is None else use_cache
+        self.cache = OCRCache((cache_dir or settings.ocr_cache_dir) if use_cache else None)
+    
+    @property
+    def easyocr_reader(self):
+        """EasyOCR Reader（延遲初始化）"""
+        return _get_easyocr_reader(tuple(self.languages))
+    
+    def _languages_for(self, method: str) -> List[str]:
+        """OCR 方法使用的語言組合"""
+        return TESSERACT_LANGUAGES if method == "tesseract" else self.languages
     
     def extract_text_from_image(self, image_path: Path, method: str = "easyocr") -> str:
         """從圖片中提取文字
@@ -39,46 +110,173 @@ class ImageProcessor:
         Returns:
             提取的文字內容
         """
+        result = self.recognize(image_path, method)
+        return ocr_result_text(result) if result else ""
+    
+    def recognize(self, image_path: Path, method: str = "easyocr") -> Optional[Dict[str, Any]]:
+        """辨識圖片，返回包含文字、框選座標與信心度的結果（優先使用快取）
+        
+        Returns:
+            {"method", "languages", "detections": [{"box", "text", "confidence"}]}，失敗時返回 None
+        """
+        if method not in ("easyocr", "tesseract"):
+            print(f"⚠️ 不支援的方法: {method}")
+            return None
+        
         try:
-            if method == "easyocr" and self.easyocr_reader:
-                return self._extract_with_easyocr(image_path)
-            elif method == "tesseract":
-                return self._extract_with_tesseract(image_path)
-            else:
-                print(f"⚠️ 不支援的方法: {method}")
-                return ""
+            cache_key = self._cache_key(image_path, method)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+            return self._recognize_uncached(image_path, method, cache_key)
         except Exception as e:
             print(f"❌ 圖片文字提取失敗 {image_path}: {e}")
-            return ""
+            return None
+    
+    def _cache_key(self, image_path: Path, method: str) -> str:
+        """圖片的快取鍵（EasyOCR 的縮圖與切片參數會影響結果，一併納入）"""
+        options = f"max{self.max_side}:tile{self.tile_size}x{self.tile_overlap}" if method == "easyocr" else ""
+        return OCRCache.make_key(hash_file(image_path), method, self._languages_for(method), options)
+    
+    def _recognize_uncached(self, image_path: Path, method: str, cache_key: str) -> Optional[Dict[str, Any]]:
+        """執行 OCR 並寫入快取"""
+        if method == "easyocr":
+            if not self.easyocr_reader:
+                print(f"⚠️ 不支援的方法: {method}")
+                return None
+            detections = self._detect_with_easyocr(image_path)
+        else:
+            detections = self._detect_with_tesseract(image_path)
+        
+        result = {"method": method, "languages": self._languages_for(method), "detections": detections}
+        self.cache.put(cache_key, result)
+        return result
+    
+    def recognize_batch(self, image_paths: Sequence[Path], method: str = "easyocr",
+                        workers: Optional[int] = None) -> List[Optional[Dict[str, Any]]]:
+        """批次辨識圖片，結果順序與 image_paths 對應
+        
+        先在目前行程查詢快取，只有未命中的圖片才分散到行程池；每個工作行程只初始化一個 Reader。
+        
+        Args:
+            image_paths: 圖片路徑
+            method: 文字提取方法
+            workers: 工作行程數，預設依設定 ocr_workers（0 表示 CPU 核心數）；1 表示在目前行程執行
+        """
+        if method not in ("easyocr", "tesseract"):
+            print(f"⚠️ 不支援的方法: {method}")
+            return [None] * len(image_paths)
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(image_paths)
+        pending = []
+        for position, image_path in enumerate(image_paths):
+            try:
+                cache_key = self._cache_key(Path(image_path), method)
+            except Exception as e:
+                print(f"❌ 圖片文字提取失敗 {image_path}: {e}")
+                continue
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                results[position] = cached
+            else:
+                pending.append((position, str(image_path), cache_key))
+        
+        if not pending:
+            return results
+        
+        from ..config.settings import get_settings
+        workers = workers or get_settings().ocr_workers or os.cpu_count() or 1
+        workers = min(workers, len(pending))
+        
+        if workers <= 1:
+            for position, image_path, cache_key in pending:
+                results[position] = self._recognize_pending(Path(image_path), method, cache_key)
+            return results
+        
+        worker_config = (self.languages, self.cache.cache_dir, self.max_side, self.tile_size,
+                         self.tile_overlap, method, workers)
+        # 依序分片，每個工作行程處理連續的一段，減少行程間傳遞次數
+        chunksize = max(1, len(pending) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker, initargs=worker_config) as executor:
+            outputs = executor.map(_ocr_worker_task, [(image_path, method, cache_key) for _, image_path, cache_key in pending],
+                                   chunksize=chunksize)
+            for (position, _, _), result in zip(pending, outputs):
+                results[position] = result
+        return results
+    
+    def extract_text_batch(self, image_paths: Sequence[Path], method: str = "easyocr",
+                           workers: Optional[int] = None) -> List[str]:
+        """批次提取文字，結果順序與 image_paths 對應（失敗的圖片為空字串）"""
+        return [
+            ocr_result_text(result) if result else ""
+            for result in self.recognize_batch(image_paths, method, workers)
+        ]
     
-    def _extract_with_easyocr(self, image_path: Path) -> str:
-        """使用 EasyOCR 提取文字"""
+    def _recognize_pending(self, image_path: Path, method: str, cache_key: str) -> Optional[Dict[str, Any]]:
+        """辨識快取未命中的圖片（錯誤時返回 None）"""
         try:
-            results = self.easyocr_reader.readtext(str(image_path))
-            text_parts = []
+            return self._recognize_uncached(image_path, method, cache_key)
+        except Exception as e:
+            print(f"❌ 圖片文字提取失敗 {image_path}: {e}")
+            return None
+    
+    def _detect_with_easyocr(self, image_path: Path) -> List[Dict[str, Any]]:
+        """使用 EasyOCR 辨識，保留所有片段的框選座標與信心度
+        
+        超大掃描檔先縮小到 max_side，仍超過 tile_size 時切片辨識；框選座標一律換算回原圖座標。
+        """
+        with Image.open(image_path) as image:
+            width, height = image.size
+            scale = 1.0
+            if self.max_side and max(width, height) > self.max_side:
+                scale = self.max_side / max(width, height)
+            needs_tiling = self.tile_size and max(width, height) * scale > self.tile_size
             
-            for (bbox, text, confidence) in results:
-                if confidence > 0.5:  # 只保留信心度較高的文字
-                    text_parts.append(text)
+            if scale == 1.0 and not needs_tiling:
+                return self._readtext(str(image_path), 0, 0, 1.0)
             
-            return "\n".join(text_parts)
-        except Exception as e:
-            print(f"EasyOCR 提取失敗: {e}")
-            return ""
+            # 轉為灰階陣列交給 EasyOCR（其內部同樣以灰階進行辨識）
+            image = image.convert("L")
+            if scale != 1.0:
+                image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+            pixels = np.asarray(image)
+        
+        scaled_height, scaled_width = pixels.shape
+        detections = []
+        for top, bottom, own_top, own_bottom in plan_tiles(scaled_height, self.tile_size, self.tile_overlap):
+            for left, right, own_left, own_right in plan_tiles(scaled_width, self.tile_size, self.tile_overlap):
+                for detection in self._readtext(pixels[top:bottom, left:right], left, top, scale):
+                    center_x = sum(x for x, _ in detection["box"]) / 4 * scale
+                    center_y = sum(y for _, y in detection["box"]) / 4 * scale
+                    if own_left <= center_x < own_right and own_top <= center_y < own_bottom:
+                        detections.append(detection)
+        
+        if needs_tiling:
+            # 切片結果依由上而下、由左而右排列
+            detections.sort(key=lambda d: (min(y for _, y in d["box"]), min(x for x, _ in d["box"])))
+        return detections
     
-    def _extract_with_tesseract(self, image_path: Path) -> str:
-        """使用 Tesseract 提取文字"""
-        try:
-            # 設定 Tesseract 支援中文
-            custom_config = r'--oem 3 --psm 6 -l chi_sim+eng'
-            text = pytesseract.image_to_string(
-                Image.open(image_path), 
-                config=custom_config
-            )
-            return text.strip()
-        except Exception as e:
-            print(f"Tesseract 提取失敗: {e}")
-            return ""
+    def _readtext(self, image: Any, offset_x: int, offset_y: int, scale: float) -> List[Dict[str, Any]]:
+        """執行 EasyOCR，並將框選座標由（縮小後的切片）換算為原圖座標"""
+        return [
+            {
+                "box": [[(float(x) + offset_x) / scale, (float(y) + offset_y) / scale] for x, y in bbox],
+                "text": text,
+                "confidence": float(confidence)
+            }
+            for (bbox, text, confidence) in self.easyocr_reader.readtext(image)
+        ]
+    
+    def _detect_with_tesseract(self, image_path: Path) -> List[Dict[str, Any]]:
+        """使用 Tesseract 辨識（只有整頁文字，沒有框選座標與信心度）"""
+        import pytesseract
+        # 設定 Tesseract 支援中文
+        custom_config = rf'--oem 3 --psm 6 -l {"+".join(TESSERACT_LANGUAGES)}'
+        text = pytesseract.image_to_string(
+            Image.open(image_path), 
+            config=custom_config
+        )
+        return [{"box": None, "text": text.strip(), "confidence": None}]
     
     def process_image_to_document(self, image_path: Path, method: str = "easyocr") -> Optional[Document]:
         """將圖片轉換為 LangChain Document 物件
@@ -93,40 +291,72 @@ class ImageProcessor:
         try:
             # 提取文字
             text_content = self.extract_text_from_image(image_path, method)
-            
-            if not text_content.strip():
-                print(f"⚠️ 無法從圖片中提取文字: {image_path}")
-                return None
-            
-            # 建立 Document 物件
-            metadata = {
-                "source": str(image_path),
-                "file_type": "image",
-                "extraction_method": method,
-                "file_name": image_path.name,
-                "file_size": image_path.stat().st_size if image_path.exists() else 0
-            }
-            
-            return Document(
-                page_content=text_content,
-                metadata=metadata
-            )
-            
+            return self.build_document(image_path, text_content, method)
         except Exception as e:
             print(f"❌ 圖片處理失敗 {image_path}: {e}")
             return None
     
+    def build_document(self, image_path: Path, text_content: str, method: str = "easyocr") -> Optional[Document]:
+        """以提取的文字建立 Document 物件，沒有文字時返回 None"""
+        if not text_content.strip():
+            print(f"⚠️ 無法從圖片中提取文字: {image_path}")
+            return None
+        
+        # 建立 Document 物件
+        metadata = {
+            "source": str(image_path),
+            "file_type": "image",
+            "extraction_method": method,
+            "file_name": image_path.name,
+            "file_size": image_path.stat().st_size if image_path.exists() else 0
+        }
+        
+        return Document(
+            page_content=text_content,
+            metadata=metadata
+        )
+    
     def get_supported_formats(self) -> List[str]:
         """取得支援的圖片格式"""
         return ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif']
 
 
-def process_images_in_directory(directory_path: Path, method: str = "easyocr") -> List[Document]:
+# 工作行程內的圖片處理器（由 _init_ocr_worker 建立，每個行程一個 Reader）
+_worker_processor: Optional[ImageProcessor] = None
+
+
+def _init_ocr_worker(languages: List[str], cache_dir: Optional[Path], max_side: int, tile_size: int,
+                     tile_overlap: int, method: str, workers: int) -> None:
+    """初始化 OCR 工作行程"""
+    global _worker_processor
+    # 平分 CPU 核心給各工作行程，避免 torch 執行緒互相搶占
+    try:
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    except ImportError:
+        pass
+    _worker_processor = ImageProcessor(
+        languages=languages, cache_dir=cache_dir, use_cache=cache_dir is not None,
+        max_side=max_side, tile_size=tile_size, tile_overlap=tile_overlap
+    )
+    if method == "easyocr":
+        _worker_processor.easyocr_reader
+
+
+def _ocr_worker_task(task: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+    """在工作行程中辨識單張圖片"""
+    image_path, method, cache_key = task
+    return _worker_processor._recognize_pending(Path(image_path), method, cache_key)
+
+
+def process_images_in_directory(directory_path: Path, method: str = "easyocr",
+                                workers: Optional[int] = None) -> List[Document]:
     """處理目錄中的所有圖片檔案
     
     Args:
         directory_path: 目錄路徑
         method: 文字提取方法
+        workers: OCR 工作行程數（預設依設定 ocr_workers）
     
     Returns:
         Document 物件列表
@@ -137,16 +367,19 @@ def process_images_in_directory(directory_path: Path, method: str = "easyocr") -
     
     print(f"🔍 正在掃描目錄: {directory_path}")
     
-    for file_path in directory_path.rglob("*"):
-        if file_path.is_file() and file_path.suffix.lower() in supported_formats:
-            print(f"📷 正在處理圖片: {file_path.name}")
-            
-            doc = processor.process_image_to_document(file_path, method)
-            if doc:
-                documents.append(doc)
-                print(f"✅ 成功提取文字: {len(doc.page_content)} 字元")
-            else:
-                print(f"❌ 處理失敗: {file_path.name}")
+    image_paths = sorted(
+        file_path for file_path in directory_path.rglob("*")
+        if file_path.is_file() and file_path.suffix.lower() in supported_formats
+    )
+    print(f"📷 正在處理 {len(image_paths)} 張圖片")
+    
+    for file_path, text_content in zip(image_paths, processor.extract_text_batch(image_paths, method, workers)):
+        doc = processor.build_document(file_path, text_content, method)
+        if doc:
+            documents.append(doc)
+            print(f"✅ 成功提取文字 {file_path.name}: {len(doc.page_content)} 字元")
+        else:
+            print(f"❌ 處理失敗: {file_path.name}")
     
-    print(f"📊 圖片處理完成，共處理 {len(documents)} 個檔案")
+    print(f"📊 圖片處理完成，共處理 {len(documents)} 個檔案（OCR 快取命中 {processor.cache.hits} 張）")
     return documents
@@ -0,0 +1,113 @@
+"""
+多關鍵字比對器
+將多組關鍵字預先整理成一個比對器，一次呼叫即可找出所有命中的關鍵字與群組，
+取代逐一 `any(keyword in text ...)` 的巢狀掃描
+"""
+
+import re
+from typing import Dict, Hashable, Iterable, List, Mapping, Optional, Set, Tuple
+
+
+# 關鍵字數量達到此值時改用 trie 正規表示式單次掃描；
+# 數量較少時 CPython 的 C 層子字串搜尋逐一比對反而較快（約 200 個關鍵字為交叉點）
+REGEX_MIN_KEYWORDS = 200
+
+
+def _build_trie(words: Iterable[str]) -> Dict[str, dict]:
+    """建立字元 trie，空字串鍵標記單字結尾"""
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return trie
+
+
+def _trie_to_pattern(node: Dict[str, dict]) -> str:
+    """將 trie 轉成正規表示式
+
+    共用前綴只比對一次，且以貪婪的可選群組讓同一位置優先比對到最長的關鍵字，
+    每個位置的比對成本與關鍵字長度相關，而非關鍵字數量。
+    """
+    is_terminal = "" in node
+    branches = [re.escape(char) + _trie_to_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if is_terminal:
+        return body + "?" if len(branches) == 1 and len(body) == 1 else "(?:" + body + ")?"
+    return body
+
+
+class KeywordMatcher:
+    """以群組為單位的多關鍵字比對器（不分大小寫，語意等同逐一檢查 `keyword in text`）
+
+    Args:
+        groups: 群組 ID -> 關鍵字列表；同一關鍵字可屬於多個群組
+        use_regex: 是否使用 trie 正規表示式，None 表示依關鍵字數量決定
+    """
+
+    def __init__(self, groups: Mapping[Hashable, Iterable[str]], use_regex: Optional[bool] = None):
+        self.groups: Dict[Hashable, List[str]] = {group_id: list(keywords) for group_id, keywords in groups.items()}
+
+        keyword_groups: Dict[str, List[Hashable]] = {}
+        for group_id, keywords in self.groups.items():
+            for keyword in keywords:
+                normalized = keyword.lower()
+                if normalized and group_id not in keyword_groups.setdefault(normalized, []):
+                    keyword_groups[normalized].append(group_id)
+        self._keyword_groups = keyword_groups
+
+        keywords = sorted(keyword_groups)
+        self._keywords: Tuple[str, ...] = tuple(keywords)
+        if use_regex is None:
+            use_regex = len(keywords) >= REGEX_MIN_KEYWORDS
+
+        self._pattern: Optional["re.Pattern"] = None
+        if use_regex and keywords:
+            # 每個位置只會回報最長的關鍵字，較短的前綴關鍵字由此表補齊
+            self._prefixes: Dict[str, Tuple[str, ...]] = {
+                keyword: tuple(other for other in keywords if keyword.startswith(other))
+                for keyword in keywords
+            }
+            self._pattern = re.compile("(?=(" + _trie_to_pattern(_build_trie(keywords)) + "))")
+
+    def find_keywords(self, text: str) -> Set[str]:
+        """找出文字中出現的所有關鍵字（小寫）"""
+        text_lower = text.lower()
+        if self._pattern is None:
+            return {keyword for keyword in self._keywords if keyword in text_lower}
+        found: Set[str] = set()
+        for match in self._pattern.finditer(text_lower):
+            longest = match.group(1)
+            if longest not in found:
+                found.update(self._prefixes[longest])
+        return found
+
+    def match(self, text: str) -> Set[Hashable]:
+        """找出有任一關鍵字出現的群組 ID"""
+        return {group_id for keyword in self.find_keywords(text) for group_id in self._keyword_groups[keyword]}
+
+    def matched_keywords(self, text: str) -> Dict[Hashable, List[str]]:
+        """各群組命中的關鍵字（保留原始寫法與群組內順序），未命中的群組不列出"""
+        found = self.find_keywords(text)
+        result = {}
+        for group_id, keywords in self.groups.items():
+            matched = [keyword for keyword in keywords if keyword.lower() in found]
+            if matched:
+                result[group_id] = matched
+        return result
+
+    def first_occurrence(self, text: str) -> Optional[Tuple[int, str]]:
+        """最早出現的關鍵字位置與該位置最長的關鍵字（小寫），找不到時返回 None"""
+        text_lower = text.lower()
+        if self._pattern is None:
+            positions = [(text_lower.find(keyword), -len(keyword), keyword) for keyword in self._keywords]
+            found = [position for position in positions if position[0] >= 0]
+            if not found:
+                return None
+            position, _, keyword = min(found)
+            return position, keyword
+        match = self._pattern.search(text_lower)
+        return (match.start(), match.group(1)) if match else None
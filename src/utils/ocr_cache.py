@@ -0,0 +1,75 @@
+"""
+OCR 結果快取
+以圖片內容雜湊、OCR 方法與語言組合為鍵，將辨識結果（文字、框選座標、信心度）持久化到磁碟
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+# 快取格式版本，修改辨識結果的結構時需遞增
+OCR_CACHE_VERSION = 1
+
+
+class OCRCache:
+    """OCR 結果的磁碟快取
+
+    每筆結果存成獨立的 JSON 檔（以先寫暫存檔再替換的方式寫入），
+    建立索引時多個 OCR 工作行程可以安全地共用同一個快取目錄。
+    """
+
+    def __init__(self, cache_dir: Optional[Path]):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_hash: str, method: str, languages: List[str], options: str = "") -> str:
+        """產生快取鍵（options 為會影響辨識結果的前處理參數）"""
+        raw_key = f"v{OCR_CACHE_VERSION}:{image_hash}:{method}:{'+'.join(languages)}:{options}"
+        return hashlib.sha1(raw_key.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        """快取檔案路徑（以鍵的前兩碼分目錄，避免單一目錄檔案過多）"""
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """取得辨識結果，未命中時返回 None"""
+        if not self.cache_dir:
+            return None
+
+        path = self._entry_path(key)
+        if not path.exists():
+            self.misses += 1
+            return None
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except Exception as e:
+            print(f"⚠️ OCR 快取讀取失敗 {path.name}: {e}")
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]) -> bool:
+        """寫入辨識結果（result 必須可 JSON 序列化）"""
+        if not self.cache_dir:
+            return False
+
+        path = self._entry_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            return True
+        except Exception as e:
+            print(f"⚠️ OCR 快取寫入失敗 {path.name}: {e}")
+            return False
@@ -3,6 +3,7 @@
 """
 
 import re
+import unicodedata
 from typing import List, Dict, Any
 
 
@@ -42,6 +43,11 @@ def clean_text(text: str) -> str:
     return text
 
 
+def normalize_text(text: str) -> str:
+    """正規化文字（全半形統一、合併空白），作為查詢與訊息快取鍵的一部分"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
 def extract_citation_references(text: str) -> List[int]:
     """從文字中提取引註編號"""
     pattern = r'\[引註 (\d+)\]'
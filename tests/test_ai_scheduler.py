@@ -0,0 +1,106 @@
+"""
+AI 請求排程器測試
+以可控制完成時機的假 AI 服務驗證名額上限、優先順序與相同請求合併
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+# 添加src目錄到路徑
+project_root = Path(__file__).parent.parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path))
+
+from src.services.ai_scheduler import AIScheduler, RequestPriority
+from src.services.ai_service import AIService, Message, MessageRole
+
+
+class GatedAIService(AIService):
+    """每個請求都等待 release 才返回，記錄送達後端的順序"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def chat(self, messages, **kwargs):
+        with self.lock:
+            self.calls.append(messages[-1].content)
+        self.release.wait(5)
+        return f"回覆：{messages[-1].content}"
+
+    def chat_stream(self, messages, **kwargs):
+        with self.lock:
+            self.calls.append(messages[-1].content)
+        self.release.wait(5)
+        yield "回覆："
+        yield messages[-1].content
+
+    def is_available(self):
+        return True
+
+
+def ask(content):
+    return [Message(role=MessageRole.USER, content=content)]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "等待逾時"
+        time.sleep(0.005)
+
+
+def run_in_thread(target, results, key):
+    thread = threading.Thread(target=lambda: results.__setitem__(key, target()))
+    thread.start()
+    return thread
+
+
+def test_interactive_requests_jump_ahead_of_background():
+    """名額已滿時，排隊中的問診請求先於較早排隊的報告請求送出"""
+    backend = GatedAIService()
+    scheduler = AIScheduler(backend, max_parallel=1)
+    chat = scheduler.client(RequestPriority.INTERACTIVE)
+    report = scheduler.client(RequestPriority.BACKGROUND)
+
+    results = {}
+    threads = [run_in_thread(lambda: report.chat(ask("報告一")), results, "report1")]
+    wait_for(lambda: backend.calls == ["報告一"])
+
+    threads.append(run_in_thread(lambda: report.chat(ask("報告二")), results, "report2"))
+    wait_for(lambda: scheduler.get_metrics()["scheduler"]["waiting"]["background"] == 1)
+    threads.append(run_in_thread(lambda: "".join(chat.chat_stream(ask("問診"))), results, "chat"))
+    wait_for(lambda: scheduler.get_metrics()["scheduler"]["waiting"]["interactive"] == 1)
+
+    backend.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert backend.calls == ["報告一", "問診", "報告二"]
+    assert results == {"report1": "回覆：報告一", "report2": "回覆：報告二", "chat": "回覆：問診"}
+    metrics = scheduler.get_metrics()["scheduler"]
+    assert metrics["in_flight"] == 0 and metrics["dispatched"] == 3
+
+
+def test_identical_concurrent_requests_are_coalesced():
+    """同時送出的相同請求只送往後端一次，所有呼叫端取得同一結果"""
+    backend = GatedAIService()
+    scheduler = AIScheduler(backend, max_parallel=4)
+    chat = scheduler.client(RequestPriority.INTERACTIVE)
+
+    results = {}
+    threads = [run_in_thread(lambda: chat.chat(ask("哪裡痛？")), results, i) for i in range(5)]
+    wait_for(lambda: scheduler.get_metrics()["scheduler"]["coalesced"] == 4)
+    backend.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert backend.calls == ["哪裡痛？"]
+    assert list(results.values()) == ["回覆：哪裡痛？"] * 5
+
+    # 完成後再送出的相同請求不會沿用舊結果
+    assert chat.chat(ask("哪裡痛？")) == "回覆：哪裡痛？"
+    assert backend.calls == ["哪裡痛？", "哪裡痛？"]
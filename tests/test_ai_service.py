@@ -0,0 +1,125 @@
+"""
+Ollama AI 服務測試
+以假的客戶端取代 Ollama，驗證共用連線池服務的並行上限、佇列指標與串流介面，以及請求參數
+"""
+
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+# 添加src目錄到路徑
+project_root = Path(__file__).parent.parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path))
+
+pytest.importorskip("ollama")
+pytest.importorskip("httpx")
+
+from src.services.ai_service import PooledOllamaAIService, Message, MessageRole, OllamaAIService
+
+
+class FakeAsyncClient:
+    """模擬 ollama.AsyncClient，記錄同時進行中的請求數"""
+
+    def __init__(self, delay=0.02, parts=("醫生，", "我胸口痛。")):
+        self.delay = delay
+        self.parts = parts
+        self.active = 0
+        self.peak = 0
+        self.models = []
+
+    async def _enter(self, model):
+        self.models.append(model)
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(self.delay)
+
+    async def chat(self, model, messages, stream=False, **kwargs):
+        if stream:
+            return self._stream(model)
+        await self._enter(model)
+        self.active -= 1
+        return {"message": {"content": "".join(self.parts)}}
+
+    async def _stream(self, model):
+        await self._enter(model)
+        try:
+            for part in self.parts:
+                yield {"message": {"content": part}}
+        finally:
+            self.active -= 1
+
+    async def list(self):
+        return {"models": []}
+
+
+MESSAGES = [Message(role=MessageRole.USER, content="哪裡不舒服？")]
+
+
+@pytest.fixture
+def service():
+    service = PooledOllamaAIService(host="http://127.0.0.1:11434", model="llama3:8b", max_concurrency=2)
+    service._client = FakeAsyncClient()
+    return service
+
+
+def test_concurrent_chats_respect_model_semaphore(service):
+    """多個執行緒同時呼叫時，每個模型同時送出的請求不超過上限，超出者計入佇列"""
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(service.chat(MESSAGES))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert replies == ["醫生，我胸口痛。"] * 8
+    assert service._client.peak == 2
+
+    metrics = service.get_metrics()["models"]["llama3:8b"]
+    assert metrics["completed"] == 8 and metrics["in_flight"] == 0 and metrics["waiting"] == 0
+    assert metrics["max_waiting"] > 0 and metrics["max_wait_ms"] > 0
+
+
+def test_streaming_and_per_request_model(service):
+    """串流介面逐段返回，並可依請求指定模型，各模型分開計算指標"""
+    assert service.chat(MESSAGES, model="qwen2:7b") == "醫生，我胸口痛。"
+    assert list(service.chat_stream(MESSAGES)) == ["醫生，", "我胸口痛。"]
+    assert service.is_available()
+
+    models = service.get_metrics()["models"]
+    assert models["qwen2:7b"]["completed"] == 1
+    assert models["llama3:8b"]["completed"] == 1
+
+
+class RecordingClient:
+    """模擬 ollama.Client，記錄每次請求的參數"""
+
+    def __init__(self):
+        self.requests = []
+
+    def chat(self, model, messages, stream=False, **kwargs):
+        self.requests.append(kwargs)
+        if stream:
+            return iter([{"message": {"content": "好"}}])
+        return {"message": {"content": "好"}}
+
+
+def test_keep_alive_and_options_are_sent_with_every_request():
+    """服務預設的 keep_alive 與 options 隨每個請求送出，單次請求指定的值優先"""
+    service = OllamaAIService(
+        host="http://127.0.0.1:11434", model="llama3:8b", keep_alive="30m", options={"num_ctx": 8192}
+    )
+    service._client = RecordingClient()
+
+    service.chat(MESSAGES)
+    list(service.chat_stream(MESSAGES, options={"temperature": 0}))
+    service.chat(MESSAGES, keep_alive=0, options={"num_ctx": 4096})
+
+    assert service._client.requests == [
+        {"keep_alive": "30m", "options": {"num_ctx": 8192}},
+        {"keep_alive": "30m", "options": {"num_ctx": 8192, "temperature": 0}},
+        {"keep_alive": 0, "options": {"num_ctx": 4096}}
+    ]
@@ -0,0 +1,181 @@
+"""
+串流問診端點測試
+使用 Flask 測試客戶端與假的 AI 服務，不需要啟動後端或 Ollama
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# 添加src目錄到路徑
+project_root = Path(__file__).parent.parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path))
+
+pytest.importorskip("flask")
+
+from src.api import routes
+from src.config.settings import get_settings
+from src.services.ai_service import AIService
+from src.services.case_service import CaseService
+from src.services.conversation_service import ConversationService
+from src.services.report_service import ReportService
+
+
+class StreamingAIService(AIService):
+    """依序返回固定片段的 AI 服務，可在指定片段後拋出錯誤"""
+
+    def __init__(self, parts, fail_after=None):
+        self.parts = parts
+        self.fail_after = fail_after
+        self.produced = []
+        self.requests = []
+
+    def chat(self, messages, **kwargs):
+        return "".join(self.parts)
+
+    def chat_stream(self, messages, **kwargs):
+        self.requests.append(messages)
+        for i, part in enumerate(self.parts):
+            if self.fail_after is not None and i == self.fail_after:
+                raise RuntimeError("連線中斷")
+            self.produced.append(part)
+            yield part
+
+    def is_available(self):
+        return True
+
+
+@pytest.fixture
+def client_factory(monkeypatch):
+    """建立注入指定 AI 服務的測試客戶端"""
+
+    def create(ai_service, report_service=None):
+        settings = get_settings()
+        conversation_service = ConversationService(settings, CaseService(settings), ai_service)
+        dependencies = {
+            "case_service": CaseService(settings),
+            "conversation_service": conversation_service,
+            "report_service": report_service
+        }
+        monkeypatch.setattr(routes, "get_dependencies", lambda: dependencies)
+        return routes.create_app().test_client()
+
+    return create
+
+
+def read_events(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+
+
+def test_stream_emits_tokens_then_final_metrics(client_factory):
+    """每段文字即時送出，最後的 done 事件帶有完整回應、覆蓋率與生命體徵"""
+    ai_service = StreamingAIService(["醫生，", "我胸口", "很痛。"])
+    client = client_factory(ai_service)
+
+    response = client.post("/ask_patient_stream", json={
+        "history": [{"role": "user", "content": "請問胸痛什麼時候開始？我先幫你測量生命徵象。"}],
+        "case_id": "case_chest_pain_acs_01"
+    }, buffered=False)
+    assert response.mimetype == "application/x-ndjson"
+
+    # 第一個事件送出時，模型尚未產生後續片段
+    stream = iter(response.response)
+    first = json.loads(next(stream))
+    assert first == {"type": "token", "content": "醫生，"}
+    assert ai_service.produced == ["醫生，"]
+
+    rest = [json.loads(line) for chunk in stream for line in chunk.decode("utf-8").splitlines() if line]
+    assert [event["content"] for event in rest[:-1]] == ["我胸口", "很痛。"]
+    done = rest[-1]
+    assert done["type"] == "done"
+    assert done["reply"] == "醫生，我胸口很痛。"
+    assert done["coverage"] > 0
+    assert done["vital_signs"]
+
+
+def test_stream_reports_errors_as_events(client_factory):
+    """生成中途失敗時以 error 事件結束；請求無效時直接返回 400"""
+    client = client_factory(StreamingAIService(["醫生，", "我"], fail_after=1))
+
+    events = read_events(client.post("/ask_patient_stream", json={
+        "history": [{"role": "user", "content": "哪裡不舒服？"}],
+        "case_id": "case_chest_pain_acs_01"
+    }))
+    assert events[0] == {"type": "token", "content": "醫生，"}
+    assert events[-1]["type"] == "error" and "連線中斷" in events[-1]["error"]
+
+    assert client.post("/ask_patient_stream", json={"history": []}).status_code == 400
+
+
+def test_stream_rebuilds_conversation_from_history(client_factory):
+    """每次請求都以完整的對話歷史重建對話送給模型，回應後不保留對話"""
+    ai_service = StreamingAIService(["大概一小時前。"])
+    client = client_factory(ai_service)
+    history = [
+        {"role": "user", "content": "哪裡不舒服？"},
+        {"role": "assistant", "content": "胸口很悶。"},
+        {"role": "user", "content": "什麼時候開始的？"}
+    ]
+
+    events = read_events(client.post("/ask_patient_stream", json={"history": history, "case_id": "case_chest_pain_acs_01"}))
+    assert events[-1]["type"] == "done"
+
+    sent = ai_service.requests[0]
+    assert [(msg.role.value, msg.content) for msg in sent[1:]] == [(m["role"], m["content"]) for m in history]
+    assert routes.get_dependencies()["conversation_service"]._conversations == {}
+
+
+class UnavailableRAGService:
+    """索引不可用的 RAG 服務替身"""
+
+    def register_precompute_queries(self, queries, k):
+        pass
+
+    def wait_until_ready(self, timeout=None):
+        return False
+
+    def is_available(self):
+        return False
+
+
+def test_detailed_report_stream_pushes_stage_events(client_factory, tmp_path):
+    """詳細報告串流依序送出查詢、引註、LLM 片段，最後的 done 事件與非串流端點欄位相同"""
+    ai_service = StreamingAIService(["## 問診表現評估\n", "表現良好。"])
+    settings = get_settings().model_copy(update={"report_history_dir": tmp_path})
+    report_service = ReportService(settings, CaseService(settings), ai_service, UnavailableRAGService())
+    client = client_factory(ai_service, report_service)
+
+    events = read_events(client.post("/get_detailed_report_stream", json={
+        "full_conversation": [
+            {"role": "user", "content": "請問胸痛什麼時候開始？"},
+            {"role": "assistant", "content": "大概一小時前。"}
+        ],
+        "case_id": "case_chest_pain_acs_01"
+    }))
+
+    assert [event.get("stage", event["type"]) for event in events] == [
+        "queries", "citations", "llm", "token", "token", "done"
+    ]
+    assert events[0]["rag_queries"]
+    done = events[-1]
+    assert done["report_text"] == "## 問診表現評估\n表現良好。"
+    assert done["filename"] and done["citations"] == []
+    assert set(done) >= {"report_text", "citations", "rag_queries", "coverage", "metadata"}
+
+
+def test_detailed_report_stream_returns_404_for_unknown_case(client_factory, tmp_path):
+    """找不到案例時在開始串流前返回 404，與非串流端點一致"""
+    ai_service = StreamingAIService(["不應被呼叫"])
+    settings = get_settings().model_copy(update={"report_history_dir": tmp_path})
+    report_service = ReportService(settings, CaseService(settings), ai_service, UnavailableRAGService())
+    client = client_factory(ai_service, report_service)
+
+    payload = {"full_conversation": [{"role": "user", "content": "你好"}], "case_id": "case_does_not_exist"}
+    for endpoint in ("/get_detailed_report", "/get_detailed_report_stream"):
+        response = client.post(endpoint, json=payload)
+        assert response.status_code == 404
+        assert response.is_json and "error" in response.get_json()
+    assert ai_service.produced == []
@@ -0,0 +1,199 @@
+"""
+對話服務測試
+使用計數用的假 AI 服務，驗證系統提示詞、病人回應快取與上下文視窗
+"""
+
+import sys
+from pathlib import Path
+
+# 添加src目錄到路徑
+project_root = Path(__file__).parent.parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path))
+
+from src.config.settings import get_settings
+from src.models.conversation import MessageRole
+from src.services.ai_service import AIService
+from src.services.case_service import CaseService
+from src.services.context_window import SUMMARY_INSTRUCTIONS, estimate_message_tokens
+from src.services.conversation_service import ConversationService
+from src.services.response_cache import ResponseCache
+
+
+CASE_ID = "case_chest_pain_acs_01"
+
+
+class CountingAIService(AIService):
+    """每次呼叫返回不同編號回應的 AI 服務"""
+
+    model = "llama3:8b"
+
+    def __init__(self):
+        self.calls = 0
+        self.requests = []
+
+    def chat(self, messages, **kwargs):
+        self.calls += 1
+        self.requests.append(messages)
+        return f"回應 {self.calls}"
+
+    def chat_stream(self, messages, **kwargs):
+        yield from ("回應 ", str(self.calls + 1))
+        self.calls += 1
+
+    def is_available(self):
+        return True
+
+
+def build_service(ai_service, **overrides):
+    settings = get_settings().model_copy(update={"response_cache_enabled": True, **overrides})
+    return ConversationService(settings, CaseService(settings), ai_service)
+
+
+def ask(service, *contents):
+    """以新對話依序送出使用者訊息，返回最後一則回應"""
+    _, conversation_id = service.create_conversation(CASE_ID)
+    reply = None
+    for content in contents:
+        service.add_message(conversation_id, MessageRole.USER, content)
+        reply = service.generate_ai_response(conversation_id)
+        service.add_message(conversation_id, MessageRole.ASSISTANT, reply)
+    return reply
+
+
+def test_each_turn_resends_a_byte_identical_prefix():
+    """系統提示詞在案例上快取，每輪請求都以上一輪的完整訊息作為前綴"""
+    ai_service = CountingAIService()
+    service = build_service(ai_service, response_cache_enabled=False)
+    ask(service, "你好", "哪裡痛？", "痛多久了？")
+
+    first, second, third = ai_service.requests
+    assert first[0].role == MessageRole.SYSTEM
+    assert first[0].content is third[0].content
+    assert not first[0].content.startswith((" ", "\n"))
+    # 個案資料以 JSON 序列化，而非 Python dict 的 repr
+    assert "{'" not in first[0].content
+    assert second[:len(first)] == first and third[:len(second)] == second
+
+
+def test_identical_openings_skip_the_model():
+    """不同對話的相同開場（忽略全半形與空白差異）直接使用快取，仍會更新覆蓋率"""
+    ai_service = CountingAIService()
+    service = build_service(ai_service)
+
+    assert ask(service, "你好", "哪裡痛？") == "回應 2"
+    assert ask(service, "你好 ", "哪裡痛?") == "回應 2"
+    assert ai_service.calls == 2
+
+    # 串流與非串流共用快取
+    _, conversation_id = service.create_conversation(CASE_ID)
+    service.add_message(conversation_id, MessageRole.USER, "你好")
+    assert "".join(service.stream_ai_response(conversation_id)) == "回應 1"
+    assert service.get_conversation(conversation_id).coverage >= 0
+    assert ai_service.calls == 2
+
+    # 前三輪命中快取，超過快取輪數後一律呼叫模型
+    assert ask(service, "你好", "哪裡痛？", "痛多久了？", "有流汗嗎？") == "回應 4"
+    assert ask(service, "你好", "哪裡痛？", "痛多久了？", "有流汗嗎？") == "回應 5"
+    assert service.response_cache.stats()["hits"] == 8
+
+
+def test_sampling_mode_collects_variants_before_hitting():
+    """抽樣模式下每個鍵先收集指定數量的回應，之後從中隨機返回"""
+    ai_service = CountingAIService()
+    service = build_service(ai_service, response_cache_variants=3)
+
+    replies = [ask(service, "你好") for _ in range(3)]
+    assert replies == ["回應 1", "回應 2", "回應 3"]
+
+    assert {ask(service, "你好") for _ in range(20)} <= set(replies)
+    assert ai_service.calls == 3
+
+
+def test_response_cache_evicts_by_lru_and_ttl():
+    """超過容量時淘汰最久未使用的項目，超過 TTL 的項目視為未命中"""
+    cache = ResponseCache(max_size=2, ttl=3600)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert cache.get("b") is None and cache.get("a") == "A" and len(cache) == 2
+
+    expired = ResponseCache(ttl=1e-9)
+    expired.put("a", "A")
+    assert expired.get("a") is None
+
+
+class SummarizingAIService(CountingAIService):
+    """摘要請求返回涵蓋的訊息數，其餘返回編號回應"""
+
+    def __init__(self):
+        super().__init__()
+        self.summaries = 0
+
+    def chat(self, messages, **kwargs):
+        if messages[0].content == SUMMARY_INSTRUCTIONS:
+            self.summaries += 1
+            return f"摘要 {self.summaries}"
+        return super().chat(messages, **kwargs)
+
+
+def test_long_conversation_stays_within_token_budget():
+    """60 輪問診中，較早的對話摺疊成背景摘要，每輪 prompt 都不超過 token 預算"""
+    ai_service = SummarizingAIService()
+    service = build_service(
+        ai_service, response_cache_enabled=False, context_token_budget=2400, context_keep_turns=4
+    )
+    _, conversation_id = service.create_conversation(CASE_ID)
+
+    for turn in range(60):
+        service.add_message(conversation_id, MessageRole.USER, f"第 {turn} 個問題：胸口還會悶嗎？有沒有喘？")
+        service.add_message(conversation_id, MessageRole.ASSISTANT, service.generate_ai_response(conversation_id))
+        # 等待背景摘要完成，讓下一輪使用最新的摘要
+        service.context_manager._executor.submit(lambda: None).result()
+
+    prompts = ai_service.requests
+    assert len(prompts) == 60
+    assert max(estimate_message_tokens(prompt) for prompt in prompts) <= 2400
+
+    last = prompts[-1]
+    assert last[1].role == MessageRole.SYSTEM and last[1].content.startswith("【先前對話摘要】")
+    assert last[-1].content.startswith("第 59 個問題")
+    # 最近 4 輪以原文保留，摘要落後最多一個摺疊單位
+    assert 8 <= len(last) - 2 <= 8 + 4
+    # 摘要增量更新：每兩輪摺疊一次，而非每輪重算
+    assert ai_service.summaries <= 60 // 2
+
+
+def test_history_is_trimmed_to_budget_without_summaries():
+    """停用摘要時只依 token 預算捨棄最舊的訊息，最新一則一定保留"""
+    ai_service = CountingAIService()
+    service = build_service(
+        ai_service, response_cache_enabled=False, context_summary_enabled=False, context_token_budget=1
+    )
+    ask(service, "你好", "哪裡痛？", "痛多久了？")
+
+    assert [len(prompt) for prompt in ai_service.requests] == [2, 2, 2]
+    assert ai_service.requests[-1][-1].content == "痛多久了？"
+
+
+def test_budget_trimming_moves_window_start_only_at_block_boundaries():
+    """預算截斷以摺疊單位捨棄，連續兩輪之間大多只是附加新訊息，前綴快取可以沿用"""
+    ai_service = CountingAIService()
+    service = build_service(
+        ai_service, response_cache_enabled=False, context_summary_enabled=False, context_token_budget=1700
+    )
+    _, conversation_id = service.create_conversation(CASE_ID)
+    for turn in range(20):
+        service.add_message(conversation_id, MessageRole.USER, f"第 {turn} 個問題：胸口還會悶嗎？")
+        service.add_message(conversation_id, MessageRole.ASSISTANT, service.generate_ai_response(conversation_id))
+
+    prompts = ai_service.requests
+    assert max(estimate_message_tokens(prompt) for prompt in prompts) <= 1700
+    shifted = [
+        turn for turn in range(1, len(prompts))
+        if prompts[turn][:len(prompts[turn - 1])] != prompts[turn - 1]
+    ]
+    # 視窗起點每 4 則訊息（兩輪）才移動一次
+    assert shifted and len(shifted) <= len(prompts) // 2
+    assert all(prompts[turn][0] == prompts[0][0] for turn in shifted)
@@ -0,0 +1,120 @@
+"""
+圖片 OCR 處理測試
+以假的 EasyOCR Reader 取代真實模型，驗證辨識結果快取
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# 添加src目錄到路徑
+project_root = Path(__file__).parent.parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path))
+
+pytest.importorskip("PIL")
+
+from PIL import Image
+
+from src.utils import image_processor
+from src.utils.image_processor import ImageProcessor, plan_tiles
+
+
+def write_image(path, size=(40, 20), color=255):
+    """寫入一張單色測試圖片"""
+    Image.new("L", size, color=color).save(path)
+
+
+class FakeReader:
+    """記錄呼叫次數的假 EasyOCR Reader"""
+
+    def __init__(self):
+        self.calls = 0
+        self.inputs = []
+
+    def readtext(self, image):
+        self.calls += 1
+        self.inputs.append(image)
+        return [
+            ([[0, 0], [10, 0], [10, 5], [0, 5]], "胸痛病人", 0.91),
+            ([[0, 6], [10, 6], [10, 9], [0, 9]], "noise", 0.2),
+        ]
+
+
+@pytest.fixture
+def fake_reader(monkeypatch):
+    reader = FakeReader()
+    monkeypatch.setattr(image_processor, "_get_easyocr_reader", lambda languages: reader)
+    return reader
+
+
+def test_ocr_results_are_cached_by_content(tmp_path, fake_reader):
+    """相同內容的圖片只執行一次 OCR，內容改變後重新辨識"""
+    image_path = tmp_path / "case.jpg"
+    write_image(image_path, color=255)
+
+    processor = ImageProcessor(cache_dir=tmp_path / "ocr_cache")
+    assert processor.extract_text_from_image(image_path) == "胸痛病人"
+
+    result = ImageProcessor(cache_dir=tmp_path / "ocr_cache").recognize(image_path)
+    assert fake_reader.calls == 1
+    assert result["detections"][1] == {
+        "box": [[0.0, 6.0], [10.0, 6.0], [10.0, 9.0], [0.0, 9.0]], "text": "noise", "confidence": 0.2
+    }
+
+    write_image(image_path, color=0)
+    processor.extract_text_from_image(image_path)
+    assert fake_reader.calls == 2
+
+
+def test_ocr_cache_key_includes_languages(tmp_path, fake_reader):
+    """語言組合不同時不應共用快取"""
+    image_path = tmp_path / "case.jpg"
+    write_image(image_path)
+
+    ImageProcessor(cache_dir=tmp_path / "ocr_cache").extract_text_from_image(image_path)
+    ImageProcessor(languages=["en"], cache_dir=tmp_path / "ocr_cache").extract_text_from_image(image_path)
+    assert fake_reader.calls == 2
+
+
+def test_plan_tiles_splits_overlap_at_midpoint():
+    """切片應覆蓋整個長度，重疊區以中線分給相鄰切片"""
+    assert plan_tiles(800, 1000, 100) == [(0, 800, 0.0, 800.0)]
+
+    tiles = plan_tiles(2500, 1000, 100)
+    assert [(start, end) for start, end, _, _ in tiles] == [(0, 1000), (900, 1900), (1500, 2500)]
+    assert [(own_start, own_end) for _, _, own_start, own_end in tiles] == [
+        (0.0, 950.0), (950.0, 1700.0), (1700.0, 2500.0)
+    ]
+
+
+def test_large_scans_are_downscaled_and_tiled(tmp_path, fake_reader):
+    """超大圖片應先縮小再切片，框選座標換算回原圖且不重複"""
+    image_path = tmp_path / "scan.png"
+    write_image(image_path, size=(400, 200))
+
+    processor = ImageProcessor(use_cache=False, max_side=200, tile_size=60, tile_overlap=10)
+    result = processor.recognize(image_path)
+
+    assert all(tile.shape[0] <= 60 and tile.shape[1] <= 60 for tile in fake_reader.inputs)
+    assert fake_reader.calls == 8  # 縮小為 200x100，切成 4x2 片
+    # 假 Reader 在每個切片的左上角回報文字；落在與前一切片重疊區前半的片段屬於前一切片，應被略過
+    kept = [d for d in result["detections"] if d["text"] == "胸痛病人"]
+    assert kept[0]["box"][2] == [20.0, 10.0]  # 縮小比例 0.5 換算回原圖座標
+    assert [d["box"][0] for d in kept] == [[0.0, 0.0], [100.0, 0.0], [200.0, 0.0]]
+
+
+def test_extract_text_batch_keeps_order_and_uses_cache(tmp_path, fake_reader):
+    """批次 OCR 結果應與輸入順序對應，已快取的圖片不再辨識"""
+    paths = []
+    for i in range(3):
+        paths.append(tmp_path / f"case_{i}.png")
+        write_image(paths[-1], color=i * 50)
+
+    processor = ImageProcessor(cache_dir=tmp_path / "ocr_cache")
+    processor.extract_text_from_image(paths[1])
+    texts = processor.extract_text_batch(paths + [tmp_path / "missing.png"], workers=1)
+
+    assert texts == ["胸痛病人", "胸痛病人", "胸痛病人", ""]
+    assert fake_reader.calls == 3
@@ -0,0 +1,107 @@
+"""
+多關鍵字比對器測試
+驗證單次掃描的結果與逐一 `keyword in text` 檢查一致
+"""
+
+import json
+import sys
+from pathlib import Path
+
+# 添加src目錄到路徑
+project_root = Path(__file__).parent.parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path))
+
+from src.config.settings import get_settings
+from src.utils.keyword_matcher import KeywordMatcher
+from src.services.case_service import CaseService
+from src.services.conversation_service import ConversationService
+from src.services.rag_service import RAGService
+from src.models.conversation import Conversation, MessageRole
+
+
+def naive_matched_keywords(groups, text):
+    """逐一檢查的參考實作"""
+    text_lower = text.lower()
+    result = {}
+    for group_id, keywords in groups.items():
+        matched = [kw for kw in keywords if kw.lower() in text_lower]
+        if matched:
+            result[group_id] = matched
+    return result
+
+
+def test_overlapping_keywords_match_like_substring_checks():
+    """互為前綴或子字串的關鍵字都要被找到"""
+    groups = {
+        "ecg": ["心電圖", "ECG", "12導程", "12導", "心電"],
+        "pain": ["痛", "胸痛", "疼痛"],
+        "empty": [],
+    }
+    texts = ["請做12導程心電圖", "胸口疼痛，ecg 正常", "沒有相關內容", "", "12導"]
+    for use_regex in (False, True):
+        matcher = KeywordMatcher(groups, use_regex=use_regex)
+        for text in texts:
+            assert matcher.matched_keywords(text) == naive_matched_keywords(groups, text)
+
+        assert matcher.match("請做12導程心電圖") == {"ecg"}
+        assert matcher.find_keywords("ECG") == {"ecg"}
+
+
+def test_first_occurrence_returns_earliest_longest_keyword():
+    """first_occurrence 返回最早出現的位置與該位置最長的關鍵字"""
+    for use_regex in (False, True):
+        matcher = KeywordMatcher({"query": ["心電", "心電圖", "troponin"]}, use_regex=use_regex)
+        assert matcher.first_occurrence("抽血 Troponin 與心電圖") == (3, "troponin")
+        assert matcher.first_occurrence("安排心電圖") == (2, "心電圖")
+        assert matcher.first_occurrence("無") is None
+    assert KeywordMatcher({}).first_occurrence("任何文字") is None
+
+
+def test_coverage_uses_checklist_matcher():
+    """覆蓋率計算與逐一比對檢查清單關鍵字的結果一致"""
+    case = CaseService().get_case("case_chest_pain_acs_01")
+    checklist = case.get_feedback_checklist()
+    assert case.get_checklist_matcher() is case.get_checklist_matcher()
+
+    service = ConversationService(case_service=CaseService())
+    message = "請問您胸口哪裡痛？什麼時候開始的？是刺痛還是悶悶的？"
+    conversation = Conversation(case_id="case_chest_pain_acs_01")
+    conversation.add_message(MessageRole.USER, message)
+    service._calculate_coverage(conversation, case)
+
+    expected = naive_matched_keywords(
+        {item["id"]: item.get("keywords", []) for item in checklist if item.get("id")}, message
+    )
+    assert set(conversation.covered_items) == {item_id for item_id, kws in expected.items() if len(kws) >= 2}
+    assert set(conversation.partially_covered_items) == {item_id for item_id, kws in expected.items() if len(kws) == 1}
+
+
+def test_content_relevance_filters():
+    """相關性判斷：查詢詞、關鍵詞映射與不相關內容特徵"""
+    service = RAGService.__new__(RAGService)
+    assert service._is_content_relevant("建議在10分鐘內完成 12導程 心電圖", "ECG 判讀")
+    assert not service._is_content_relevant("案例2：特雷弗先生胸痛的練習題目與討論內容", "troponin")
+    assert not service._is_content_relevant("太短", "troponin")
+    assert service._is_content_relevant("這是一段足夠長而且沒有任何不相關特徵的一般臨床內容", "troponin")
+
+
+def test_keyword_registry_extends_without_code_changes(tmp_path):
+    """修改登錄表 JSON 即可擴充詞彙"""
+    from src.config.keyword_registry import KeywordRegistry, get_keyword_registry
+
+    registry = get_keyword_registry()
+    assert registry.critical_action_type("立即安排 12 導程 ECG") == "ecg"
+    assert registry.critical_action_type("抽血檢驗 Troponin") == "troponin"
+    assert registry.critical_action_type("給予阿斯匹靈") == "general"
+    assert "OSCE 問診技巧和病史詢問指南" in registry.feedback_query_vocabulary()
+
+    data = json.loads(get_settings().keyword_registry_path.read_text(encoding="utf-8"))
+    data["relevance_keyword_groups"]["主動脈剝離"] = ["aortic dissection", "主動脈"]
+    path = tmp_path / "keyword_registry.json"
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+    extended = KeywordRegistry.load(path)
+    content = "懷疑主動脈病變時應安排電腦斷層檢查"
+    assert "relevant" in extended.relevance_matcher("主動脈剝離").match(content)
+    assert "relevant" not in registry.relevance_matcher("主動脈剝離").match(content)
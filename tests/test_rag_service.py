@@ -0,0 +1,721 @@
+"""
+RAG 服務測試
+使用記憶體內的小型 FAISS 索引與假 embedding 模型，不需要下載 nomic 模型
+"""
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# 添加src目錄到路徑
+project_root = Path(__file__).parent.parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path))
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+
+from src.config.settings import Settings
+from src.services.rag_service import RAGService
+
+
+DIMENSION = 16
+
+DOCUMENTS = [
+    ("documents/Guideline/ECG_Guideline.pdf", 0, "急性胸痛病人應在10分鐘內完成12導程心電圖 ECG 檢查。心電圖可協助判斷 STEMI。"),
+    ("documents/Review/Troponin_Review.pdf", 2, "心肌鈣蛋白 troponin 是診斷心肌梗塞的重要檢驗。應在到院時抽血檢驗。"),
+    ("documents/Review/OSCE_History.pdf", 1, "OSCE 問診應遵循 OPQRST 結構詢問病史。包含 onset、quality、radiation。"),
+]
+
+
+class CountingEmbeddings:
+    """以字元雜湊產生向量的假 embedding 模型，並記錄呼叫次數"""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    @staticmethod
+    def _vector(text):
+        vector = np.zeros(DIMENSION, dtype=np.float32)
+        for char in text.lower():
+            vector[ord(char) % DIMENSION] += 1.0
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+
+class InMemoryDocstore:
+    """最小化的 docstore 替身"""
+
+    def __init__(self, docs):
+        self._docs = docs
+
+    def search(self, doc_id):
+        return self._docs[doc_id]
+
+
+def build_fake_vector_store(embeddings, metric="l2", documents=DOCUMENTS):
+    """建立與 langchain FAISS 相同介面的記憶體向量庫"""
+    docs = {}
+    index_to_docstore_id = {}
+    for position, (source, page, text) in enumerate(documents):
+        doc_id = f"doc-{position}"
+        docs[doc_id] = SimpleNamespace(page_content=text, metadata={"source": source, "page": page})
+        index_to_docstore_id[position] = doc_id
+
+    index = faiss.IndexFlatIP(DIMENSION) if metric == "ip" else faiss.IndexFlatL2(DIMENSION)
+    index.add(np.asarray(embeddings.embed_documents([text for _, _, text in documents]), dtype=np.float32))
+    embeddings.calls.clear()
+
+    return SimpleNamespace(
+        index=index,
+        docstore=InMemoryDocstore(docs),
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
+@pytest.fixture
+def rag_service(tmp_path):
+    """注入假向量庫的 RAG 服務"""
+    settings = Settings(faiss_index_dir=tmp_path / "missing_index")
+    service = RAGService(settings)
+    service.embeddings = CountingEmbeddings()
+    service.vector_store = build_fake_vector_store(service.embeddings)
+    return service
+
+
+def test_uninitialized_service_is_unavailable(tmp_path):
+    """索引不存在時服務應不可用且搜尋回傳提示"""
+    service = RAGService(Settings(faiss_index_dir=tmp_path / "missing_index"))
+    assert not service.is_available()
+    assert "未初始化" in service.search("ECG")
+    assert service.search_with_citations(["ECG"]) == []
+
+
+def test_search_with_citations_embeds_queries_in_one_batch(rag_service):
+    """多個查詢應只觸發一次 embedding 計算"""
+    queries = ["ECG 心電圖", "troponin 心肌鈣蛋白", "OPQRST 問診"]
+    citations = rag_service.search_with_citations(queries, k=2)
+
+    assert rag_service.embeddings.calls == [queries]
+    assert [citation.id for citation in citations] == [1, 2, 3]
+    assert [citation.query for citation in citations] == queries
+    assert "ECG Guideline" in citations[0].source
+    assert citations[1].page_number == 3
+
+
+def test_search_returns_formatted_context(rag_service):
+    """單一查詢搜尋應回傳格式化內容"""
+    context = rag_service.search("troponin 心肌鈣蛋白", k=1)
+    assert context.startswith("📚 **Troponin Review**")
+
+
+def test_query_embedding_cache_skips_repeated_queries(rag_service):
+    """重複查詢應命中快取，不再呼叫 embedding 模型"""
+    queries = ["ECG 心電圖", "troponin 心肌鈣蛋白"]
+    rag_service.search_with_citations(queries, k=2)
+    rag_service.search_with_citations(queries + ["OPQRST  問診"], k=2)
+    rag_service.search_with_citations(["OPQRST 問診"], k=2)
+
+    assert rag_service.embeddings.calls == [queries, ["OPQRST  問診"]]
+    assert rag_service.query_cache.hits == 3
+
+
+def test_query_embedding_cache_persists_to_disk(tmp_path):
+    """查詢向量快取應可寫入並重新載入，且只載入同一模型的向量"""
+    from src.services.rag_cache import QueryEmbeddingCache
+
+    cache_path = tmp_path / "query_embedding_cache.npz"
+    cache = QueryEmbeddingCache("model-a", max_size=2, persist_path=cache_path)
+    cache.put("ECG", np.ones(4, dtype=np.float32))
+    cache.put("troponin", np.zeros(4, dtype=np.float32))
+    cache.put("OPQRST", np.full(4, 2.0, dtype=np.float32))
+    assert cache.save()
+
+    reloaded = QueryEmbeddingCache("model-a", max_size=2, persist_path=cache_path)
+    assert len(reloaded) == 2
+    assert reloaded.get("ECG") is None  # 已被 LRU 淘汰
+    assert np.array_equal(reloaded.get(" OPQRST "), np.full(4, 2.0, dtype=np.float32))
+
+    other_model = QueryEmbeddingCache("model-b", persist_path=cache_path)
+    assert len(other_model) == 0
+
+
+def test_query_embedding_cache_saves_in_background_every_n_inserts(tmp_path):
+    """新向量累積到 save_every 筆才在背景寫入，寫入不在 put 的呼叫端執行"""
+    from src.services.rag_cache import QueryEmbeddingCache
+
+    cache_path = tmp_path / "query_embedding_cache.npz"
+    cache = QueryEmbeddingCache("model-a", persist_path=cache_path, save_every=2)
+    cache.put("ECG", np.ones(4, dtype=np.float32))
+    assert cache._saver is None and not cache_path.exists()
+
+    cache.put("troponin", np.zeros(4, dtype=np.float32))
+    assert cache._saver is not None and cache._saver.name == "query-cache-save"
+    cache._saver.join(5)
+    assert len(QueryEmbeddingCache("model-a", persist_path=cache_path)) == 2
+
+
+def test_query_embedding_cache_keeps_changes_until_a_save_succeeds(tmp_path):
+    """略過或失敗的寫入不會清除未寫入狀態；同時呼叫 save 時檔案仍完整"""
+    from concurrent.futures import ThreadPoolExecutor
+    from src.services.rag_cache import QueryEmbeddingCache
+
+    cache_path = tmp_path / "faiss_index" / "query_embedding_cache.npz"
+    cache = QueryEmbeddingCache("model-a", persist_path=cache_path, save_every=0)
+    cache.put("ECG", np.ones(4, dtype=np.float32))
+    assert not cache.save() and cache.dirty
+
+    cache_path.parent.mkdir()
+    for i in range(20):
+        cache.put(f"query {i}", np.full(4, i, dtype=np.float32))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: cache.save(), range(8)))
+    assert results.count(True) == 1 and not cache.dirty
+
+    reloaded = QueryEmbeddingCache("model-a", persist_path=cache_path)
+    assert len(reloaded) == 21 and np.array_equal(reloaded.get("ECG"), np.ones(4, dtype=np.float32))
+
+
+def test_precomputed_results_skip_vector_search(rag_service):
+    """預計算後的固定查詢應直接由記憶體回傳，不再進行向量計算"""
+    queries = ["ECG 心電圖", "troponin 心肌鈣蛋白"]
+    expected = rag_service.search_with_citations(queries, k=2)
+
+    rag_service.query_cache.clear()
+    assert rag_service.precompute_results(queries, k=2) == 2
+    assert rag_service.precompute_results(queries, k=2) == 0
+
+    calls_before = len(rag_service.embeddings.calls)
+    citations = rag_service.search_with_citations(list(reversed(queries)), k=2)
+    context = rag_service.search("ECG 心電圖", k=2)
+
+    assert len(rag_service.embeddings.calls) == calls_before
+    assert [(c.id, c.query) for c in citations] == [(1, queries[1]), (2, queries[0])]
+    assert citations[1].content == expected[0].content
+    assert context.startswith("📚")
+
+
+def test_search_merged_dedups_chunks_across_queries(rag_service):
+    """合併檢索應跨查詢去重，湊滿段落數後不再格式化後面的查詢"""
+    rag_service.settings.rag_min_similarity = -1.0  # 所有候選都通過閾值
+    queries = ["ECG 心電圖", "急性胸痛 ECG", "troponin 心肌鈣蛋白"]
+    formatted = []
+    format_content = rag_service._format_document_content_with_query
+
+    def recording_format(source, content, query, chunk_id=None):
+        formatted.append((query, chunk_id))
+        return format_content(source, content, query, chunk_id)
+
+    rag_service._format_document_content_with_query = recording_format
+
+    sections = rag_service.search_merged(queries, k=1)
+    assert [query for query, _ in sections] == ["ECG 心電圖", "troponin 心肌鈣蛋白"]
+    assert len({chunk_id for _, chunk_id in formatted}) == len(formatted)
+    assert sections[0][1] == rag_service.search("ECG 心電圖", k=1)
+
+    formatted.clear()
+    sections = rag_service.search_merged(queries, k=2, max_sections=1)
+    assert [query for query, _ in sections] == ["ECG 心電圖"]
+    assert {query for query, _ in formatted} == {"ECG 心電圖"}
+
+    # 預計算後依 chunk ID 查表，不再進行向量計算
+    rag_service.precompute_results(queries, k=2)
+    calls_before = len(rag_service.embeddings.calls)
+    assert rag_service.search_merged(queries, k=2, max_sections=1) == sections
+    assert len(rag_service.embeddings.calls) == calls_before
+
+
+def test_precomputed_results_invalidated_by_fingerprint(tmp_path):
+    """索引指紋不同時，磁碟上的預計算結果應失效"""
+    from src.services.rag_cache import RetrievalResultCache, CACHE_MISS
+
+    cache_path = tmp_path / "precomputed_results.json"
+    cache = RetrievalResultCache(persist_path=cache_path)
+    cache.reset("fingerprint-a")
+    cache.put("search", "ECG", 2, "📚 ECG")
+    assert cache.save()
+
+    assert RetrievalResultCache(persist_path=cache_path).load("fingerprint-a")
+    stale = RetrievalResultCache(persist_path=cache_path)
+    assert not stale.load("fingerprint-b")
+    assert stale.get("search", "ECG", 2) is CACHE_MISS
+
+
+def test_background_loading_reports_readiness(tmp_path):
+    """背景載入完成前後應正確回報狀態"""
+    service = RAGService(Settings(faiss_index_dir=tmp_path / "missing_index", rag_background_loading=True))
+    assert service.wait_until_ready(timeout=5) is False
+    assert not service.is_loading()
+    assert service.get_index_info()["status"] == "not_initialized"
+
+
+def test_faiss_engine_matches_langchain_path(rag_service, tmp_path):
+    """FAISS 直接檢索引擎應與 langchain 路徑產生相同的引註"""
+    from src.services.rag_engine import ChunkStore, FaissRetrievalEngine
+
+    queries = ["ECG 心電圖", "troponin 心肌鈣蛋白", "OPQRST 問診"]
+    expected = rag_service.search_with_citations(queries, k=2)
+
+    ChunkStore.from_langchain(rag_service.vector_store).save(tmp_path / "chunk_store")
+    chunk_store = ChunkStore.load(tmp_path / "chunk_store")
+    assert len(chunk_store) == len(DOCUMENTS)
+    assert chunk_store.get(1).text == DOCUMENTS[1][2]
+
+    rag_service.engine = FaissRetrievalEngine(rag_service.vector_store.index, chunk_store)
+    rag_service.vector_store = None
+    citations = rag_service.search_with_citations(queries, k=2)
+
+    assert [c.model_dump() for c in citations] == [c.model_dump() for c in expected]
+
+
+def test_mismatched_chunk_store_falls_back_to_langchain_index(rag_service, tmp_path):
+    """chunk 儲存與 index.faiss 的 chunk 數不一致時，改用 langchain 索引並重新匯出 chunk 儲存"""
+    pytest.importorskip("langchain_community")
+    sys.path.insert(0, str(project_root / "scripts"))
+    from langchain.schema import Document
+    from build_index import create_vector_store
+    from src.services.rag_engine import ChunkStore, CHUNK_STORE_DIRNAME
+
+    chunks = [Document(page_content=text, metadata={"source": source, "page": page}) for source, page, text in DOCUMENTS]
+    store = create_vector_store(chunks, rag_service.vector_store.index, rag_service.embeddings, "l2")
+    store.save_local(str(tmp_path))
+    # 只剩兩個 chunk 的舊 chunk 儲存（例如部分重建中斷）
+    stale = create_vector_store(chunks[:2], faiss.IndexFlatL2(DIMENSION), rag_service.embeddings, "l2")
+    ChunkStore.from_langchain(stale).save(tmp_path / CHUNK_STORE_DIRNAME)
+
+    rag_service.settings = rag_service.settings.model_copy(update={"faiss_index_dir": tmp_path, "rag_engine": "faiss"})
+    engine, vector_store = rag_service._load_index(rag_service.embeddings)
+
+    assert engine is None and vector_store.index.ntotal == len(DOCUMENTS)
+    assert len(ChunkStore.load(tmp_path / CHUNK_STORE_DIRNAME)) == len(DOCUMENTS)
+    engine, vector_store = rag_service._load_index(rag_service.embeddings)
+    assert vector_store is None and len(engine.chunk_store) == len(DOCUMENTS)
+
+
+def test_inner_product_index_matches_l2_index(rag_service):
+    """內積索引以餘弦閾值過濾，結果應與 L2 索引一致"""
+    queries = ["ECG 心電圖", "troponin 心肌鈣蛋白", "OPQRST 問診"]
+    expected = rag_service.search_with_citations(queries, k=2)
+
+    rag_service.query_cache.clear()
+    rag_service.vector_store = build_fake_vector_store(rag_service.embeddings, metric="ip")
+    citations = rag_service.search_with_citations(queries, k=2)
+
+    assert [(c.query, c.source) for c in citations] == [(c.query, c.source) for c in expected]
+    for citation, reference in zip(citations, expected):
+        assert citation.metadata["similarity"] == pytest.approx(reference.metadata["similarity"], abs=1e-4)
+
+
+def test_adaptive_fetch_stops_once_enough_hits_pass(rag_service):
+    """候選足夠時只搜尋一次；閾值內候選不足時才加大 fetch_k"""
+    fetch_sizes = []
+    search_vectors = rag_service._search_vectors
+
+    def recording_search_vectors(query_vectors, fetch_k):
+        fetch_sizes.append(fetch_k)
+        return search_vectors(query_vectors, fetch_k)
+
+    rag_service._search_vectors = recording_search_vectors
+
+    rag_service.settings.rag_min_similarity = -1.0  # 所有候選都通過閾值
+    rag_service._search_filtered(["ECG 心電圖"], k=1)
+    assert fetch_sizes == [1]
+
+    fetch_sizes.clear()
+    rag_service._is_content_relevant = lambda content, query: "troponin" in content
+    results = rag_service._search_filtered(["ECG 心電圖"], k=1)
+    assert fetch_sizes[0] == 1 and len(fetch_sizes) > 1
+    assert results[0][0][0].source.endswith("Troponin_Review.pdf")
+
+
+def test_approximate_indexes_match_flat_search():
+    """HNSW 與 IVF-PQ 索引應可建立並套用搜尋參數；資料過少時 IVF-PQ 退回平面索引"""
+    from src.services.rag_engine import build_faiss_index, configure_search_params, describe_index
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, DIMENSION)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+
+    flat_index = build_faiss_index(vectors, metric="ip")
+    hnsw_index = build_faiss_index(vectors, metric="ip", index_type="hnsw", hnsw_m=8)
+    configure_search_params(hnsw_index, hnsw_ef_search=128, ivf_nprobe=1)
+    _, expected_ids = flat_index.search(vectors[:20], 3)
+    _, hnsw_ids = hnsw_index.search(vectors[:20], 3)
+
+    assert describe_index(hnsw_index) == "hnsw"
+    assert hnsw_index.hnsw.efSearch == 128
+    assert all(set(row) == set(expected) for row, expected in zip(hnsw_ids, expected_ids))
+
+    ivf_index = build_faiss_index(vectors, metric="ip", index_type="ivfpq", ivf_pq_m=4)
+    configure_search_params(ivf_index, hnsw_ef_search=16, ivf_nprobe=4)
+    assert describe_index(ivf_index) == "ivfpq"
+    assert faiss.extract_index_ivf(ivf_index).nprobe == 4
+    assert ivf_index.ntotal == len(vectors)
+
+    assert describe_index(build_faiss_index(vectors[:100], index_type="ivfpq")) == "flat"
+
+
+def test_generate_rag_queries_prioritizes_conversation_topics(rag_service):
+    """對話提到的主題應插入到查詢最前面，且所有查詢都在固定詞彙中"""
+    from src.services.rag_service import get_rag_query_vocabulary
+
+    queries = rag_service.generate_rag_queries("醫師：我幫你做心電圖。請說說你的病史。")
+    assert queries[:4] == [
+        "OSCE history taking skills and guidelines",
+        "OPQRST technique for chest pain history taking",
+        "12-lead ECG interpretation",
+        "ECG electrocardiogram importance in chest pain evaluation",
+    ]
+    assert set(queries) <= set(get_rag_query_vocabulary())
+
+
+def test_mmap_engine_matches_in_memory_engine(rag_service, tmp_path):
+    """記憶體映射載入的檢索引擎應與一般載入產生相同結果"""
+    from src.services.rag_engine import ChunkStore, FaissRetrievalEngine
+
+    faiss.write_index(rag_service.vector_store.index, str(tmp_path / "index.faiss"))
+    ChunkStore.from_langchain(rag_service.vector_store).save(tmp_path / "chunk_store")
+
+    query_vectors = np.asarray(rag_service.embeddings.embed_documents(["ECG 心電圖", "OPQRST 問診"]), dtype=np.float32)
+    expected = FaissRetrievalEngine.load(tmp_path).search_chunks(query_vectors, 3)
+    mapped = FaissRetrievalEngine.load(tmp_path, use_mmap=True)
+
+    assert isinstance(mapped.chunk_store.offsets, np.memmap)
+    assert mapped.search_chunks(query_vectors, 3) == expected
+
+
+def test_precomputed_segments_match_on_the_fly_formatting(rag_service, tmp_path):
+    """預計算的清理與斷句結果應與即時處理產生相同的引註內容"""
+    from src.services.rag_engine import ChunkStore, FaissRetrievalEngine
+    from src.services.rag_segments import SegmentStore, SEGMENTS_DIRNAME
+
+    queries = ["ECG 心電圖", "troponin 心肌鈣蛋白", "OPQRST 問診", "胸痛"]
+    expected = rag_service.search_with_citations(queries, k=2)
+    text = "## 急性胸痛臨床指引\n**重點** 應在10分鐘內完成 ECG。\n\nonset quality  time。其他內容"
+    expected_text = rag_service._format_document_content_with_query("a.pdf", text, "OPQRST 問診")
+
+    chunk_store_dir = tmp_path / "chunk_store"
+    ChunkStore.from_langchain(rag_service.vector_store).save(chunk_store_dir)
+    rag_service.settings = rag_service.settings.model_copy(update={"faiss_index_dir": tmp_path})
+    rag_service.engine = FaissRetrievalEngine(rag_service.vector_store.index, ChunkStore.load(chunk_store_dir))
+    rag_service.vector_store = None
+
+    # 斷句結果不存在時由 chunk 儲存建立並寫回，下次直接載入
+    rag_service.segments = rag_service._load_segments(rag_service.engine)
+    assert SegmentStore.load(chunk_store_dir / SEGMENTS_DIRNAME) is not None
+    rag_service.segments = SegmentStore.load(chunk_store_dir / SEGMENTS_DIRNAME, use_mmap=True)
+
+    citations = rag_service.search_with_citations(queries, k=2)
+    assert [c.model_dump() for c in citations] == [c.model_dump() for c in expected]
+
+    segments = SegmentStore.build([text], ["指引"])
+    rag_service.segments = segments
+    assert rag_service._format_document_content_with_query("a.pdf", text, "OPQRST 問診", 0) == expected_text
+
+    # 每個 chunk 只解碼一次，重複查詢沿用快取的結果
+    assert segments.get(0) is segments.get(0)
+    assert rag_service._format_document_content_with_query("a.pdf", text, "OPQRST 問診", 0) == expected_text
+
+
+def test_segments_are_rebuilt_when_chunk_content_changes(rag_service, tmp_path):
+    """chunk 數相同但內容已更新時，預計算的斷句結果應重新建立而非沿用舊內容"""
+    from src.services.rag_engine import ChunkStore
+    from src.services.rag_segments import SegmentStore, SEGMENTS_DIRNAME
+
+    rag_service.settings = rag_service.settings.model_copy(update={"faiss_index_dir": tmp_path})
+    segments_dir = tmp_path / "chunk_store" / SEGMENTS_DIRNAME
+    old_store = ChunkStore.from_records([("舊版內容：應在10分鐘內完成 ECG。", "a.pdf", 0), ("第二段。", "a.pdf", 1)])
+    SegmentStore.from_chunk_store(old_store, []).save(segments_dir)
+
+    new_store = ChunkStore.from_records([("新版內容：應在5分鐘內完成 ECG。", "a.pdf", 0), ("第二段。", "a.pdf", 1)])
+    assert len(new_store) == len(old_store) and new_store.content_hash() != old_store.content_hash()
+    segments = rag_service._load_segments(SimpleNamespace(chunk_store=new_store))
+    assert segments.get(0).text == "新版內容：應在5分鐘內完成 ECG。"
+    assert SegmentStore.load(segments_dir).is_compatible(segments.title_markers, new_store)
+
+
+def test_bm25_tokenize_and_reciprocal_rank_fusion():
+    """中文切成雙字詞、英數保留整詞；BM25 只返回有詞彙重疊的 chunk；RRF 依排名融合"""
+    from src.services.rag_lexical import BM25Index, reciprocal_rank_fusion, tokenize
+
+    assert tokenize("12-lead ECG 心電圖、痛") == ["12-lead", "ecg", "心電", "電圖", "痛"]
+
+    index = BM25Index.build([text for _, _, text in DOCUMENTS])
+    ids, scores = index.search("troponin 心肌", k=3)
+    assert ids.tolist() == [1] and scores[0] > 0
+    assert index.search("不存在的詞", k=3)[0].size == 0
+
+    fused = reciprocal_rank_fusion([[2, 0], [0, 1]], rrf_k=60)
+    assert [chunk_id for chunk_id, _ in fused] == [0, 2, 1]
+
+
+def test_lexical_index_is_rebuilt_when_chunk_content_changes(rag_service, tmp_path):
+    """BM25 詞彙索引的 chunk 數與向量索引相同但內容不同時，應由目前的 chunk 重新建立"""
+    from src.services.rag_engine import ChunkStore
+    from src.services.rag_lexical import BM25Index, LEXICAL_INDEX_DIRNAME
+
+    rag_service.settings = rag_service.settings.model_copy(update={"faiss_index_dir": tmp_path})
+    stale_texts = [f"舊版內容 {i} obsolete" for i in range(len(DOCUMENTS))]
+    BM25Index.from_chunk_store(
+        ChunkStore.from_records((text, "old.pdf", 0) for text in stale_texts)
+    ).save(tmp_path / LEXICAL_INDEX_DIRNAME)
+
+    lexical_index = rag_service._load_lexical_index(None, rag_service.vector_store)
+    assert len(lexical_index) == len(DOCUMENTS)
+    assert lexical_index.search("obsolete", k=3)[0].size == 0
+    assert lexical_index.search("troponin", k=3)[0].tolist() == [1]
+    assert BM25Index.load(tmp_path / LEXICAL_INDEX_DIRNAME).is_compatible(
+        ChunkStore.from_langchain(rag_service.vector_store)
+    )
+
+
+def test_hybrid_search_surfaces_lexical_matches(rag_service, tmp_path):
+    """混合檢索應補上向量未通過閾值、但詞彙相符的 chunk，並以重建的向量計算分數"""
+    from src.services.rag_engine import ChunkStore, FaissRetrievalEngine
+    from src.services.rag_lexical import BM25Index, LEXICAL_INDEX_DIRNAME
+
+    expected = rag_service.search_with_citations(["troponin 心肌鈣蛋白"], k=1)
+
+    # 沒有向量候選能通過閾值，結果只能來自 BM25
+    rag_service.settings = rag_service.settings.model_copy(
+        update={"faiss_index_dir": tmp_path, "rag_min_similarity": 1.1}
+    )
+    rag_service.lexical_index = rag_service._load_lexical_index(None, rag_service.vector_store)
+    assert BM25Index.load(tmp_path / LEXICAL_INDEX_DIRNAME) is not None
+
+    citations = rag_service.search_with_citations(["troponin 心肌鈣蛋白"], k=1)
+    assert [(c.source, c.content) for c in citations] == [(c.source, c.content) for c in expected]
+    assert citations[0].metadata["score"] == pytest.approx(expected[0].metadata["score"], abs=1e-4)
+
+    # 直接檢索引擎搭配記憶體映射載入的詞彙索引應得到相同結果
+    ChunkStore.from_langchain(rag_service.vector_store).save(tmp_path / "chunk_store")
+    rag_service.engine = FaissRetrievalEngine(rag_service.vector_store.index, ChunkStore.load(tmp_path / "chunk_store"))
+    rag_service.vector_store = None
+    rag_service.lexical_index = BM25Index.load(tmp_path / LEXICAL_INDEX_DIRNAME, use_mmap=True)
+    assert [c.model_dump() for c in rag_service.search_with_citations(["troponin 心肌鈣蛋白"], k=1)] == [
+        c.model_dump() for c in citations
+    ]
+
+
+def test_hybrid_search_keeps_irrelevant_content_filtered(rag_service, tmp_path):
+    """BM25 命中但屬於不相關內容（案例示範）的 chunk，在混合檢索中同樣被排除"""
+    documents = DOCUMENTS + [("documents/Cases/Case3.pdf", 0, "案例3 特雷弗先生的用藥照片。")]
+    rag_service.vector_store = build_fake_vector_store(rag_service.embeddings, documents=documents)
+    rag_service.settings = rag_service.settings.model_copy(
+        update={"faiss_index_dir": tmp_path, "rag_min_similarity": 1.1}
+    )
+    rag_service.lexical_index = rag_service._load_lexical_index(None, rag_service.vector_store)
+
+    # BM25 以「用藥」雙字詞命中案例 chunk，但內容過濾應將其排除
+    assert rag_service.lexical_index.search("用藥史", 3)[0].tolist() == [3]
+    assert rag_service._search_filtered(["用藥史", "troponin 心肌鈣蛋白"], k=2)[0] == []
+    assert [chunk.chunk_id for chunk, _ in rag_service._search_filtered(["troponin 心肌鈣蛋白"], k=2)[0]] == [1]
+
+
+def test_index_manifest_diff_and_persistence(tmp_path):
+    """索引清單應依內容雜湊分出新增、變更、移除的檔案，並可寫入與重新載入"""
+    from src.services.rag_manifest import IndexManifest
+    from src.utils.file_utils import hash_file
+
+    guideline = tmp_path / "guideline.txt"
+    guideline.write_text("ECG within 10 minutes", encoding="utf-8")
+
+    manifest = IndexManifest({"embedding_model": "model-a"})
+    manifest.update_file("guideline.txt", hash_file(guideline), ["id-1", "id-2"])
+    manifest.update_file("old.pdf", "0" * 64, ["id-3"])
+    manifest.update_file("review.md", "1" * 64, ["id-4"])
+    manifest.save(tmp_path / "manifest.json")
+
+    reloaded = IndexManifest.load(tmp_path / "manifest.json")
+    diff = reloaded.diff({
+        "guideline.txt": hash_file(guideline),
+        "review.md": "2" * 64,
+        "new.pdf": "3" * 64,
+    })
+
+    assert reloaded.config == {"embedding_model": "model-a"}
+    assert diff.added == ["new.pdf"]
+    assert diff.changed == ["review.md"]
+    assert diff.removed == ["old.pdf"]
+    assert diff.unchanged == ["guideline.txt"]
+    assert reloaded.chunk_ids(diff.stale) == ["id-4", "id-3"]
+    assert IndexManifest.load(tmp_path / "missing.json") is None
+
+
+def load_fake_pages(path):
+    """假的文件載入：每個檔案兩頁，名稱含 broken 時失敗"""
+    if "broken" in path:
+        raise ValueError("cannot parse")
+    return [SimpleNamespace(page_content=f"{path} page {page}") for page in range(2)]
+
+
+def test_ingestion_pipeline_preserves_file_order_and_counts():
+    """匯入管線應依輸入順序返回各檔案的 chunk 與向量，並略過載入失敗的檔案"""
+    from src.services.rag_ingestion import IngestionPipeline
+
+    embedded_batches = []
+
+    def embed(texts):
+        embedded_batches.append(len(texts))
+        return CountingEmbeddings().embed_documents(texts)
+
+    paths = [f"doc-{i}.pdf" for i in range(6)] + ["broken.pdf"]
+    pipeline = IngestionPipeline(
+        load_fn=load_fake_pages,
+        split_fn=lambda pages: pages,
+        embed_fn=embed,
+        load_workers=3,
+        embed_batch_size=4,
+        queue_size=1,
+        use_processes=False,
+        progress_interval=0
+    )
+    result = pipeline.run(paths)
+
+    assert list(result.file_chunks) == paths[:-1]
+    assert result.failed == ["broken.pdf"]
+    assert max(embedded_batches) == 4 and sum(embedded_batches) == 12
+    assert (result.stats.pages, result.stats.chunks, result.stats.vectors) == (12, 12, 12)
+    expected = np.asarray(CountingEmbeddings().embed_documents(["doc-5.pdf page 1"]), dtype=np.float32)
+    assert np.allclose(result.file_vectors["doc-5.pdf"][1], expected[0])
+
+
+def test_remove_documents_keeps_ivfpq_labels_aligned():
+    """IVF-PQ 向量庫刪除 chunk 後，搜尋結果的位置都能對應到 docstore，增量加入不會重用舊位置"""
+    pytest.importorskip("langchain_community")
+    sys.path.insert(0, str(project_root / "scripts"))
+    from build_index import create_vector_store, remove_documents
+    from src.services.rag_engine import build_faiss_index, describe_index
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, DIMENSION)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    chunks = [SimpleNamespace(page_content=f"chunk {i}", metadata={"source": "doc.pdf", "page": i}) for i in range(2000)]
+    doc_ids = [f"doc-{i}" for i in range(2000)]
+    settings = Settings(rag_index_type="ivfpq", rag_ivf_pq_m=4, rag_index_metric="ip")
+
+    index = build_faiss_index(vectors, metric="ip", index_type="ivfpq", ivf_pq_m=4)
+    store = create_vector_store(chunks, index, CountingEmbeddings(), "ip", doc_ids)
+    removed = doc_ids[:10]
+    store = remove_documents(store, removed, settings)
+
+    assert describe_index(store.index) == "ivfpq"
+    assert store.index.ntotal == len(store.index_to_docstore_id) == 1990
+    assert sorted(store.index_to_docstore_id) == list(range(1990))
+    faiss.extract_index_ivf(store.index).nprobe = 16
+    _, labels = store.index.search(vectors[10:60], 5)
+    assert all(label in store.index_to_docstore_id for label in labels.ravel() if label >= 0)
+    _, self_labels = store.index.search(vectors[10:60], 1)
+    assert [store.index_to_docstore_id[label] for label in self_labels[:, 0]] == doc_ids[10:60]
+
+    # 之後的增量加入從新的位置開始
+    store.add_embeddings([("chunk new", vectors[0].tolist())], ids=["doc-new"])
+    assert store.index_to_docstore_id[1990] == "doc-new"
+    _, new_labels = store.index.search(vectors[:1], 1)
+    assert new_labels[0, 0] == 1990
+
+
+class OCRReader:
+    """固定返回兩行病歷文字的假 EasyOCR Reader"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def readtext(self, image):
+        self.calls += 1
+        return [
+            ([[0, 0], [10, 0], [10, 5], [0, 5]], "病人主訴胸口悶痛已持續約一小時，伴隨冒冷汗與噁心。", 0.95),
+            ([[0, 6], [10, 6], [10, 9], [0, 9]], "到院時心電圖顯示 ST 段上升，需立即啟動心導管團隊。", 0.95),
+        ]
+
+
+@pytest.fixture
+def build_env(monkeypatch, tmp_path):
+    """以暫存目錄、假 embedding 與假 OCR Reader 執行 build_index"""
+    pytest.importorskip("langchain_community")
+    pytest.importorskip("PIL")
+    sys.path.insert(0, str(project_root / "scripts"))
+    import build_index
+    from src.utils import image_processor
+
+    reader = OCRReader()
+    monkeypatch.setattr(image_processor, "_get_easyocr_reader", lambda languages: reader)
+    monkeypatch.setattr(build_index, "_image_processor", image_processor.ImageProcessor(cache_dir=tmp_path / "ocr_cache"))
+    monkeypatch.setattr(build_index, "HuggingFaceEmbeddings", lambda **kwargs: CountingEmbeddings())
+    monkeypatch.setattr(
+        build_index, "RAGService", lambda settings: SimpleNamespace(precompute_results=lambda *args, **kwargs: 0)
+    )
+    monkeypatch.setattr(build_index, "DOCUMENTS_PATH", str(tmp_path / "documents"))
+    monkeypatch.setattr(build_index, "INDEX_PATH", str(tmp_path / "faiss_index"))
+    (tmp_path / "documents").mkdir()
+    return SimpleNamespace(module=build_index, reader=reader, documents=tmp_path / "documents",
+                           index_dir=tmp_path / "faiss_index")
+
+
+def test_build_index_ocrs_images_through_the_batch_path(build_env, monkeypatch):
+    """建立索引時圖片經由 extract_text_batch 辨識，不在匯入管線的載入行程中逐檔 OCR"""
+    from PIL import Image
+    from src.services.rag_engine import ChunkStore, CHUNK_STORE_DIRNAME
+    from src.services.rag_ingestion import IngestionPipeline
+
+    Image.new("L", (40, 20), color=255).save(build_env.documents / "ecg.png")
+    (build_env.documents / "notes.txt").write_text(
+        "胸痛病人應在到院十分鐘內完成十二導程心電圖。\n並抽血檢驗心肌鈣蛋白。", encoding="utf-8"
+    )
+
+    batches = []
+    processor = build_env.module.get_image_processor()
+    extract_text_batch = processor.extract_text_batch
+
+    def record_batch(paths, *args, **kwargs):
+        batches.append(list(paths))
+        return extract_text_batch(paths, *args, **kwargs)
+
+    monkeypatch.setattr(processor, "extract_text_batch", record_batch)
+
+    load_file_documents = build_env.module.load_file_documents
+
+    def load_without_ocr(file):
+        assert Path(file).suffix != ".png", "圖片不應交給管線的載入行程"
+        return load_file_documents(file)
+
+    monkeypatch.setattr(build_env.module, "load_file_documents", load_without_ocr)
+    monkeypatch.setattr(
+        build_env.module, "IngestionPipeline", lambda **kwargs: IngestionPipeline(use_processes=False, **kwargs)
+    )
+    build_env.module.build_index(workers=1)
+
+    assert batches == [[build_env.documents / "ecg.png"]] and build_env.reader.calls == 1
+    store = ChunkStore.load(build_env.index_dir / CHUNK_STORE_DIRNAME)
+    sources = {store.get(i).source for i in range(len(store))}
+    assert sources == {str(build_env.documents / "ecg.png"), str(build_env.documents / "notes.txt")}
+
+
+def test_build_index_clears_the_index_when_all_documents_are_removed(build_env, monkeypatch):
+    """文件資料夾清空後重新建立索引，應刪除舊索引而非繼續提供已移除的文件"""
+    from src.services.rag_engine import CHUNK_STORE_DIRNAME
+    from src.services.rag_ingestion import IngestionPipeline
+    from src.services.rag_manifest import MANIFEST_FILENAME
+
+    monkeypatch.setattr(
+        build_env.module, "IngestionPipeline", lambda **kwargs: IngestionPipeline(use_processes=False, **kwargs)
+    )
+    document = build_env.documents / "notes.txt"
+    document.write_text("胸痛病人應在到院十分鐘內完成十二導程心電圖。\n並抽血檢驗心肌鈣蛋白。", encoding="utf-8")
+    build_env.module.build_index(workers=1)
+    assert (build_env.index_dir / "index.faiss").exists()
+    assert (build_env.index_dir / MANIFEST_FILENAME).exists()
+
+    document.unlink()
+    build_env.module.build_index(workers=1)
+
+    for name in ("index.faiss", "index.pkl", MANIFEST_FILENAME, CHUNK_STORE_DIRNAME):
+        assert not (build_env.index_dir / name).exists()
@@ -0,0 +1,165 @@
+"""
+報告服務測試
+使用假的 AI 與 RAG 服務，驗證詳細報告各階段的重用與逾時處理
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+# 添加src目錄到路徑
+project_root = Path(__file__).parent.parent
+src_path = project_root / "src"
+sys.path.insert(0, str(src_path))
+
+from src.config.settings import get_settings
+from src.models.conversation import Conversation, MessageRole
+from src.models.report import Citation
+from src.services.case_service import CaseService
+from src.services.report_service import ReportService
+
+
+class FailingAIService:
+    """呼叫即失敗的 AI 服務，觸發備用報告"""
+
+    def chat(self, messages, **kwargs):
+        raise RuntimeError("AI 服務無法使用")
+
+
+class StreamingAIService:
+    """逐段返回固定報告內容的 AI 服務"""
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def chat(self, messages, **kwargs):
+        return "".join(self.parts)
+
+    def chat_stream(self, messages, **kwargs):
+        yield from self.parts
+
+
+class FakeRAGService:
+    """可控制檢索延遲的 RAG 服務替身"""
+
+    def __init__(self, release: threading.Event = None):
+        self.release = release
+        self.queries = []
+
+    def register_precompute_queries(self, queries, k):
+        pass
+
+    def wait_until_ready(self, timeout=None):
+        return True
+
+    def is_available(self):
+        return True
+
+    def search_with_citations(self, queries, k=None):
+        self.queries.append(list(queries))
+        if self.release is not None:
+            self.release.wait(5)
+        return [Citation(id=1, query=queries[0], source="ECG Guideline", content="應在10分鐘內完成 ECG。")]
+
+
+def build_report_service(tmp_path, rag_service, ai_service=None, **overrides):
+    settings = get_settings().model_copy(update={"report_history_dir": tmp_path, **overrides})
+    return ReportService(settings, CaseService(settings), ai_service or FailingAIService(), rag_service)
+
+
+def build_conversation():
+    conversation = Conversation(case_id="case_chest_pain_acs_01")
+    conversation.add_message(MessageRole.USER, "請問胸痛什麼時候開始？我先幫你做心電圖 ECG。")
+    conversation.add_message(MessageRole.ASSISTANT, "大概一小時前開始的。")
+    return conversation
+
+
+def test_detailed_report_reuses_basic_analysis_in_fallback(tmp_path):
+    """基本分析只計算一次，LLM 失敗時的備用報告直接沿用"""
+    rag_service = FakeRAGService()
+    service = build_report_service(tmp_path, rag_service)
+
+    calls = []
+    generate_basic_analysis = service._generate_basic_analysis
+
+    def counting_basic_analysis(conversation, case):
+        calls.append(threading.current_thread().name)
+        return generate_basic_analysis(conversation, case)
+
+    service._generate_basic_analysis = counting_basic_analysis
+
+    report = service.generate_detailed_report(build_conversation())
+
+    assert len(calls) == 1 and calls[0].startswith("report-stage")
+    assert rag_service.queries == [report.rag_queries]
+    assert [c.id for c in report.citations] == [1]
+    assert "備用詳細報告" in report.content
+    assert set(report.metadata["stage_timings"]) >= {"case", "basic_analysis", "retrieval", "llm"}
+
+
+def test_detailed_report_continues_without_citations_on_retrieval_timeout(tmp_path):
+    """檢索逾時時不附引註，仍生成報告"""
+    release = threading.Event()
+    service = build_report_service(
+        tmp_path, FakeRAGService(release), rag_ready_timeout=0.0, report_retrieval_timeout=0.05
+    )
+    try:
+        report = service.generate_detailed_report(build_conversation())
+    finally:
+        release.set()
+
+    assert report.citations == []
+    assert report.metadata["citations_count"] == 0
+    assert "未找到相關臨床指引" in report.content
+
+
+class LoadingRAGService(FakeRAGService):
+    """索引仍在背景載入的 RAG 服務替身，等待就緒直到逾時"""
+
+    def __init__(self):
+        super().__init__()
+        self.loaded = threading.Event()
+
+    def wait_until_ready(self, timeout=None):
+        return self.loaded.wait(timeout)
+
+    def is_available(self):
+        return self.loaded.is_set()
+
+
+def test_concurrent_reports_do_not_block_stage_pool_while_index_loads(tmp_path):
+    """多份報告同時等待索引載入時，不佔用執行緒池，其他報告的案例載入與基本分析不會逾時"""
+    service = build_report_service(
+        tmp_path, LoadingRAGService(), report_stage_workers=2, report_stage_timeout=0.3, rag_ready_timeout=0.6
+    )
+    results, errors = [], []
+
+    def generate():
+        try:
+            results.append(service.generate_detailed_report(build_conversation()))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=generate) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert errors == []
+    assert len(results) == 5 and all(report.citations == [] for report in results)
+
+
+def test_iter_detailed_report_streams_stages_and_writes_file_once(tmp_path):
+    """串流報告依序返回各階段與 LLM 片段，完整報告只在最後寫入一次檔案"""
+    parts = ["## 1. 問診表現評估\n", "根據 [引註 1] 的指引，", "應儘早完成 ECG。"]
+    service = build_report_service(tmp_path, FakeRAGService(), StreamingAIService(parts))
+
+    events = list(service.iter_detailed_report(build_conversation()))
+    names = [event for event, _ in events]
+
+    assert names == ["queries", "citations", "llm", "token", "token", "token", "report"]
+    report = events[-1][1]
+    assert "".join(payload for event, payload in events if event == "token") == report.content
+    assert report.content == "".join(parts)
+    assert len(list(tmp_path.iterdir())) == 1